@@ -0,0 +1,154 @@
+import json
+import statistics
+import time
+from collections import deque
+
+
+class ResolutionController:
+    """Подбор размера входа модели и шага кадров под целевую частоту кадров.
+
+    Уровни качества упорядочены от лучшего к самому дешёвому: сначала все
+    размеры sizes (по убыванию) с шагом 1, затем самый маленький размер с
+    шагами strides (модель запускается на каждом stride-м кадре, на
+    остальных используются результаты последнего запуска). Стоимость кадра
+    - медиана задержки инференса за последние window запусков, делённая на
+    шаг. Бюджет кадра - budget от периода 1000 / target_fps мс.
+
+    Гистерезис: уровень понижается, когда стоимость кадра больше бюджета, и
+    повышается, только если прогноз стоимости на следующем уровне (задержка
+    пропорциональна площади входа) меньше up_margin от бюджета. После
+    каждого переключения окно набирается заново. Если после повышения
+    уровень пришлось снова понизить, повторная попытка повышения до него
+    откладывается на retry_after запусков.
+
+    Переключения сохраняются в history и, если задан log_path, дописываются
+    в файл JSON Lines.
+    """
+
+    def __init__(self, name, target_fps, sizes, strides=(1,), initial=None, window=30, budget=0.9, up_margin=0.7,
+                 retry_after=300, multiple_of=1, log_path=None):
+        if target_fps <= 0:
+            raise ValueError(f"Invalid target FPS: {target_fps}")
+        sizes = sorted(set(sizes), reverse=True)
+        strides = sorted(set(strides))
+        if not sizes or strides[0] != 1:
+            raise ValueError("Sizes must be non-empty and strides must start with 1")
+        for size in sizes:
+            if size % multiple_of:
+                raise ValueError(f"Input size {size} is not a multiple of {multiple_of}")
+
+        self.name = name
+        self.target_fps = target_fps
+        self.budget_ms = 1000.0 / target_fps * budget
+        self.up_margin = up_margin
+        self.window = window
+        self.retry_after = retry_after
+        self.log_path = log_path
+        self.levels = [(size, 1) for size in sizes] + [(sizes[-1], stride) for stride in strides[1:]]
+        self.level = sizes.index(initial) if initial in sizes else 0
+
+        self._latencies = deque(maxlen=window)
+        self._countdown = 0
+        self._failed_up = {}
+        self._last_change = None
+        self._level_started = time.perf_counter()
+        self._level_seconds = [0.0] * len(self.levels)
+        self.frames = 0
+        self.inferences = 0
+        self.history = []
+        self._event("start")
+
+    @property
+    def size(self):
+        return self.levels[self.level][0]
+
+    @property
+    def stride(self):
+        return self.levels[self.level][1]
+
+    def step(self):
+        """Новый кадр; True - запускать модель, False - использовать результат последнего запуска."""
+        self.frames += 1
+        if self._countdown > 0:
+            self._countdown -= 1
+            return False
+        self._countdown = self.stride - 1
+        return True
+
+    def frame_cost(self):
+        """Стоимость кадра текущего уровня, мс (None, пока окно не набрано)."""
+        if len(self._latencies) < self.window:
+            return None
+        return statistics.median(self._latencies) / self.stride
+
+    def predicted_cost(self, level):
+        """Прогноз стоимости кадра на уровне level по задержкам текущего уровня."""
+        size, stride = self.levels[level]
+        latency = statistics.median(self._latencies) * (size / self.size) ** 2
+        return latency / stride
+
+    def observe(self, latency_ms):
+        """Задержка очередного запуска модели; возвращает True, если уровень переключился."""
+        self.inferences += 1
+        self._latencies.append(latency_ms)
+        cost = self.frame_cost()
+        if cost is None:
+            return False
+
+        if cost > self.budget_ms and self.level + 1 < len(self.levels):
+            if self._last_change == "up":
+                # Повышение не выдержало нагрузки: следующая попытка - не раньше чем через retry_after запусков
+                self._failed_up[self.level] = self.inferences
+            self._switch(self.level + 1, "slow", cost)
+            return True
+
+        if self.level > 0:
+            target = self.level - 1
+            failed = self._failed_up.get(target)
+            if failed is not None and self.inferences - failed < self.retry_after:
+                return False
+            if self.predicted_cost(target) < self.budget_ms * self.up_margin:
+                self._switch(target, "headroom", cost)
+                return True
+        return False
+
+    def _switch(self, level, reason, cost):
+        now = time.perf_counter()
+        self._level_seconds[self.level] += now - self._level_started
+        self._level_started = now
+        self._last_change = "down" if level > self.level else "up"
+        self.level = level
+        self._latencies.clear()
+        self._countdown = 0
+        self._event(reason, cost)
+
+    def _event(self, reason, cost=None):
+        event = {
+            "time": round(time.time(), 3),
+            "analysis": self.name,
+            "frame": self.frames,
+            "reason": reason,
+            "size": self.size,
+            "stride": self.stride,
+            "frame_ms": round(cost, 2) if cost is not None else None,
+            "budget_ms": round(self.budget_ms, 2),
+        }
+        self.history.append(event)
+        if self.log_path:
+            with open(self.log_path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+    def stats(self):
+        """Текущий уровень, число переключений и доля времени на каждом уровне."""
+        seconds = list(self._level_seconds)
+        seconds[self.level] += time.perf_counter() - self._level_started
+        total = max(sum(seconds), 1e-9)
+        cost = self.frame_cost()
+        return {
+            "size": self.size,
+            "stride": self.stride,
+            "switches": len(self.history) - 1,
+            "frame_ms": round(cost, 2) if cost is not None else None,
+            "levels": {f"{size}/{stride}": round(s / total, 3)
+                       for (size, stride), s in zip(self.levels, seconds) if s > 0},
+        }
@@ -0,0 +1,178 @@
+"""Сравнение бэкендов инференса torch, onnx и onnx-int8: задержка, пиковая память и точность.
+
+ONNX-модели нужно экспортировать заранее:
+    python inference_backends.py --calibration sample.mp4 --int8
+
+Запуск из корня проекта:
+    python benchmarks/bench_backends.py sample.mp4 --target terrain --frames 50
+
+Каждый бэкенд запускается в отдельном процессе, чтобы пиковый RSS не
+смешивался между бэкендами. Точность считается относительно torch:
+для детекторов - полнота и точность совпадения боксов при IoU 0.5,
+для рельефа - попиксельное совпадение и mIoU масок.
+"""
+import argparse
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from inference_backends import BACKENDS, TORCH, sample_frames  # noqa: E402
+from module_mobile_object import DetectionMerger  # noqa: E402
+from terrain_engine import _mean_iou  # noqa: E402
+
+TARGETS = ("mobile", "static", "terrain")
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт КиБ, macOS - байты
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def load_target(target, backend):
+    """Функция инференса кадра для выбранной цели и бэкенда."""
+    if target == "terrain":
+        from terrain_engine import EAGER
+        from terrain_module import TERRAIN_MODEL_PATH, build_terrain_engine
+        engine = build_terrain_engine(TERRAIN_MODEL_PATH, EAGER if backend == TORCH else backend)
+        engine.warmup()
+        return lambda frame: engine.infer(frame).copy()
+
+    from model_ensemble import ModelEnsemble
+    if target == "mobile":
+        from module_mobile_object import MOBILE_MODEL_PATHS as paths
+        imgsz = 608
+    else:
+        from static_object_detection import STATIC_MODEL_PATHS as paths
+        imgsz = 640
+    from model_registry import load_yolo
+    ensemble = ModelEnsemble([load_yolo(path, imgsz, backend=backend) for path in paths], imgsz=imgsz,
+                             concurrent=False)
+
+    def detect(frame):
+        # Боксы каждой модели отдельно: (N, 4) в координатах кадра
+        return [output.boxes for output in ensemble.predict(frame)]
+    return detect
+
+
+def run_worker(target, backend, video, frames, result_path):
+    frames = sample_frames(video, frames)
+    start = time.perf_counter()
+    infer = load_target(target, backend)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    latencies, outputs = [], []
+    for frame in frames:
+        start = time.perf_counter()
+        outputs.append(infer(frame))
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    with open(result_path, "wb") as file:
+        pickle.dump({
+            "load_ms": load_ms,
+            "mean_ms": float(np.mean(latencies)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "peak_rss_mb": peak_rss_mb(),
+            "outputs": outputs,
+        }, file)
+
+
+def detection_agreement(reference, candidate, iou_threshold=0.5):
+    """Полнота и точность боксов candidate относительно reference по всем кадрам и моделям."""
+    iou = DetectionMerger(pixel_offset=False).pairwise_iou
+    matched = total_reference = total_candidate = 0
+    for frame_reference, frame_candidate in zip(reference, candidate):
+        for ref_boxes, cand_boxes in zip(frame_reference, frame_candidate):
+            total_reference += len(ref_boxes)
+            total_candidate += len(cand_boxes)
+            if len(ref_boxes) == 0 or len(cand_boxes) == 0:
+                continue
+            boxes = np.concatenate([ref_boxes, cand_boxes]).astype(np.float32)
+            overlap = iou(boxes)[:len(ref_boxes), len(ref_boxes):]
+            # Каждому эталонному боксу - не больше одного кандидата
+            used = set()
+            for row in overlap:
+                for col in np.argsort(-row):
+                    if row[col] < iou_threshold:
+                        break
+                    if col not in used:
+                        used.add(col)
+                        matched += 1
+                        break
+    return {
+        "recall": matched / total_reference if total_reference else None,
+        "precision": matched / total_candidate if total_candidate else None,
+    }
+
+
+def mask_agreement(reference, candidate):
+    agreement = [float((r == c).mean()) for r, c in zip(reference, candidate)]
+    return {"pixel_agreement": float(np.mean(agreement)), "mean_iou": _mean_iou(candidate, reference)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("video")
+    parser.add_argument("--target", choices=TARGETS, default="terrain")
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.target, args.worker, args.video, args.frames, args.result)
+        return
+
+    backends = [TORCH] + [b for b in args.backends if b != TORCH]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in backends:
+            result_path = Path(tmp) / f"{backend}.pkl"
+            completed = subprocess.run([
+                sys.executable, __file__, args.video, "--target", args.target, "--frames", str(args.frames),
+                "--worker", backend, "--result", str(result_path),
+            ])
+            if completed.returncode != 0:
+                results[backend] = {"error": f"код возврата {completed.returncode}"}
+                continue
+            with open(result_path, "rb") as file:
+                results[backend] = pickle.load(file)
+
+    reference = results[TORCH].get("outputs")
+    if args.target == "terrain":
+        header = f"{'pixel agr':>10} {'mIoU':>6}"
+    else:
+        header = f"{'recall':>7} {'precision':>9}"
+    print(f"{'backend':<10} {'load ms':>8} {'mean ms':>8} {'p95 ms':>8} {'peak MB':>8} {header}")
+    for backend, row in results.items():
+        if "error" in row:
+            print(f"{backend:<10} ошибка: {row['error']}")
+            continue
+        rss = f"{row['peak_rss_mb']:>8.0f}" if row["peak_rss_mb"] is not None else f"{'-':>8}"
+        line = f"{backend:<10} {row['load_ms']:>8.0f} {row['mean_ms']:>8.1f} {row['p95_ms']:>8.1f} {rss}"
+        if reference is None:
+            print(line)
+        elif args.target == "terrain":
+            quality = mask_agreement(reference, row["outputs"])
+            print(f"{line} {quality['pixel_agreement']:>10.4f} {quality['mean_iou']:>6.3f}")
+        else:
+            quality = detection_agreement(reference, row["outputs"])
+            recall = quality["recall"] if quality["recall"] is not None else float("nan")
+            precision = quality["precision"] if quality["precision"] is not None else float("nan")
+            print(f"{line} {recall:>7.3f} {precision:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Сравнение последовательного и параллельного запуска ансамбля YOLO-моделей.
+
+Запуск из корня проекта:
+    python benchmarks/bench_ensemble.py video.mp4 --mode mobile --frames 100
+"""
+import argparse
+import sys
+from pathlib import Path
+
+import cv2
+from ultralytics import YOLO
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from model_ensemble import ModelEnsemble  # noqa: E402
+
+MODEL_FILES = {
+    "mobile": ("mobile_models", ["fox.pt", "people.pt", "rabbit.pt"], 608),
+    "static": ("static_models", ["tree.pt", "stone.pt", "bush.pt"], 640),
+}
+
+
+def load_models(mode):
+    folder, files, imgsz = MODEL_FILES[mode]
+    models_dir = Path(__file__).resolve().parent.parent / "models" / folder
+    models = [YOLO(str(models_dir / name)) for name in files]
+    for model in models:
+        model.fuse()
+    return models, [Path(name).stem for name in files], imgsz
+
+
+def run(video_path, ensemble, frames):
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise Exception("Error: Could not open video file.")
+    ensemble.reset_stats()
+    for _ in range(frames):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        ensemble.predict(frame)
+    cap.release()
+    return ensemble.latency_report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("video")
+    parser.add_argument("--mode", choices=sorted(MODEL_FILES), default="mobile")
+    parser.add_argument("--frames", type=int, default=100)
+    args = parser.parse_args()
+
+    models, names, imgsz = load_models(args.mode)
+    variants = [
+        ("sequential", dict(concurrent=False, reuse_letterbox=False)),
+        ("sequential+letterbox", dict(concurrent=False, reuse_letterbox=True)),
+        ("concurrent+letterbox", dict(concurrent=True, reuse_letterbox=True)),
+    ]
+    baseline_ms = None
+    for title, options in variants:
+        ensemble = ModelEnsemble(models, imgsz=imgsz, names=names, **options)
+        report = run(args.video, ensemble, args.frames)
+        ensemble.close()
+        baseline_ms = baseline_ms or report["total_ms"]
+        per_model = ", ".join(f"{name} {ms:.1f}" for name, ms in report["per_model_ms"].items())
+        print(f"{title:<22} total {report['total_ms']:7.1f} ms/frame "
+              f"(x{baseline_ms / report['total_ms']:.2f}) | {per_model}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Микро-бенчмарк DetectionMerger: масштабирование от 10 до 5000 боксов.
+
+Запуск из корня проекта:
+    python benchmarks/bench_merger.py
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from module_mobile_object import DetectionMerger  # noqa: E402
+
+CLASS_NAMES = ["fox", "person", "rabbit"]
+
+
+def legacy_merge(detections, iou_threshold=0.5):
+    # Исходная реализация с двойным циклом - для сравнения
+    merged_boxes = []
+    for detection in detections:
+        x1, y1, x2, y2, score, obj_id, class_name = detection
+        add_new = True
+        for i, merged_box in enumerate(merged_boxes):
+            mx1, my1, mx2, my2, mscore, mid, mclass_name = merged_box
+            inter_area = max(0, min(x2, mx2) - max(x1, mx1) + 1) * max(0, min(y2, my2) - max(y1, my1) + 1)
+            box_area = (x2 - x1 + 1) * (y2 - y1 + 1)
+            merged_area = (mx2 - mx1 + 1) * (my2 - my1 + 1)
+            iou = inter_area / float(box_area + merged_area - inter_area)
+            if iou > iou_threshold:
+                if score > mscore:
+                    merged_boxes[i] = [x1, y1, x2, y2, score, obj_id, class_name]
+                add_new = False
+                break
+        if add_new:
+            merged_boxes.append([x1, y1, x2, y2, score, obj_id, class_name])
+    return merged_boxes
+
+
+def make_detections(count, rng, width=1920, height=1080):
+    # Боксы группами по три - имитация одного объекта, найденного тремя моделями
+    centers = rng.uniform((0, 0), (width, height), size=(count // 3 + 1, 2))
+    sizes = rng.uniform(20, 200, size=(len(centers), 2))
+    detections = []
+    for i in range(count):
+        (cx, cy), (w, h) = centers[i // 3], sizes[i // 3]
+        jitter = rng.normal(0, 4, size=4)
+        x1, y1 = int(cx - w / 2 + jitter[0]), int(cy - h / 2 + jitter[1])
+        x2, y2 = int(cx + w / 2 + jitter[2]), int(cy + h / 2 + jitter[3])
+        detections.append([x1, y1, x2, y2, float(rng.uniform(0.7, 1.0)), i, CLASS_NAMES[i % 3]])
+    return detections
+
+
+def measure(func, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 100, 500, 1000, 2000, 5000])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--legacy-limit", type=int, default=2000,
+                        help="не запускать исходную реализацию на большем числе боксов")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    merger = DetectionMerger(iou_threshold=0.5)
+    class_merger = DetectionMerger(iou_threshold=0.5, class_aware=True)
+
+    print(f"{'boxes':>6} {'legacy ms':>10} {'list ms':>9} {'array ms':>9} {'per-class ms':>13} {'kept':>6}")
+    for size in args.sizes:
+        detections = make_detections(size, rng)
+        boxes, class_codes, _ = merger.to_array(detections)
+
+        legacy_ms = measure(lambda: legacy_merge(detections), args.repeats) if size <= args.legacy_limit else float("nan")
+        list_ms = measure(lambda: merger.merge_detections(detections), args.repeats)
+        array_ms = measure(lambda: merger.merge_array(boxes, class_codes), args.repeats)
+        class_ms = measure(lambda: class_merger.merge_array(boxes, class_codes), args.repeats)
+        kept = len(merger.merge_array(boxes, class_codes))
+        print(f"{size:>6} {legacy_ms:>10.2f} {list_ms:>9.2f} {array_ms:>9.2f} {class_ms:>13.2f} {kept:>6}")
+
+
+if __name__ == "__main__":
+    main()
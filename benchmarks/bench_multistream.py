@@ -0,0 +1,80 @@
+"""Масштабирование пакетного инференса по числу видеопотоков.
+
+Запуск из корня проекта:
+    python benchmarks/bench_multistream.py --streams 1 2 4 --duration 10
+    python benchmarks/bench_multistream.py --models real --policy deadline --latency-target 150
+
+Каждый поток - отдельное синтетическое видео, читаемое в темпе его FPS;
+все готовые кадры идут в один вызов каждой модели. Выводится суммарная
+пропускная способность, FPS на поток, средний размер пакета и p95
+задержки; scaling - отношение к пропускной способности первого числа
+потоков. Без весов в models/ используются модели-заглушки, у которых
+каждый следующий кадр пакета стоит --batch-cost от задержки одиночного вызова.
+"""
+import argparse
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from module_mobile_object import MOBILE_MODEL_PATHS  # noqa: E402
+from multistream import DEADLINE, ROUND_ROBIN, StreamSource, scaling_report  # noqa: E402
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from synthetic import StubYOLO, make_synthetic_video  # noqa: E402
+
+MOBILE_CLASSES = ["fox", "person", "rabbit"]
+
+
+def load_detectors(kind, stub_latency_ms, batch_cost):
+    real = kind == "real" or (kind == "auto" and all(Path(p).exists() for p in MOBILE_MODEL_PATHS))
+    if real:
+        from model_registry import load_yolo
+        return [load_yolo(path, imgsz=608) for path in MOBILE_MODEL_PATHS], "real"
+    return [StubYOLO(name, stub_latency_ms, imgsz=608, seed=i, batch_cost=batch_cost)
+            for i, name in enumerate(MOBILE_CLASSES)], "stub"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=10.0, help="секунд на каждое число потоков")
+    parser.add_argument("--size", default="1280x720")
+    parser.add_argument("--fps", type=float, default=25.0)
+    parser.add_argument("--models", choices=["auto", "real", "stub"], default="auto")
+    parser.add_argument("--stub-latency", type=float, default=15.0, help="мс на вызов модели-заглушки")
+    parser.add_argument("--batch-cost", type=float, default=0.25)
+    parser.add_argument("--policy", choices=[ROUND_ROBIN, DEADLINE], default=ROUND_ROBIN)
+    parser.add_argument("--max-batch", type=int, default=None)
+    parser.add_argument("--latency-target", type=float, default=None, help="целевая задержка потока, мс")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    models, kind = load_detectors(args.models, args.stub_latency, args.batch_cost)
+    frames = int(args.duration * args.fps) + 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        videos = [make_synthetic_video(Path(tmp) / f"stream{i}.mp4", (width, height), frames=frames,
+                                       fps=args.fps, seed=i) for i in range(max(args.streams))]
+
+        def make_sources(count):
+            return [StreamSource(str(videos[i]), name=f"stream{i}") for i in range(count)]
+
+        targets = None
+        if args.latency_target is not None:
+            targets = {f"stream{i}": args.latency_target for i in range(max(args.streams))}
+        rows = scaling_report(models, make_sources, args.streams, duration_s=args.duration,
+                              max_batch=args.max_batch, policy=args.policy, latency_targets=targets)
+
+    print(f"models: {kind}, policy: {args.policy}, {args.size} @ {args.fps:g} FPS")
+    print(f"{'streams':>7} {'total FPS':>10} {'FPS/stream':>11} {'batch':>6} {'p95 ms':>8} {'scaling':>8}")
+    for row in rows:
+        scaling = f"{row['scaling']:.2f}x" if row["scaling"] is not None else "-"
+        print(f"{row['streams']:>7} {row['throughput_fps']:>10.1f} {row['per_stream_fps']:>11.1f} "
+              f"{row['mean_batch']:>6.2f} {row['latency_p95_ms']:>8.1f} {scaling:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""Воспроизводимый набор бенчмарков по стадиям конвейера на синтетических видео.
+
+Запуск из корня проекта:
+    python benchmarks/bench_suite.py --output results.json
+    python benchmarks/bench_suite.py --baseline benchmarks/baseline.json --tolerance 0.2
+    python benchmarks/bench_suite.py --save-baseline benchmarks/baseline.json
+
+Для каждой комбинации разрешения и плотности объектов генерируется
+синтетическое видео, и каждая стадия (декодирование, letterbox, каждая
+модель, DetectionMerger, отрисовка, сегментация рельефа, раскраска,
+конвертация для Tk) измеряется отдельно: мс/кадр и пиковая память
+(tracemalloc, отдельным проходом, чтобы не искажать время). С --models
+auto используются настоящие веса, если они есть, иначе - заглушки с
+заданной задержкой (benchmarks/synthetic.py). Сравнение с базовой линией
+завершается с кодом 1, если какая-либо стадия стала медленнее или
+прожорливее больше чем на tolerance.
+"""
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from model_ensemble import ModelEnsemble  # noqa: E402
+from presenter import TkPresenter  # noqa: E402
+from module_mobile_object import MOBILE_MODEL_PATHS, DetectionMerger, VideoProcessor  # noqa: E402
+from terrain_module import TERRAIN_MODEL_PATH, RealTimeVideoProcessor  # noqa: E402
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from synthetic import StubSegmentationModel, StubYOLO, make_synthetic_video  # noqa: E402
+
+RESOLUTIONS = ["640x360", "1280x720", "1920x1080"]
+DENSITIES = [2, 10, 50]
+MOBILE_CLASSES = ["fox", "person", "rabbit"]
+# Показатели меньше этих порогов считаются шумом при сравнении с базовой линией
+MIN_MS = 0.05
+MIN_KIB = 64
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def measure(step, count, memory_frames=3):
+    """Время стадии (мс/кадр) и пиковая память одного прохода (КиБ)."""
+    step(0)  # прогрев и выделение переиспользуемых буферов
+    start = time.perf_counter()
+    for index in range(count):
+        step(index)
+    ms = (time.perf_counter() - start) * 1000 / count
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    for index in range(min(memory_frames, count)):
+        step(index)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"ms": ms, "peak_kib": (peak - baseline) / 1024}
+
+
+def load_models(kind, density, stub_latency_ms, stub_terrain_ms):
+    """Детекторы мобильных объектов и модель рельефа: настоящие или заглушки."""
+    weights = list(MOBILE_MODEL_PATHS) + [TERRAIN_MODEL_PATH]
+    real = kind == "real" or (kind == "auto" and all(Path(p).exists() for p in weights))
+    if real:
+        from model_registry import load_yolo
+        from terrain_module import build_terrain_engine
+        detectors = [load_yolo(path, imgsz=608) for path in MOBILE_MODEL_PATHS]
+        return "real", detectors, build_terrain_engine(TERRAIN_MODEL_PATH)
+
+    detectors = [
+        StubYOLO(Path(path).stem, stub_latency_ms, density, imgsz=608, seed=i, class_name=MOBILE_CLASSES[i])
+        for i, path in enumerate(MOBILE_MODEL_PATHS)
+    ]
+    return "stub", detectors, StubSegmentationModel(stub_terrain_ms)
+
+
+def decode_frames(video_path):
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        raise Exception("Error: Could not open video file.")
+    frames = []
+    start = time.perf_counter()
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    cap.release()
+    return frames, elapsed_ms / max(len(frames), 1)
+
+
+def tk_converter():
+    """Вывод кадра на холст через TkPresenter, если доступен дисплей, иначе только подготовка."""
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+        root.withdraw()
+        presenter = TkPresenter(tk.Canvas(root, width=800, height=600), root)
+    except Exception:
+        presenter = TkPresenter(None, None)
+
+    def convert(frame):
+        rgb = presenter.prepare(frame)
+        if presenter.canvas is not None:
+            presenter.show(rgb)
+        else:
+            Image.fromarray(rgb)
+    return convert, presenter.canvas is not None
+
+
+def run_configuration(video_path, models, frames_limit, converter):
+    frames, decode_ms = decode_frames(video_path)
+    frames = frames[:frames_limit]
+    count = len(frames)
+    _, detectors, terrain = models
+    stages = {"decode": {"ms": decode_ms, "peak_kib": None}}
+
+    # Детекторы: letterbox и каждая модель последовательно, чтобы задержки не перекрывались
+    merger = DetectionMerger(iou_threshold=0.5)
+    processor = VideoProcessor(detectors, merger)
+    processor.ensemble.concurrent = False
+    processor.reset_tracking()
+    stages["letterbox"] = measure(lambda i: processor.ensemble.letterbox(frames[i]), count)
+    for index, detector in enumerate(detectors):
+        single = ModelEnsemble([detector], imgsz=processor.ensemble.imgsz, names=[processor.ensemble.names[index]])
+        row = measure(lambda i: single.track(frames[i], iou=0.4, conf=0.7, persist=True), count)
+        row["ms"] = single.latency_report()["per_model_ms"][single.names[0]]
+        stages[f"model:{single.names[0]}"] = row
+
+    # Объединение и отрисовка на заранее полученных детекциях
+    raw = []
+    for frame in frames:
+        detections = []
+        for output in processor.ensemble.track(frame, iou=0.4, conf=0.7, persist=True):
+            if output.ids is None:
+                continue
+            for box, score, obj_id, class_id in zip(output.boxes.astype(int), output.scores, output.ids,
+                                                    output.class_ids):
+                detections.append([*box, score, obj_id, output.names[class_id]])
+        raw.append(detections)
+    merged = [merger.merge_detections(detections) for detections in raw]
+    stages["merge"] = measure(lambda i: merger.merge_detections(raw[i]), count)
+    canvases = [frame.copy() for frame in frames]
+    stages["draw"] = measure(lambda i: processor.annotate(canvases[i], merged[i], i / 25.0), count)
+
+    # Рельеф: препроцессинг, модель, argmax, раскраска с наложением
+    if isinstance(terrain, StubSegmentationModel):
+        terrain_processor = RealTimeVideoProcessor(terrain)
+    else:
+        terrain_processor = RealTimeVideoProcessor(terrain.model, engine=terrain)
+    engine = terrain_processor.engine
+    resized = [terrain_processor.standardize_frame(frame) for frame in frames]
+    stages["terrain_preprocess"] = measure(lambda i: engine.preprocess(resized[i]), count)
+    with torch.inference_mode():
+        stages["model:terrain"] = measure(lambda i: engine.model(engine.preprocess(resized[i])), count)
+        logits = engine.model(engine.preprocess(resized[0]))["out"][0]
+        stages["terrain_postprocess"] = measure(lambda i: engine.postprocess(logits), count)
+        mask = engine.postprocess(logits).copy()
+    height, width = resized[0].shape[:2]
+    stages["colorize"] = measure(lambda i: terrain_processor.render(resized[i], mask, width, height), count)
+
+    convert, with_tk = converter
+    stages["tk_convert" if with_tk else "pil_convert"] = measure(lambda i: convert(frames[i]), count)
+    return {"frames": count, "stages": stages}
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Регрессии относительно базовой линии: список (конфигурация, стадия, метрика, было, стало)."""
+    regressions = []
+    for config, current in results["configurations"].items():
+        reference = baseline.get("configurations", {}).get(config)
+        if reference is None:
+            continue
+        for stage, row in current["stages"].items():
+            before = reference["stages"].get(stage)
+            if before is None:
+                continue
+            for metric, floor in (("ms", MIN_MS), ("peak_kib", MIN_KIB)):
+                old, new = before.get(metric), row.get(metric)
+                if old is None or new is None:
+                    continue
+                if new > max(old, floor) * (1 + tolerance):
+                    regressions.append((config, stage, metric, old, new))
+    return regressions
+
+
+def format_table(results):
+    lines = []
+    for config, current in results["configurations"].items():
+        lines.append(f"{config} ({current['frames']} кадров)")
+        for stage, row in current["stages"].items():
+            peak = f"{row['peak_kib']:>10.0f}" if row["peak_kib"] is not None else f"{'-':>10}"
+            lines.append(f"  {stage:<22} {row['ms']:>9.2f} ms {peak} KiB")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--resolutions", nargs="+", default=RESOLUTIONS)
+    parser.add_argument("--densities", type=int, nargs="+", default=DENSITIES)
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--models", choices=["auto", "real", "stub"], default="auto")
+    parser.add_argument("--stub-latency", type=float, default=15.0, help="задержка заглушки детектора, мс")
+    parser.add_argument("--stub-terrain-latency", type=float, default=40.0,
+                        help="задержка заглушки модели рельефа, мс")
+    parser.add_argument("--output", "-o", help="JSON с результатами")
+    parser.add_argument("--baseline", help="JSON базовой линии для сравнения")
+    parser.add_argument("--save-baseline", help="сохранить результаты как базовую линию")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимый рост относительно базовой линии")
+    args = parser.parse_args(argv)
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "frames": args.frames,
+        },
+        "configurations": {},
+    }
+    converter = tk_converter()
+    with tempfile.TemporaryDirectory() as tmp:
+        for density in args.densities:
+            models = load_models(args.models, density, args.stub_latency, args.stub_terrain_latency)
+            results["meta"]["models"] = models[0]
+            for resolution in args.resolutions:
+                size = parse_size(resolution)
+                video = make_synthetic_video(Path(tmp) / f"{resolution}-{density}.mp4", size, density, args.frames)
+                config = f"{resolution}-d{density}"
+                results["configurations"][config] = run_configuration(video, models, args.frames, converter)
+
+    print(format_table(results))
+    for path in (args.output, args.save_baseline):
+        if path:
+            Path(path).write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        if baseline.get("meta", {}).get("models") != results["meta"]["models"]:
+            print("Базовая линия снята с другими моделями; сравнение может быть некорректным")
+        regressions = compare(results, baseline, args.tolerance)
+        for config, stage, metric, old, new in regressions:
+            print(f"РЕГРЕССИЯ {config} {stage} {metric}: {old:.2f} -> {new:.2f}")
+        if regressions:
+            return 1
+        print("Регрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
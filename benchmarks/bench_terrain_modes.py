@@ -0,0 +1,61 @@
+"""Точность и задержка режимов инференса модели рельефа на образце видео.
+
+Запуск из корня проекта:
+    python benchmarks/bench_terrain_modes.py sample.mp4 --frames 50 --modes eager script int8
+"""
+import argparse
+import sys
+from pathlib import Path
+
+import cv2
+import torch
+from torchvision.models.segmentation import deeplabv3_mobilenet_v3_large
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from terrain_engine import TORCH_MODES, accuracy_latency_report  # noqa: E402
+
+MODEL_PATH = Path(__file__).resolve().parent.parent / "models" / "terrain_model" / "terrain.pth"
+
+
+def load_model():
+    model = deeplabv3_mobilenet_v3_large(num_classes=7)
+    model.load_state_dict(torch.load(MODEL_PATH, map_location=torch.device('cpu')))
+    return model.eval()
+
+
+def read_frames(video_path, count, size):
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise Exception("Error: Could not open video file.")
+    frames = []
+    while len(frames) < count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(cv2.resize(frame, size, interpolation=cv2.INTER_AREA))
+    cap.release()
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("video")
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--modes", nargs="+", choices=TORCH_MODES, default=list(TORCH_MODES))
+    args = parser.parse_args()
+
+    frames = read_frames(args.video, args.frames, (512, 512))
+    report = accuracy_latency_report(load_model, frames, modes=args.modes)
+
+    print(f"{'mode':<8} {'load ms':>8} {'mean ms':>8} {'p95 ms':>8} {'pixel agr':>10} {'mIoU':>6}")
+    for mode, row in report.items():
+        if "error" in row:
+            print(f"{mode:<8} ошибка: {row['error']}")
+            continue
+        print(f"{mode:<8} {row['load_ms']:>8.0f} {row['mean_ms']:>8.1f} {row['p95_ms']:>8.1f} "
+              f"{row['pixel_agreement']:>10.4f} {row['mean_iou']:>6.3f}")
+
+
+if __name__ == "__main__":
+    main()
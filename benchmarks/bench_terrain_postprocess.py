@@ -0,0 +1,83 @@
+"""Постобработка сегментации рельефа: время и выделения памяти на кадр до и после LUT.
+
+Запуск из корня проекта:
+    python benchmarks/bench_terrain_postprocess.py --frames 200
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import cv2
+import numpy as np
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from terrain_module import TERRAIN_CLASSES, RealTimeVideoProcessor  # noqa: E402
+
+LEGACY_PALETTE = {
+    0: (0, 255, 255),
+    1: (255, 255, 0),
+    2: (255, 0, 255),
+    3: (0, 255, 0),
+    4: (255, 0, 64),
+    5: (255, 255, 255),
+    6: (0, 0, 0),
+}
+
+
+def legacy_postprocess(logits, frame, width, height):
+    # Исходная реализация: argmax по float-логитам, словарь палитры и семь проходов масками
+    output = torch.argmax(logits, dim=0).cpu().numpy()
+    color_mask = np.zeros((output.shape[0], output.shape[1], 3), dtype=np.uint8)
+    for class_idx, color in LEGACY_PALETTE.items():
+        color_mask[output == class_idx] = color
+    segmented_mask = cv2.resize(color_mask, (width, height), interpolation=cv2.INTER_NEAREST)
+    return cv2.addWeighted(frame, 0.7, segmented_mask, 0.3, 0)
+
+
+def measure(step, frames):
+    step()  # прогрев и выделение переиспользуемых буферов
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start_snapshot = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    for _ in range(frames):
+        step()
+    elapsed_ms = (time.perf_counter() - start) * 1000 / frames
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed_ms, (peak - start_snapshot) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--size", type=int, default=512)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    size = args.size
+    logits = torch.from_numpy(rng.standard_normal((len(TERRAIN_CLASSES), size, size), dtype=np.float32))
+    frame = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+
+    # Модель не вызывается: измеряется только постобработка логитов
+    processor = RealTimeVideoProcessor(MagicMock(), target_size=(size, size))
+
+    def current_step():
+        with torch.inference_mode():
+            mask = processor.engine.postprocess(logits)
+        processor.render(frame, mask, size, size)
+
+    legacy_ms, legacy_kb = measure(lambda: legacy_postprocess(logits, frame, size, size), args.frames)
+    current_ms, current_kb = measure(current_step, args.frames)
+    print(f"{'variant':<8} {'ms/frame':>9} {'peak numpy KiB':>15}")
+    print(f"{'legacy':<8} {legacy_ms:>9.2f} {legacy_kb:>15.0f}")
+    print(f"{'lut':<8} {current_ms:>9.2f} {current_kb:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Длительный прогон хранилища треков: память не должна расти с числом выданных id.
+
+Запуск из корня проекта (3 часа видео 25 FPS, новый id каждые 5 кадров):
+    python benchmarks/soak_tracks.py --hours 3
+"""
+import argparse
+import sys
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from module_mobile_object import DetectionMerger, VideoProcessor  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=float, default=3.0)
+    parser.add_argument("--fps", type=float, default=25.0)
+    parser.add_argument("--visible", type=int, default=10, help="одновременно видимых объектов")
+    parser.add_argument("--id-every", type=int, default=5, help="новый id трека каждые N кадров")
+    parser.add_argument("--report-every", type=float, default=0.25, help="отчёт каждые N часов")
+    args = parser.parse_args()
+
+    processor = VideoProcessor(models=[], merger=DetectionMerger())
+    frame = np.zeros((720, 1280, 3), dtype=np.uint8)
+    total = int(args.hours * 3600 * args.fps)
+    report_every = max(int(args.report_every * 3600 * args.fps), 1)
+
+    tracemalloc.start()
+    print(f"{'hours':>6} {'ids':>8} {'live':>5} {'store KiB':>10} {'traced KiB':>11}")
+    for index in range(total):
+        first = index // args.id_every
+        detections = [[100, 100, 140, 160, 0.9, track_id, "fox"] for track_id in range(first, first + args.visible)]
+        processor.annotate(frame, detections, index / args.fps)
+        if (index + 1) % report_every == 0:
+            traced = tracemalloc.get_traced_memory()[0]
+            print(f"{(index + 1) / args.fps / 3600:>6.2f} {first + args.visible:>8} {len(processor.tracks):>5} "
+                  f"{processor.tracks.nbytes / 1024:>10.1f} {traced / 1024:>11.0f}")
+    tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    main()
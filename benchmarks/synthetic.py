@@ -0,0 +1,124 @@
+"""Синтетические видео и детерминированные модели-заглушки для бенчмарков.
+
+Заглушки повторяют интерфейс, которым пользуется проект: StubYOLO - как
+ultralytics.YOLO для ModelEnsemble (predict/track, results[0].boxes с
+тензорами xyxy/conf/cls/id, names), StubSegmentationModel - как модель
+сегментации torchvision (model(x)["out"]). Задержка задаётся в мс и
+выдерживается через time.sleep, поэтому, как и настоящий инференс,
+не держит GIL; результаты зависят только от seed и номера вызова.
+"""
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+
+
+def make_synthetic_video(path, size=(1280, 720), density=10, frames=100, fps=25.0, seed=0):
+    """MP4 с density движущимися прямоугольниками на текстурированном фоне."""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    background = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (0, 0), 3)
+    scale = min(width, height)
+    sizes = rng.uniform(0.05, 0.2, size=(density, 2)) * scale
+    positions = rng.uniform(0, 1, size=(density, 2)) * (width, height)
+    velocities = rng.uniform(-4, 4, size=(density, 2)) * scale / 360
+    colors = rng.integers(0, 256, size=(density, 3))
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    if not writer.isOpened():
+        raise Exception("Error: Could not open video writer.")
+    # Медленный сдвиг фона имитирует движение камеры
+    for index in range(frames):
+        frame = np.roll(background, index, axis=1)
+        centers = (positions + velocities * index) % (width, height)
+        for (cx, cy), (w, h), color in zip(centers, sizes, colors):
+            cv2.rectangle(frame, (int(cx - w / 2), int(cy - h / 2)), (int(cx + w / 2), int(cy + h / 2)),
+                          tuple(int(c) for c in color), -1)
+        writer.write(frame)
+    writer.release()
+    return Path(path)
+
+
+class _StubBoxes:
+    def __init__(self, xyxy, conf, cls, ids):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+        self.id = ids
+
+    def __len__(self):
+        return len(self.xyxy)
+
+
+class _StubResult:
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+
+class StubYOLO:
+    """Детектор-заглушка: density объектов, равномерно движущихся по входу imgsz x imgsz."""
+
+    def __init__(self, name, latency_ms=15.0, density=10, imgsz=640, seed=0, class_name=None, batch_cost=0.25):
+        self.ckpt_path = f"{name}.pt"
+        self.names = {0: class_name or name}
+        self.latency_ms = latency_ms
+        # Доля latency_ms на каждый следующий кадр пакета: пакет дешевле отдельных вызовов
+        self.batch_cost = batch_cost
+        self.imgsz = imgsz
+        self.calls = 0
+        rng = np.random.default_rng(seed)
+        self._sizes = rng.uniform(0.05, 0.2, size=(density, 2)) * imgsz
+        self._positions = rng.uniform(0, imgsz, size=(density, 2))
+        self._velocities = rng.uniform(-3, 3, size=(density, 2))
+        self._scores = rng.uniform(0.75, 0.99, size=density).astype(np.float32)
+
+    def _boxes(self):
+        centers = (self._positions + self._velocities * self.calls) % self.imgsz
+        boxes = np.concatenate([centers - self._sizes / 2, centers + self._sizes / 2], axis=1)
+        return np.clip(boxes, 0, self.imgsz - 1).astype(np.float32)
+
+    def predict(self, source, **kwargs):
+        # Тензор Bx3xSxS - пакет из B кадров, один результат на кадр
+        size = source.shape[0] if isinstance(source, torch.Tensor) and source.dim() == 4 else 1
+        time.sleep(self.latency_ms * (1 + self.batch_cost * (size - 1)) / 1000)
+        results = []
+        for _ in range(size):
+            boxes = self._boxes()
+            self.calls += 1
+            count = len(boxes)
+            results.append(_StubResult(_StubBoxes(
+                torch.from_numpy(boxes),
+                torch.from_numpy(self._scores),
+                torch.zeros(count),
+                torch.arange(1, count + 1),
+            )))
+        return results
+
+    track = predict
+
+    def fuse(self):
+        return self
+
+
+class StubSegmentationModel(torch.nn.Module):
+    """Модель сегментации-заглушка: фиксированные логиты под размер входа."""
+
+    def __init__(self, latency_ms=40.0, num_classes=7, seed=0):
+        super().__init__()
+        self.latency_ms = latency_ms
+        self.num_classes = num_classes
+        self.seed = seed
+        self._logits = {}
+
+    def forward(self, x):
+        time.sleep(self.latency_ms / 1000)
+        shape = (1, self.num_classes, x.shape[2], x.shape[3])
+        if shape not in self._logits:
+            generator = torch.Generator().manual_seed(self.seed)
+            # Крупные однородные области, как у реальной маски рельефа
+            coarse = torch.randn((1, self.num_classes, 16, 16), generator=generator)
+            self._logits[shape] = torch.nn.functional.interpolate(coarse, size=shape[2:], mode="nearest")
+        return {"out": self._logits[shape]}
@@ -0,0 +1,307 @@
+"""Бинарный журнал результатов анализа (.rslog) с произвольным доступом к кадрам.
+
+Формат файла:
+    MAGIC
+    блоки по chunk_frames кадров: строки детекций блока (DETECTION_DTYPE),
+        затем сжатые zlib маски рельефа кадров блока (uint8, H x W) и
+        сетки вероятностей классов рельефа (uint8, 0..255, rows x cols x C),
+        доли классов рельефа кадров (float32, по meta["terrain_classes"])
+    таблица кадров (FRAME_DTYPE): смещения детекций, маски, сетки и долей
+        классов каждого кадра
+    метаданные JSON: анализ, FPS, размер кадра, таблицы имён классов,
+        размеры маски и сетки, исходное видео
+    TRAILER: смещение и длина таблицы кадров и метаданных, MAGIC
+
+Имена классов хранятся кодами class_id (номер в meta["classes"]),
+анализ строки - кодом analysis (номер в ANALYSES). Файл читается через
+memmap: ColumnarLog.records(i), mask(i), grid(i) и fractions(i)
+обращаются только к байтам кадра i. Журналы первой версии (без сеток и
+долей классов) читаются по-прежнему.
+"""
+import json
+import struct
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+MAGIC = b"RSLOG\x00\x02\x00"
+MAGIC_V1 = b"RSLOG\x00\x01\x00"
+TRAILER = struct.Struct("<QQQQ")
+
+# Анализы, строки которых хранятся в журнале (рельеф хранится масками)
+ANALYSES = ("mobile", "static")
+
+DETECTION_DTYPE = np.dtype([
+    ("frame", "<u4"),
+    ("analysis", "u1"),
+    ("class_id", "<u2"),
+    ("track_id", "<i4"),
+    ("x1", "<f4"), ("y1", "<f4"), ("x2", "<f4"), ("y2", "<f4"),
+    ("score", "<f4"),
+    ("speed", "<f4"),
+    ("size", "<f4"),
+])
+
+FRAME_DTYPE_V1 = np.dtype([
+    ("frame", "<u4"),
+    ("time", "<f8"),
+    ("det_offset", "<u8"),
+    ("det_count", "<u4"),
+    ("mask_offset", "<u8"),
+    ("mask_size", "<u4"),
+])
+
+FRAME_DTYPE = np.dtype(FRAME_DTYPE_V1.descr + [
+    ("grid_offset", "<u8"),
+    ("grid_size", "<u4"),
+    ("fractions_offset", "<u8"),
+    ("fractions_count", "<u4"),
+])
+
+
+class ColumnarLogWriter:
+    """Запись журнала .rslog; write() повторяет интерфейс DetectionLog.write.
+
+    records - записи одного конвейера (список словарей, как у
+    update_tracks/detection_records) или объединённая запись
+    комбинированного режима (словарь по анализам). mask - маска классов
+    рельефа кадра (None - без маски, например на кадрах, где рельеф не
+    пересчитывался), grid - вероятности классов ячеек TerrainGrid
+    (rows x cols x C, float). Записи рельефа {"class", "fraction"} (список
+    конвейера рельефа или records["terrain"]) сохраняются долями классов.
+    """
+
+    def __init__(self, path, analysis, fps=None, frame_size=None, source=None, chunk_frames=256, compression=6):
+        self.path = Path(path)
+        self.analysis = analysis
+        self.chunk_frames = chunk_frames
+        self.compression = compression
+        self.meta = {
+            "analysis": analysis,
+            "fps": fps,
+            "frame_size": list(frame_size) if frame_size is not None else None,
+            "source": str(source) if source is not None else None,
+            "classes": [],
+            "mask_shape": None,
+            "grid_shape": None,
+            "terrain_classes": [],
+            "chunk_frames": chunk_frames,
+        }
+        self._classes = {}
+        self._terrain_classes = {}
+        self._frames = []
+        self._pending = []
+        self.file = open(self.path, "wb")
+        self.file.write(MAGIC)
+
+    def _class_id(self, name):
+        class_id = self._classes.get(name)
+        if class_id is None:
+            class_id = self._classes[name] = len(self.meta["classes"])
+            self.meta["classes"].append(name)
+        return class_id
+
+    def _fractions(self, records):
+        if isinstance(records, dict):
+            records = records.get("terrain")
+        elif self.analysis != "terrain":
+            return None
+        if not isinstance(records, list) or not records or "fraction" not in records[0]:
+            return None
+        for record in records:
+            if record["class"] not in self._terrain_classes:
+                self._terrain_classes[record["class"]] = len(self.meta["terrain_classes"])
+                self.meta["terrain_classes"].append(record["class"])
+        fractions = np.zeros(len(self.meta["terrain_classes"]), dtype="<f4")
+        for record in records:
+            fractions[self._terrain_classes[record["class"]]] = record["fraction"]
+        return fractions
+
+    def _rows(self, frame_index, records):
+        if isinstance(records, dict):
+            by_analysis = {name: rows for name, rows in records.items() if name in ANALYSES}
+        else:
+            by_analysis = {self.analysis: records} if self.analysis in ANALYSES else {}
+        count = sum(len(rows) for rows in by_analysis.values())
+        rows = np.zeros(count, dtype=DETECTION_DTYPE)
+        i = 0
+        for name, records in by_analysis.items():
+            for record in records:
+                row = rows[i]
+                row["frame"] = frame_index
+                row["analysis"] = ANALYSES.index(name)
+                row["class_id"] = self._class_id(record["class"])
+                row["track_id"] = record.get("id", -1)
+                row["x1"], row["y1"], row["x2"], row["y2"] = record["x1"], record["y1"], record["x2"], record["y2"]
+                row["score"] = record.get("score", 0.0)
+                row["speed"] = record.get("speed", 0.0)
+                row["size"] = record.get("size", 0.0)
+                i += 1
+        return rows
+
+    def write(self, frame_index, timestamp, records, mask=None, grid=None):
+        blob = grid_blob = b""
+        if mask is not None:
+            mask = np.ascontiguousarray(mask, dtype=np.uint8)
+            self.meta["mask_shape"] = list(mask.shape)
+            blob = zlib.compress(mask.tobytes(), self.compression)
+        if grid is not None:
+            self.meta["grid_shape"] = list(grid.shape)
+            quantized = np.clip(np.rint(np.asarray(grid) * 255), 0, 255).astype(np.uint8)
+            grid_blob = zlib.compress(quantized.tobytes(), self.compression)
+        fractions = self._fractions(records)
+        fractions_blob = fractions.tobytes() if fractions is not None else b""
+        self._pending.append((frame_index, timestamp, self._rows(frame_index, records), blob, grid_blob,
+                              fractions_blob))
+        if len(self._pending) >= self.chunk_frames:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        det_offset = self.file.tell()
+        self.file.write(np.concatenate([item[2] for item in self._pending]).tobytes())
+        for frame_index, timestamp, rows, blob, grid_blob, fractions_blob in self._pending:
+            mask_offset = self.file.tell() if blob else 0
+            self.file.write(blob)
+            grid_offset = self.file.tell() if grid_blob else 0
+            self.file.write(grid_blob)
+            fractions_offset = self.file.tell() if fractions_blob else 0
+            self.file.write(fractions_blob)
+            self._frames.append((frame_index, timestamp, det_offset, len(rows), mask_offset, len(blob),
+                                 grid_offset, len(grid_blob), fractions_offset, len(fractions_blob) // 4))
+            det_offset += rows.nbytes
+        self._pending = []
+
+    def close(self):
+        if self.file.closed:
+            return
+        self._flush()
+        table = np.array(self._frames, dtype=FRAME_DTYPE)
+        table_offset = self.file.tell()
+        self.file.write(table.tobytes())
+        meta = json.dumps(self.meta, ensure_ascii=False).encode("utf-8")
+        meta_offset = self.file.tell()
+        self.file.write(meta)
+        self.file.write(TRAILER.pack(table_offset, len(table), meta_offset, len(meta)) + MAGIC)
+        self.file.close()
+
+
+class NullLogWriter:
+    """Журнал-заглушка, когда запись журнала выключена."""
+
+    def write(self, frame_index, timestamp, records, mask=None, grid=None):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_LOG_WRITER = NullLogWriter()
+
+
+def open_log_writer(path, analysis, cap=None, source=None):
+    """Журнал для обработчика видео: ColumnarLogWriter или заглушка, если path не задан."""
+    if not path:
+        return NULL_LOG_WRITER
+    fps = frame_size = None
+    if cap is not None:
+        import cv2
+        fps = cap.get(cv2.CAP_PROP_FPS) or None
+        frame_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    return ColumnarLogWriter(path, analysis, fps=fps, frame_size=frame_size, source=source)
+
+
+class ColumnarLog:
+    """Чтение журнала .rslog через memmap."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._raw = np.memmap(self.path, dtype=np.uint8, mode="r")
+        end = len(self._raw) - len(MAGIC)
+        magic = bytes(self._raw[:len(MAGIC)])
+        if magic not in (MAGIC, MAGIC_V1) or bytes(self._raw[end:]) != magic:
+            raise Exception("Error: Not a RoboSight log or the log was not closed.")
+        table_offset, count, meta_offset, meta_length = TRAILER.unpack(bytes(self._raw[end - TRAILER.size:end]))
+        self.frames = self._view(table_offset, count, FRAME_DTYPE if magic == MAGIC else FRAME_DTYPE_V1)
+        self.meta = json.loads(bytes(self._raw[meta_offset:meta_offset + meta_length]).decode("utf-8"))
+        self.classes = self.meta["classes"]
+
+    def _view(self, offset, count, dtype):
+        return self._raw[offset:offset + count * dtype.itemsize].view(dtype)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def position(self, frame_index):
+        """Номер строки таблицы кадров для кадра видео или None, если кадр не записан."""
+        position = int(np.searchsorted(self.frames["frame"], frame_index))
+        if position < len(self.frames) and self.frames["frame"][position] == frame_index:
+            return position
+        return None
+
+    def detections(self, frame_index):
+        """Строки детекций кадра (DETECTION_DTYPE, только чтение)."""
+        position = self.position(frame_index)
+        if position is None:
+            return np.empty(0, dtype=DETECTION_DTYPE)
+        entry = self.frames[position]
+        return self._view(int(entry["det_offset"]), int(entry["det_count"]), DETECTION_DTYPE)
+
+    def records(self, frame_index):
+        """Записи кадра по анализам: {"mobile": [...], "static": [...]} в формате конвейеров."""
+        records = {name: [] for name in ANALYSES}
+        for row in self.detections(frame_index):
+            name = ANALYSES[row["analysis"]]
+            record = {"class": self.classes[row["class_id"]],
+                      "x1": int(row["x1"]), "y1": int(row["y1"]), "x2": int(row["x2"]), "y2": int(row["y2"]),
+                      "score": round(float(row["score"]), 4)}
+            if name == "mobile":
+                record.update(id=int(row["track_id"]), speed=round(float(row["speed"]), 2))
+            else:
+                record["size"] = int(row["size"])
+            records[name].append(record)
+        return records
+
+    def mask(self, frame_index):
+        """Маска классов рельефа кадра или None, если для кадра маска не записана."""
+        position = self.position(frame_index)
+        if position is None or not self.frames["mask_size"][position]:
+            return None
+        entry = self.frames[position]
+        offset, size = int(entry["mask_offset"]), int(entry["mask_size"])
+        data = zlib.decompress(bytes(self._raw[offset:offset + size]))
+        return np.frombuffer(data, dtype=np.uint8).reshape(self.meta["mask_shape"])
+
+    def grid(self, frame_index):
+        """Вероятности классов ячеек сетки рельефа (rows x cols x C, float32) или None."""
+        position = self.position(frame_index)
+        if position is None or "grid_size" not in self.frames.dtype.names or not self.frames["grid_size"][position]:
+            return None
+        entry = self.frames[position]
+        offset, size = int(entry["grid_offset"]), int(entry["grid_size"])
+        data = zlib.decompress(bytes(self._raw[offset:offset + size]))
+        grid = np.frombuffer(data, dtype=np.uint8).reshape(self.meta["grid_shape"])
+        return grid.astype(np.float32) / 255
+
+    def fractions(self, frame_index):
+        """Доли классов рельефа кадра {класс: доля} или None, если они не записаны."""
+        position = self.position(frame_index)
+        if position is None or "fractions_count" not in self.frames.dtype.names \
+                or not self.frames["fractions_count"][position]:
+            return None
+        entry = self.frames[position]
+        values = self._view(int(entry["fractions_offset"]), int(entry["fractions_count"]), np.dtype("<f4"))
+        return {name: round(float(value), 4) for name, value in zip(self.meta["terrain_classes"], values)}
+
+    def table(self):
+        """Все детекции журнала одним массивом (для анализа по столбцам)."""
+        parts = [self._view(int(e["det_offset"]), int(e["det_count"]), DETECTION_DTYPE)
+                 for e in self.frames if e["det_count"]]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=DETECTION_DTYPE)
+
+    def close(self):
+        # Отображение файла освобождается вместе с последней ссылкой на массивы
+        self._raw = None
+        self.frames = None
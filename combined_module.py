@@ -0,0 +1,248 @@
+import cv2
+
+from metrics import NULL_METRICS, PerformanceMetrics
+from model_ensemble import SharedLetterbox
+from pipeline import OFFLINE, StagedPipeline
+from playback_clock import PlaybackClock
+from presenter import TkPresenter, fit_frame
+from columnar_log import open_log_writer
+from frame_source import open_source
+from result_cache import NULL_CACHE_ENTRY
+
+# Анализы комбинированного режима и частота их запуска по умолчанию (каждый N-й кадр)
+ANALYSES = ("mobile", "static", "terrain")
+DEFAULT_RATES = {"mobile": 1, "static": 1, "terrain": 5}
+
+
+class CombinedProcessor:
+    """Мобильные объекты, статичные объекты и рельеф на одном декодированном потоке.
+
+    Кадр декодируется один раз. Оба ансамбля детекторов приводятся к
+    одному размеру входа detector_imgsz и получают общий letterbox-тензор
+    (SharedLetterbox); кадр уменьшается до размера вывода один раз, и из
+    этого же буфера готовится вход модели рельефа. Каждый анализ
+    выполняется на каждом rates[name]-м кадре, на остальных используются
+    его последние результаты. process() возвращает один составной кадр
+    (рельеф, статичные и мобильные объекты) и одну запись на кадр.
+    """
+
+    def __init__(self, mobile, static, terrain, rates=None, display_size=(800, 600), detector_imgsz=640,
+                 policy=OFFLINE, realtime=True):
+        self.mobile = mobile    # VideoProcessor
+        self.static = static    # ObjectDetectionProcessor без собственного видео
+        self.terrain = terrain  # RealTimeVideoProcessor
+        self.rates = {**DEFAULT_RATES, **(rates or {})}
+        for name, rate in self.rates.items():
+            if name not in ANALYSES or rate < 1:
+                raise ValueError(f"Invalid rate for {name}: {rate}")
+        self.display_size = display_size
+        self.policy = policy
+        self.realtime = realtime
+        # False - мобильные объекты не рисуются на составном кадре (см. parallel_offline)
+        self.draw_tracks = True
+        # Размер (ширина, высота), до которого источник уменьшает кадры при декодировании (None - исходный)
+        self.decode_size = None
+
+        self.shared_letterbox = SharedLetterbox()
+        for ensemble in (mobile.ensemble, static.ensemble):
+            if detector_imgsz is not None:
+                ensemble.imgsz = detector_imgsz
+            ensemble.shared_letterbox = self.shared_letterbox
+
+        self.metrics = NULL_METRICS
+        self.result_cache = None  # ResultCache, см. enable_result_cache
+        self.detection_log = None  # путь к журналу .rslog, см. enable_detection_log
+        self.cache_stats = None
+        self._cache = dict.fromkeys(ANALYSES, NULL_CACHE_ENTRY)
+        self.pipeline_stats = None
+        self.playback_stats = None
+        self.reset()
+
+    def enable_metrics(self, **options):
+        """Сбор p50/p95 по стадиям и счётчиков кадров (см. PerformanceMetrics)."""
+        self.metrics = PerformanceMetrics("combined", **options)
+        return self.metrics
+
+    def enable_detection_log(self, path):
+        """Запись объединённых записей и пересчитанных масок рельефа в журнал .rslog (см. columnar_log)."""
+        self.detection_log = path
+        return path
+
+    def enable_result_cache(self, cache):
+        """Результаты анализов берутся из ResultCache, если видео уже обрабатывалось с теми же моделями.
+
+        Детекции объектов хранятся в тех же записях, что и у отдельных
+        режимов (с размером входа detector_imgsz); маска рельефа здесь
+        считается по уменьшенному кадру и хранится отдельно.
+        """
+        self.result_cache = cache
+        for processor in (self.mobile, self.static, self.terrain):
+            processor.enable_result_cache(cache)
+        return cache
+
+    def reset(self):
+        self.frame_index = 0
+        self.mobile.reset_tracking()
+        self._mobile_records = []
+        self._static_detections = []
+        self._terrain_mask = None
+        self._terrain_records = []
+        self.terrain.terrain_grid.reset()
+
+    def process(self, frame, timestamp, measure=None, video_index=None):
+        """Составной кадр размера display_size и объединённая запись результатов кадра.
+
+        measure(stage) - контекст замера стадии; по умолчанию метрики процессора.
+        video_index - номер кадра в видео (по умолчанию - номер обработанного кадра).
+        """
+        measure = measure or self.metrics.stage
+        index = self.frame_index
+        self.frame_index += 1
+        self.shared_letterbox.begin(frame)
+
+        # Номер кадра видео для кэша результатов (кадры могут пропускаться при выводе в реальном времени)
+        if video_index is None:
+            video_index = index
+        # С кэшем анализы пересчитываются на кадрах видео, кратных rate: их набор не зависит от пропусков
+        step_index = video_index if self.result_cache is not None else index
+        fresh = {name: step_index % self.rates[name] == 0 for name in ANALYSES}
+        if fresh["mobile"]:
+            with measure("mobile"):
+                if self.result_cache is None:
+                    detections = self.mobile.detect(frame)
+                else:
+                    detections = self.mobile._detect_cached(self._cache["mobile"], video_index, frame)
+                self._mobile_records = self.mobile.update_tracks(detections, timestamp)
+        if fresh["static"]:
+            with measure("static"):
+                self._static_detections = self.static._detect_cached(self._cache["static"], video_index, frame)
+
+        with measure("resize"):
+            display, scale = fit_frame(frame, self.display_size)
+            if display is frame:
+                display = frame.copy()
+        if fresh["terrain"]:
+            with measure("terrain"):
+                # Вход модели рельефа готовится из уже уменьшенного кадра
+                mask = self.terrain._segment_cached(self._cache["terrain"], video_index,
+                                                    self.terrain.standardize_frame(display))
+                self._terrain_mask = mask.copy()
+                self._terrain_records = self.terrain.update_grid(mask)
+
+        with measure("composite"):
+            if self._terrain_mask is not None:
+                color_mask = self.terrain.apply_colormap(self._terrain_mask)
+                segmented = self.terrain.postprocess_mask(color_mask, self.display_size)
+                cv2.addWeighted(display, 0.7, segmented, 0.3, 0, dst=display)
+            self.static._draw_detections(display, self._static_detections, scale)
+            if self.draw_tracks:
+                self.mobile.draw_records(display, self._mobile_records, scale)
+
+        record = {
+            "mobile": self._mobile_records,
+            "static": self.static.detection_records(self._static_detections),
+            "terrain": self._terrain_records,
+            "fresh": fresh,
+        }
+        return display, record
+
+    def process_video(self, input_video_path, canvas=None, root=None, output_path=None, on_record=None):
+        """Обработка видео: вывод на холст, запись составного MP4 и/или передача записей в on_record."""
+        cap = open_source(input_video_path, decode_size=self.decode_size)
+        # Размер декодирования входит в ключи кэша детекций подпроцессоров
+        self.mobile.decode_size = self.static.decode_size = self.decode_size
+        self.reset()
+
+        clock = PlaybackClock(cap.get(cv2.CAP_PROP_FPS))
+        if self.result_cache is not None:
+            self._cache = {
+                "mobile": self.mobile._open_result_cache(input_video_path, cap.frame_count, self.rates["mobile"]),
+                "static": self.static._open_result_cache(input_video_path, cap.frame_count, self.rates["static"]),
+                "terrain": self.terrain._open_result_cache(input_video_path, "combined:terrain"),
+            }
+        log = open_log_writer(self.detection_log, "combined", cap, input_video_path)
+        realtime = self.realtime and canvas is not None
+        # Пока записи кэша не полные, кадры не пропускаются даже при отставании: иначе они не станут полными
+        recording = any(entry.recording for entry in self._cache.values())
+        catch_up = realtime and not recording
+        presenter = TkPresenter(canvas, root, self.display_size, self.metrics) if canvas is not None else None
+        state = {"writer": None}
+
+        def decode():
+            with self.metrics.stage("decode"):
+                ret, frame, timestamp = clock.read(cap, catch_up=catch_up)
+            if not ret:
+                return None
+            self.metrics.frame_decoded()
+            return clock.frame_index, timestamp, frame
+
+        def infer(item):
+            index, timestamp, frame = item
+            display, record = self.process(frame, timestamp, video_index=index)
+            self.metrics.draw_hud(display)
+            # Маска и сетка рельефа пишутся только на кадрах, где рельеф пересчитывался
+            fresh_terrain = record["fresh"]["terrain"]
+            log.write(index, timestamp, record,
+                      mask=self._terrain_mask if fresh_terrain else None,
+                      grid=self.terrain.terrain_grid.probabilities if fresh_terrain else None)
+            if on_record is not None:
+                on_record(self.frame_index - 1, timestamp, record)
+            if output_path:
+                if state["writer"] is None:
+                    state["writer"] = cv2.VideoWriter(str(output_path), cv2.VideoWriter_fourcc(*"mp4v"), clock.fps,
+                                                      (display.shape[1], display.shape[0]))
+                state["writer"].write(display)
+            return timestamp, display
+
+        def present(item):
+            if presenter is not None:
+                timestamp, display = item
+                with self.metrics.stage("tk_convert"):
+                    rgb = presenter.prepare(display)
+                if realtime:
+                    clock.wait(timestamp)
+                presenter.post(rgb)
+            self.metrics.frame_presented(clock, pipeline)
+
+        pipeline = StagedPipeline(decode, infer, present, policy=OFFLINE if recording else self.policy,
+                                  name="combined")
+        try:
+            self.pipeline_stats = pipeline.run()
+        finally:
+            self.playback_stats = clock.stats()
+            self.metrics.close()
+            log.close()
+            self.cache_stats = {name: entry.stats() for name, entry in self._cache.items()}
+            for entry in self._cache.values():
+                entry.close()
+            self._cache = dict.fromkeys(ANALYSES, NULL_CACHE_ENTRY)
+            if presenter is not None:
+                presenter.close()
+            if state["writer"] is not None:
+                state["writer"].release()
+            cap.release()
+
+    def model_report(self):
+        """Средние задержки моделей обоих ансамблей, мс/кадр запуска."""
+        report = {}
+        for prefix, ensemble in (("mobile", self.mobile.ensemble), ("static", self.static.ensemble)):
+            for name, ms in ensemble.latency_report()["per_model_ms"].items():
+                report[f"{prefix}:{name}"] = ms
+        return report
+
+
+def load_combined_processor(rates=None, backend="torch", **options):
+    """Комбинированный процессор на моделях из реестра."""
+    from module_mobile_object import load_mobile_models
+    from static_object_detection import ObjectDetectionProcessor, load_static_models
+    from terrain_engine import EAGER
+    from terrain_module import TerrainModelLoader
+
+    # Ансамбли работают с общим letterbox размера detector_imgsz: ONNX-модели с фиксированным
+    # входом экспортируются сразу под этот размер
+    imgsz = options.get("detector_imgsz", 640) if backend != "torch" else None
+    mobile, _ = load_mobile_models(backend, imgsz=imgsz or 608)
+    models, labels = load_static_models(backend, imgsz=imgsz or 640)
+    static = ObjectDetectionProcessor(models, labels, None)
+    terrain = TerrainModelLoader(EAGER if backend == "torch" else backend).get_video_processor()
+    return CombinedProcessor(mobile, static, terrain, rates=rates, **options)
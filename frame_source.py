@@ -0,0 +1,525 @@
+"""Источники кадров для обработчиков видео.
+
+Все источники повторяют подмножество интерфейса cv2.VideoCapture (read,
+grab, get, set, isOpened, release) и поэтому передаются в PlaybackClock и
+open_log_writer вместо VideoCapture. Дополнительно источник сообщает
+время (pts) и номер (frame_index) последнего прочитанного кадра, умеет
+перематываться (seek) и пропускать кадры через grab() без получения
+изображения.
+
+decode_size - размер (ширина, высота), который нужен конвейеру: кадр
+уменьшается с сохранением пропорций, пока ещё покрывает decode_size, и
+уменьшение выполняется как можно раньше - в ffmpeg (фильтр scale), в
+декодере JPEG (cv2.IMREAD_REDUCED_*) или в самой камере (режим
+захвата); только если этого сделать нельзя, кадр уменьшается сразу после
+декодирования. Все кадры источника имеют размер frame_size.
+
+open_source() выбирает источник по строке: номер устройства - камера,
+каталог - последовательность изображений, "sim://путь" - локальная
+имитация сетевой камеры из видеофайла, URL - сетевой поток, иначе -
+видеофайл.
+"""
+import json
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+SIMULATED_SCHEME = "sim://"
+DEFAULT_FPS = 25.0
+
+
+def decode_scale(source_size, decode_size):
+    """Коэффициент уменьшения (не больше 1), при котором кадр source_size ещё покрывает decode_size."""
+    width, height = source_size
+    if not decode_size or not width or not height:
+        return 1.0
+    return min(1.0, max(decode_size[0] / width, decode_size[1] / height))
+
+
+def scaled_size(source_size, scale):
+    return max(1, int(round(source_size[0] * scale))), max(1, int(round(source_size[1] * scale)))
+
+
+class FrameSource:
+    """Базовый источник: read() возвращает кадры 0, stride, 2 * stride, ..., остальные пропускаются через grab()."""
+
+    live = False
+
+    def __init__(self, stride=1):
+        if stride < 1:
+            raise ValueError(f"Invalid stride: {stride}")
+        self.stride = stride
+        self.fps = DEFAULT_FPS
+        self.source_size = (0, 0)  # размер кадра в источнике
+        self.frame_size = (0, 0)   # размер кадров, которые отдаёт read()
+        self.frame_count = None    # None - длина неизвестна (камера, поток)
+        self.index = 0             # номер следующего кадра источника
+        self.frame_index = None    # номер последнего прочитанного кадра
+        self.pts = None            # время последнего прочитанного кадра, с
+        self.decoded = 0
+        self.skipped = 0
+        self._skip = 0             # кадры, которые следующий read() пропустит перед декодированием
+
+    @property
+    def scale(self):
+        """Масштаб кадров read() относительно кадров источника."""
+        return self.frame_size[0] / self.source_size[0] if self.source_size[0] else 1.0
+
+    def _fit(self, frame):
+        # Уменьшение после декодирования - для источников, которые не умеют делать это раньше
+        if (frame.shape[1], frame.shape[0]) != self.frame_size:
+            frame = cv2.resize(frame, self.frame_size, interpolation=cv2.INTER_AREA)
+        return frame
+
+    def isOpened(self):
+        return True
+
+    def grab(self):
+        """Пропуск кадра без получения изображения."""
+        if not self._grab():
+            return False
+        self.index += 1
+        self.skipped += 1
+        return True
+
+    def read(self):
+        # Пропуск после прочитанного кадра откладывается до следующего read(), чтобы не задерживать кадр
+        while self._skip > 0:
+            self._skip -= 1
+            if not self.grab():
+                return False, None
+        ret, frame, pts = self._read()
+        if not ret:
+            return False, None
+        self.frame_index = self.index
+        self.index += 1
+        self._skip = self.stride - 1
+        self.pts = pts if pts is not None else self.frame_index / self.fps
+        self.decoded += 1
+        return True, frame
+
+    def seek(self, index):
+        """Переход к кадру index; следующий read() вернёт его."""
+        if self.live:
+            raise Exception("Error: Cannot seek a live source.")
+        self._seek(index)
+        self.index = index
+        self._skip = 0
+
+    def get(self, prop):
+        values = {
+            cv2.CAP_PROP_FPS: self.fps,
+            cv2.CAP_PROP_FRAME_WIDTH: self.frame_size[0],
+            cv2.CAP_PROP_FRAME_HEIGHT: self.frame_size[1],
+            cv2.CAP_PROP_FRAME_COUNT: self.frame_count or 0,
+            cv2.CAP_PROP_POS_FRAMES: self.index,
+            cv2.CAP_PROP_POS_MSEC: (self.pts or 0.0) * 1000,
+        }
+        return float(values.get(prop, 0.0))
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            self.seek(int(value))
+            return True
+        return False
+
+    def release(self):
+        pass
+
+    def stats(self):
+        return {
+            "source": type(self).__name__,
+            "source_size": list(self.source_size),
+            "frame_size": list(self.frame_size),
+            "decoded": self.decoded,
+            "skipped": self.skipped,
+        }
+
+    def _grab(self):
+        ret, _, _ = self._read()
+        return ret
+
+    def _read(self):
+        raise NotImplementedError
+
+    def _seek(self, index):
+        raise NotImplementedError
+
+
+class CaptureSource(FrameSource):
+    """Видеофайл, камера (номер устройства) или сетевой поток через cv2.VideoCapture.
+
+    Камере задаётся режим захвата не больше нужного размера; у файлов время
+    кадра берётся из его pts (CAP_PROP_POS_MSEC), у камер и потоков - по
+    моменту получения кадра.
+    """
+
+    def __init__(self, source, decode_size=None, stride=1, live=None):
+        super().__init__(stride)
+        self.cap = cv2.VideoCapture(source)
+        if not self.cap.isOpened():
+            raise Exception("Error: Could not open video file.")
+        self.live = live if live is not None else isinstance(source, int) or "://" in str(source)
+        if isinstance(source, int) and decode_size:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, decode_size[0])
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, decode_size[1])
+        fps = float(self.cap.get(cv2.CAP_PROP_FPS) or 0)
+        self.fps = fps if fps > 0 else DEFAULT_FPS
+        self.source_size = (int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self.frame_size = scaled_size(self.source_size, decode_scale(self.source_size, decode_size))
+        count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.frame_count = count if count > 0 and not self.live else None
+        self._opened = time.perf_counter()
+
+    def _grab(self):
+        return self.cap.grab()
+
+    def _read(self):
+        ret, frame = self.cap.read()
+        if not ret:
+            return False, None, None
+        if self.live:
+            pts = time.perf_counter() - self._opened
+        else:
+            msec = float(self.cap.get(cv2.CAP_PROP_POS_MSEC))
+            pts = msec / 1000 if msec > 0 or self.index == 0 else None
+        return True, self._fit(frame), pts
+
+    def _seek(self, index):
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+
+    def release(self):
+        self.cap.release()
+
+
+def probe_video(path):
+    """(fps, (ширина, высота), число кадров или None) через ffprobe или None, если ffprobe недоступен."""
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe is None:
+        return None
+    command = [ffprobe, "-v", "error", "-select_streams", "v:0", "-show_entries",
+               "stream=width,height,avg_frame_rate,nb_frames", "-of", "json", str(path)]
+    try:
+        streams = json.loads(subprocess.run(command, capture_output=True, text=True, check=True).stdout)["streams"]
+    except (OSError, subprocess.CalledProcessError, ValueError, KeyError):
+        return None
+    if not streams:
+        return None
+    stream = streams[0]
+    numerator, _, denominator = stream.get("avg_frame_rate", "0/1").partition("/")
+    fps = float(numerator) / float(denominator or 1) if float(denominator or 1) else 0.0
+    frames = stream.get("nb_frames")
+    return (fps if fps > 0 else DEFAULT_FPS, (int(stream["width"]), int(stream["height"])),
+            int(frames) if frames and frames.isdigit() else None)
+
+
+class FfmpegSource(FrameSource):
+    """Видеофайл, декодируемый процессом ffmpeg с уменьшением кадра фильтром scale.
+
+    По каналу приходят уже уменьшенные BGR-кадры, так что кадр полного
+    размера не копируется в память процесса. seek() перезапускает ffmpeg
+    с -ss перед входом (переход к ближайшему ключевому кадру и
+    декодирование до нужного); grab() читает кадр из канала в общий
+    буфер, не создавая массив.
+    """
+
+    def __init__(self, path, decode_size=None, stride=1):
+        super().__init__(stride)
+        info = probe_video(path)
+        if info is None:
+            raise Exception("Error: Could not open video file.")
+        self.path = str(path)
+        self.fps, self.source_size, self.frame_count = info
+        self.frame_size = scaled_size(self.source_size, decode_scale(self.source_size, decode_size))
+        self._scratch = bytearray(self.frame_size[0] * self.frame_size[1] * 3)
+        self._process = None
+
+    @staticmethod
+    def available():
+        return shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
+
+    def _start(self):
+        width, height = self.frame_size
+        command = ["ffmpeg", "-v", "error", "-nostdin"]
+        if self.index:
+            command += ["-ss", f"{self.index / self.fps:.6f}"]
+        command += ["-i", self.path, "-an", "-sn", "-vsync", "0", "-vf", f"scale={width}:{height}:flags=area",
+                    "-f", "rawvideo", "-pix_fmt", "bgr24", "pipe:1"]
+        self._process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                         bufsize=len(self._scratch) * 2)
+
+    def _read_into(self, buffer):
+        if self._process is None:
+            self._start()
+        view = memoryview(buffer)
+        filled = 0
+        while filled < len(view):
+            count = self._process.stdout.readinto(view[filled:])
+            if not count:
+                return False
+            filled += count
+        return True
+
+    def _grab(self):
+        return self._read_into(self._scratch)
+
+    def _read(self):
+        width, height = self.frame_size
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        if not self._read_into(memoryview(frame.reshape(-1))):
+            return False, None, None
+        return True, frame, None
+
+    def _seek(self, index):
+        self.release()
+
+    def release(self):
+        if self._process is not None:
+            self._process.stdout.close()
+            self._process.terminate()
+            self._process.wait()
+            self._process = None
+
+
+class ImageDirectorySource(FrameSource):
+    """Последовательность изображений каталога (по имени файла) с частотой fps.
+
+    JPEG декодируется сразу в уменьшенном в 2, 4 или 8 раз виде
+    (cv2.IMREAD_REDUCED_COLOR_*), если такой кадр ещё покрывает
+    decode_size; grab() не читает файл.
+    """
+
+    REDUCED_MODES = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                     (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+    def __init__(self, directory, decode_size=None, stride=1, fps=DEFAULT_FPS):
+        super().__init__(stride)
+        self.files = sorted(path for path in Path(directory).iterdir() if path.suffix.lower() in IMAGE_SUFFIXES)
+        if not self.files:
+            raise Exception("Error: Could not open video source.")
+        first = cv2.imread(str(self.files[0]))
+        if first is None:
+            raise Exception("Error: Could not open video source.")
+        self.fps = fps
+        self.frame_count = len(self.files)
+        self.source_size = (first.shape[1], first.shape[0])
+        scale = decode_scale(self.source_size, decode_size)
+        self.frame_size = scaled_size(self.source_size, scale)
+        self._mode = next((mode for factor, mode in self.REDUCED_MODES if 1 / factor >= scale), cv2.IMREAD_COLOR)
+
+    def _grab(self):
+        return self.index < len(self.files)
+
+    def _read(self):
+        if self.index >= len(self.files):
+            return False, None, None
+        frame = cv2.imread(str(self.files[self.index]), self._mode)
+        if frame is None:
+            return False, None, None
+        return True, self._fit(frame), None
+
+    def _seek(self, index):
+        pass
+
+
+class SimulatedStream(FrameSource):
+    """Локальная замена сетевой камеры: видеофайл, отдаваемый в реальном времени.
+
+    Фоновый поток читает файл в темпе его fps и хранит только последний
+    кадр. read() ждёт кадр новее прочитанного; кадры, которые не успели
+    забрать, заменяются свежими и считаются потерянными (dropped), как у
+    RTSP-камеры. Время кадра - момент его поступления. loop=True -
+    файл воспроизводится по кругу.
+    """
+
+    live = True
+
+    def __init__(self, path, decode_size=None, stride=1, loop=False):
+        super().__init__(stride)
+        self._source = open_file_source(path, decode_size)
+        self.fps = self._source.fps
+        self.source_size = self._source.source_size
+        self.frame_size = self._source.frame_size
+        self.loop = loop
+        self.dropped = 0
+        self._cond = threading.Condition()
+        self._latest = None
+        self._ended = False
+        self._stop = threading.Event()
+        self._opened = time.perf_counter()
+        self._thread = threading.Thread(target=self._produce, name="simulated-stream", daemon=True)
+        self._thread.start()
+
+    def _produce(self):
+        start = time.perf_counter()
+        produced = 0
+        try:
+            while not self._stop.is_set():
+                ret, frame = self._source.read()
+                if not ret:
+                    if not self.loop or produced == 0:
+                        break
+                    self._source.seek(0)
+                    continue
+                delay = start + produced / self.fps - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                produced += 1
+                with self._cond:
+                    if self._latest is not None:
+                        self.dropped += 1
+                    self._latest = (frame, time.perf_counter() - self._opened)
+                    self._cond.notify_all()
+        finally:
+            with self._cond:
+                self._ended = True
+                self._cond.notify_all()
+
+    def _take(self):
+        with self._cond:
+            while self._latest is None and not self._ended:
+                self._cond.wait()
+            item, self._latest = self._latest, None
+        return item
+
+    def _grab(self):
+        return self._take() is not None
+
+    def _read(self):
+        item = self._take()
+        if item is None:
+            return False, None, None
+        frame, pts = item
+        return True, frame, pts
+
+    def stats(self):
+        return {**super().stats(), "dropped": self.dropped}
+
+    def release(self):
+        self._stop.set()
+        self._thread.join(1.0)
+        self._source.release()
+
+
+class PrefetchSource(FrameSource):
+    """Чтение кадров источника наперёд в отдельном потоке (до depth кадров).
+
+    Декодирование идёт параллельно с обработкой, даже если обработчик
+    читает кадры в том же потоке, что и модели. Шаг кадров задаёт
+    внутренний источник: в очередь попадают только кадры его read(), и
+    grab() берёт из очереди следующий из них без использования; seek()
+    останавливает чтение и начинает его с нового места.
+    """
+
+    def __init__(self, source, depth=4):
+        super().__init__(1)
+        self.source = source
+        self.stride = source.stride
+        self.depth = depth
+        self.live = source.live
+        self.fps = source.fps
+        self.source_size = source.source_size
+        self.frame_size = source.frame_size
+        self.frame_count = source.frame_count
+        self._start()
+
+    def _start(self):
+        self._queue = queue.Queue(maxsize=self.depth)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._prefetch, name="prefetch", daemon=True)
+        self._thread.start()
+
+    def _prefetch(self):
+        while not self._stop.is_set():
+            ret, frame = self.source.read()
+            item = (frame, self.source.frame_index, self.source.pts) if ret else None
+            while not self._stop.is_set():
+                try:
+                    self._queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if item is None:
+                return
+
+    def _next(self):
+        item = self._queue.get()
+        if item is None:
+            # Конец источника остаётся в очереди для следующих вызовов
+            self._queue.put(None)
+        return item
+
+    def grab(self):
+        item = self._next()
+        if item is None:
+            return False
+        # Номер следующего кадра - после пропущенного, с учётом шага внутреннего источника
+        self.index = item[1] + 1
+        self.skipped += 1
+        return True
+
+    def read(self):
+        item = self._next()
+        if item is None:
+            return False, None
+        frame, self.frame_index, self.pts = item
+        self.index = self.frame_index + 1
+        self.decoded += 1
+        return True, frame
+
+    def _stop_thread(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _seek(self, index):
+        self._stop_thread()
+        self.source.seek(index)
+        self._start()
+
+    def stats(self):
+        return self.source.stats()
+
+    def release(self):
+        self._stop_thread()
+        self.source.release()
+
+
+def open_file_source(path, decode_size=None, stride=1):
+    """Видеофайл: через ffmpeg, если кадр нужно уменьшать и ffmpeg установлен, иначе через VideoCapture."""
+    if decode_size and FfmpegSource.available():
+        try:
+            source = FfmpegSource(path, decode_size, stride)
+        except Exception:
+            source = None
+        if source is not None and source.scale < 1.0:
+            return source
+    return CaptureSource(str(path), decode_size, stride, live=False)
+
+
+def open_source(source, decode_size=None, stride=1, prefetch=0):
+    """Источник кадров по описанию: FrameSource, номер камеры, каталог, sim://файл, URL или файл.
+
+    prefetch > 0 - чтение наперёд в отдельном потоке (PrefetchSource) на prefetch кадров.
+    """
+    if isinstance(source, FrameSource):
+        return source
+    if isinstance(source, int) or (isinstance(source, str) and source.isdigit()):
+        frames = CaptureSource(int(source), decode_size, stride)
+    elif str(source).startswith(SIMULATED_SCHEME):
+        frames = SimulatedStream(str(source)[len(SIMULATED_SCHEME):], decode_size, stride)
+    elif "://" in str(source):
+        frames = CaptureSource(str(source), decode_size, stride, live=True)
+    elif Path(source).is_dir():
+        frames = ImageDirectorySource(source, decode_size, stride)
+    else:
+        frames = open_file_source(source, decode_size, stride)
+    if prefetch:
+        frames = PrefetchSource(frames, prefetch)
+    return frames
@@ -0,0 +1,227 @@
+"""Экспорт моделей в ONNX и запуск через ONNX Runtime на CPU.
+
+Однократный экспорт всех моделей (с INT8-квантизацией по кадрам образца видео):
+    python inference_backends.py --calibration sample.mp4 --int8
+"""
+import argparse
+import shutil
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+
+from terrain_engine import ONNX, ONNX_INT8, normalize_frame
+
+# Бэкенды инференса
+TORCH = "torch"
+BACKENDS = (TORCH, ONNX, ONNX_INT8)
+
+# Экспортированные модели хранятся рядом с исходными весами
+CACHE_DIR = Path(__file__).parent.resolve() / "models" / "onnx"
+
+
+def _require_onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError as e:
+        raise ImportError("ONNX-бэкенду нужны пакеты onnx и onnxruntime: pip install onnx onnxruntime") from e
+    return onnxruntime
+
+
+def artifact_path(source_path, suffix, int8=False):
+    """Путь к экспортированной модели в кэше: <имя>-<suffix>[-int8].onnx."""
+    name = f"{Path(source_path).stem}-{suffix}{'-int8' if int8 else ''}.onnx"
+    return CACHE_DIR / name
+
+
+def is_fresh(artifact, source_path):
+    """Экспорт актуален, если он новее исходных весов."""
+    artifact = Path(artifact)
+    return artifact.exists() and artifact.stat().st_mtime >= Path(source_path).stat().st_mtime
+
+
+def session_options(num_threads=None):
+    ort = _require_onnxruntime()
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+    return options
+
+
+# Квантизация
+
+class _CalibrationReader:
+    """Источник калибровочных входов для onnxruntime.quantization.quantize_static."""
+
+    def __init__(self, input_name, inputs):
+        self._inputs = iter([{input_name: array} for array in inputs])
+
+    def get_next(self):
+        return next(self._inputs, None)
+
+    def rewind(self):
+        pass
+
+
+def quantize_int8(fp32_path, int8_path, calibration_inputs):
+    """Статическая INT8-квантизация (QDQ, веса по каналам) с калибровкой на реальных кадрах."""
+    _require_onnxruntime()
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    class Reader(_CalibrationReader, CalibrationDataReader):
+        pass
+
+    input_name = onnx.load(str(fp32_path), load_external_data=False).graph.input[0].name
+    quantize_static(
+        str(fp32_path), str(int8_path), Reader(input_name, calibration_inputs),
+        quant_format=QuantFormat.QDQ, per_channel=True,
+        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+    )
+
+    # Метаданные ultralytics (имена классов, stride, imgsz) нужны для загрузки через YOLO
+    source = onnx.load(str(fp32_path))
+    quantized = onnx.load(str(int8_path))
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(source.metadata_props)
+    onnx.save(quantized, str(int8_path))
+    return Path(int8_path)
+
+
+def _missing_int8(path):
+    return FileNotFoundError(
+        f"INT8-модель {path.name} не экспортирована: запустите "
+        "python inference_backends.py --calibration <видео> --int8"
+    )
+
+
+# YOLO
+
+def ensure_yolo_onnx(pt_path, imgsz, int8=False, calibration_frames=None):
+    """Путь к ONNX-версии YOLO-модели; экспортирует её при отсутствии или устаревании."""
+    from ultralytics import YOLO
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    fp32_path = artifact_path(pt_path, imgsz)
+    if not is_fresh(fp32_path, pt_path):
+        exported = YOLO(str(pt_path)).export(format="onnx", imgsz=imgsz, dynamic=False, verbose=False)
+        shutil.move(str(exported), fp32_path)
+    if not int8:
+        return fp32_path
+
+    int8_path = artifact_path(pt_path, imgsz, int8=True)
+    if is_fresh(int8_path, pt_path):
+        return int8_path
+    if not calibration_frames:
+        raise _missing_int8(int8_path)
+
+    from model_ensemble import ModelEnsemble
+    letterbox = ModelEnsemble([], imgsz=imgsz).letterbox
+    inputs = [letterbox(frame)[0].numpy() for frame in calibration_frames]
+    return quantize_int8(fp32_path, int8_path, inputs)
+
+
+def load_yolo_onnx(pt_path, imgsz, int8=False):
+    """YOLO-модель поверх ONNX Runtime: тот же API predict/track и тот же формат результатов."""
+    from ultralytics import YOLO
+
+    _require_onnxruntime()
+    return YOLO(str(ensure_yolo_onnx(pt_path, imgsz, int8=int8)), task="detect")
+
+
+# Модель рельефа
+
+class OnnxSegmentationModel:
+    """Сессия ONNX Runtime с интерфейсом модели сегментации torchvision: model(x)["out"]."""
+
+    def __init__(self, path, num_threads=None):
+        ort = _require_onnxruntime()
+        self.path = Path(path)
+        self.session = ort.InferenceSession(str(path), session_options(num_threads),
+                                            providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, input_tensor):
+        output = self.session.run(None, {self.input_name: input_tensor.numpy()})[0]
+        return {"out": torch.from_numpy(output)}
+
+
+def ensure_terrain_onnx(pth_path, target_size=(512, 512), int8=False, calibration_frames=None):
+    """Путь к ONNX-версии модели рельефа; экспортирует её при отсутствии или устаревании."""
+    from torchvision.models.segmentation import deeplabv3_mobilenet_v3_large
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    width, height = target_size
+    fp32_path = artifact_path(pth_path, f"{width}x{height}")
+    if not is_fresh(fp32_path, pth_path):
+        model = deeplabv3_mobilenet_v3_large(num_classes=7)
+        model.load_state_dict(torch.load(pth_path, map_location=torch.device('cpu')))
+        model.eval()
+        torch.onnx.export(model, torch.zeros((1, 3, height, width)), str(fp32_path),
+                          input_names=["input"], output_names=["out"], opset_version=17)
+    if not int8:
+        return fp32_path
+
+    int8_path = artifact_path(pth_path, f"{width}x{height}", int8=True)
+    if is_fresh(int8_path, pth_path):
+        return int8_path
+    if not calibration_frames:
+        raise _missing_int8(int8_path)
+    inputs = [normalize_frame(frame, target_size) for frame in calibration_frames]
+    return quantize_int8(fp32_path, int8_path, inputs)
+
+
+def load_terrain_onnx(pth_path, target_size=(512, 512), int8=False):
+    return OnnxSegmentationModel(ensure_terrain_onnx(pth_path, target_size, int8=int8))
+
+
+# Экспорт всех моделей
+
+def sample_frames(video_path, count=100):
+    """Равномерная выборка кадров из видео для калибровки."""
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        raise Exception("Error: Could not open video file.")
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or count
+    frames = []
+    for index in np.linspace(0, total - 1, num=min(count, total)).astype(int):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+        ret, frame = cap.read()
+        if ret:
+            frames.append(frame)
+    cap.release()
+    return frames
+
+
+def export_all(int8=False, calibration_frames=None):
+    from module_mobile_object import MOBILE_MODEL_PATHS
+    from static_object_detection import STATIC_MODEL_PATHS
+    from terrain_module import TERRAIN_MODEL_PATH
+
+    exported = []
+    for path in MOBILE_MODEL_PATHS:
+        exported.append(ensure_yolo_onnx(path, 608, int8, calibration_frames))
+    for path in STATIC_MODEL_PATHS:
+        exported.append(ensure_yolo_onnx(path, 640, int8, calibration_frames))
+    exported.append(ensure_terrain_onnx(TERRAIN_MODEL_PATH, int8=int8, calibration_frames=calibration_frames))
+    return exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--int8", action="store_true", help="дополнительно построить INT8-версии")
+    parser.add_argument("--calibration", help="видео для калибровки INT8-квантизации")
+    parser.add_argument("--calibration-frames", type=int, default=100)
+    args = parser.parse_args()
+    if args.int8 and not args.calibration:
+        parser.error("для --int8 нужно видео --calibration")
+
+    frames = sample_frames(args.calibration, args.calibration_frames) if args.calibration else None
+    for path in export_all(args.int8, frames):
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,43 @@
+import argparse
 import tkinter as tk
-from tkinter import filedialog
+from tkinter import filedialog, simpledialog
 from PIL import Image, ImageTk
-import threading
+from pathlib import Path
 import cv2
 from module_mobile_object import load_mobile_models
-from terrain_module import TerrainModelLoader
+from terrain_module import TERRAIN_CLASSES, TERRAIN_PALETTE, TerrainModelLoader
 import static_object_detection
+from model_registry import REGISTRY
+from combined_module import load_combined_processor
+from result_cache import CACHE_DIR, ResultCache
+from replay import LogReplayer
+from sessions import SessionManager, current_session
+
+# Названия классов рельефа для палитры
+TERRAIN_LABELS = {
+    "Urban land": "Городская местность",
+    "Agriculture land": "Сельхоз местность",
+    "Rangeland": "Пастбище",
+    "Forest land": "Лес",
+    "Water": "Вода",
+    "Barren land": "Бесплодная земля",
+    "Unknown": "Неизвестная местность",
+}
 
 class VideoApp:
-    def __init__(self, root):
+    def __init__(self, root, preload_models=False, metrics=None, result_cache=None, log_dir=None, adaptive=None,
+                 max_sessions=2):
         self.root = root
+        # Параметры PerformanceMetrics для обработчиков видео (None - метрики выключены)
+        self.metrics = metrics
+        # ResultCache: повторно открытые видео не обрабатываются моделями заново (None - без кэша)
+        self.result_cache = result_cache
+        # Каталог журналов .rslog: результаты каждой обработки записываются для просмотра без моделей
+        self.log_dir = log_dir
+        # Параметры ResolutionController (target_fps, log_path): размер входа подбирается под частоту кадров
+        self.adaptive = adaptive
         self.root.title("Видеообработка")
-        self.root.geometry("990x450")
+        self.root.geometry("990x600")
 
         # Темный фон для окна
         self.root.config(bg="#2E2E2E")
@@ -44,23 +70,53 @@ class VideoApp:
         )
         self.terrain_button.pack(side=tk.TOP, padx=20, pady=10)
 
+        self.combined_button = tk.Button(
+            self.left_frame, text="Все анализы одновременно", command=self.select_combined_video,
+            font=("Arial", 14), bg="grey", fg="white", width=button_width, height=button_height
+        )
+        self.combined_button.pack(side=tk.TOP, padx=20, pady=10)
+
+        self.replay_button = tk.Button(
+            self.left_frame, text="Просмотр журнала", command=self.select_replay_log,
+            font=("Arial", 14), bg="grey", fg="white", width=button_width, height=button_height
+        )
+        self.replay_button.pack(side=tk.TOP, padx=20, pady=10)
+
+        # Источник вместо файла: номер камеры, каталог изображений, URL потока или sim://видеофайл
+        self.source_button = tk.Button(
+            self.left_frame, text="Другой источник", command=self.select_source,
+            font=("Arial", 14), bg="grey", fg="white", width=button_width, height=button_height
+        )
+        self.source_button.pack(side=tk.TOP, padx=20, pady=10)
+        self.source = None
+
+        # Активные обработки и загрузка процессора, обновляется раз в секунду
+        self.sessions_label = tk.Label(
+            self.left_frame, text="", font=("Arial", 11), bg="#2E2E2E", fg="white", justify=tk.LEFT, anchor="w"
+        )
+        self.sessions_label.pack(side=tk.TOP, fill=tk.X, padx=20, pady=10)
+
         self.video_processor = None
         self.merger = None
         self.terrain_processor = None
-        self.running = False
+        self.combined_processor = None
+        # Обработки выполняются в небольшом пуле потоков; закрытие окна отменяет обработку
+        self.sessions = SessionManager(max_workers=max_sessions)
 
-        # Карта классов и цветов
+        # Карта классов и цветов: цвета берутся из палитры наложения (BGR) и переводятся в RGB
         self.class_map = {
-            (0, 255, 255): "Городская местность",
-            (255, 255, 0): "Сельхоз местность",
-            (255, 0, 255): "Пастбище",
-            (0, 255, 0): "Лес",
-            (255, 255, 255): "Бесплодная земля",
-            (146, 142, 250): "Неизвестная местность"
+            tuple(int(c) for c in color[::-1]): TERRAIN_LABELS[name]
+            for color, name in zip(TERRAIN_PALETTE, TERRAIN_CLASSES)
         }
 
         self.create_palette()
 
+        # Фоновая загрузка и прогрев всех моделей, чтобы кнопки не блокировали интерфейс
+        if preload_models:
+            REGISTRY.preload([load_mobile_models, static_object_detection.load_static_models, TerrainModelLoader])
+
+        self.refresh_sessions()
+
     def create_palette(self):
         """Создает палитру цветов с названиями классов."""
         tk.Label(
@@ -86,8 +142,12 @@ class VideoApp:
         """Преобразует RGB-кортеж в HEX-строку."""
         return "#%02x%02x%02x" % rgb
 
-    def open_video_window(self, process_func, video_path):
-        """Открыть новое окно для видеопотока."""
+    def open_video_window(self, process_func, video_path, resource=None):
+        """Открыть новое окно для видеопотока.
+
+        resource - имя общего обработчика: обработки с одним resource
+        выполняются по очереди, чтобы не смешивать его треки и буферы.
+        """
         video_window = tk.Toplevel(self.root)
         video_window.title("Видеопоток")
         video_window.geometry("800x600")
@@ -97,31 +157,80 @@ class VideoApp:
         video_canvas = tk.Canvas(video_window, bg="black", width=800, height=600, bd=0, highlightthickness=0)
         video_canvas.pack(fill=tk.BOTH, expand=True)
 
-        # Запуск видеопотока
-        self.running = True
-        threading.Thread(target=process_func, args=(video_path, video_canvas, video_window)).start()
+        # Обработка в потоке пула; закрытие окна отменяет её и освобождает ресурсы
+        session = self.sessions.submit(Path(str(video_path)).name, process_func, video_path, video_canvas, video_window,
+                                       resource=resource)
+        video_window.protocol("WM_DELETE_WINDOW", lambda: self.close_session(session, video_window))
+        return session
+
+    @staticmethod
+    def close_session(session, window):
+        """Отмена обработки и закрытие её окна."""
+        session.cancel()
+        window.destroy()
+
+    def refresh_sessions(self):
+        """Список активных обработок с загрузкой процессора."""
+        lines = [f"#{s['id']} {s['name']}: {s['state']}, CPU {s['cpu_percent']:.0f}%" for s in self.sessions.stats()]
+        self.sessions_label.config(text="\n".join(lines) or "Нет активных обработок")
+        self.root.after(1000, self.refresh_sessions)
+
+    def close(self):
+        """Закрытие приложения: все обработки отменяются."""
+        self.sessions.shutdown(wait=False)
+        self.root.destroy()
+
+    def select_source(self):
+        """Запрос источника вместо видеофайла; пустая строка возвращает выбор файла в диалоге."""
+        source = simpledialog.askstring(
+            "Другой источник", "Номер камеры, каталог изображений, URL потока или sim://видеофайл:", parent=self.root
+        )
+        if source is not None:
+            self.source = source.strip() or None
+            # Кнопка показывает источник, который возьмёт следующий анализ
+            self.source_button.config(text=f"Источник: {self.source}" if self.source else "Другой источник")
+
+    def choose_source(self, title):
+        """Источник, заданный кнопкой «Другой источник» (только для одного запуска), или видеофайл из диалога."""
+        source, self.source = self.source, None
+        if source:
+            self.source_button.config(text="Другой источник")
+            return source
+        return filedialog.askopenfilename(title=title, filetypes=[("Видео файлы", "*.mp4 *.avi")])
+
+    def log_path(self, video_path, analysis):
+        """Путь журнала .rslog для обработки видео или None, если журналы не записываются."""
+        if not self.log_dir:
+            return None
+        Path(self.log_dir).mkdir(parents=True, exist_ok=True)
+        name = Path(str(video_path)).stem or "source"
+        return str(Path(self.log_dir) / f"{name}.{analysis}.rslog")
 
     def select_mobile_video(self):
         """Выбор видео для обработки мобильных объектов."""
-        if self.video_processor is None or self.merger is None:
-            print("Загрузка модели для мобильных объектов...")
-            self.video_processor, self.merger = load_mobile_models()
-            print("Модель успешно загружена.")
-        
         # Открываем диалоговое окно для выбора видео
-        video_path = filedialog.askopenfilename(
-            title="Выберите видео для мобильных объектов",
-            filetypes=[("Видео файлы", "*.mp4 *.avi")]
-        )
+        video_path = self.choose_source("Выберите видео для мобильных объектов")
         if video_path:
-            self.open_video_window(self.process_mobile_video, video_path)
+            self.open_video_window(self.process_mobile_video, video_path, resource="mobile")
 
     def process_mobile_video(self, video_path, canvas, window):
         """Обработка мобильных объектов через module_mobile_object.py."""
         try:
-            if self.video_processor is None:
-                raise Exception("Ошибка: Модель не загружена.")
-            
+            # Модели загружаются в потоке обработки (или берутся из реестра после предзагрузки)
+            if self.video_processor is None or self.merger is None:
+                print("Загрузка модели для мобильных объектов...")
+                self.video_processor, self.merger = load_mobile_models()
+                print("Модель успешно загружена.")
+
+            if self.metrics is not None:
+                self.video_processor.enable_metrics(**self.metrics)
+            if self.result_cache is not None:
+                self.video_processor.enable_result_cache(self.result_cache)
+            self.video_processor.enable_detection_log(self.log_path(video_path, "mobile"))
+            if self.adaptive is not None and self.video_processor.adaptive is None:
+                self.video_processor.enable_adaptive_resolution(**self.adaptive)
+            # Треки и удержанные детекции видео сбрасываются при завершении обработки
+            current_session().add_cleanup(self.video_processor.reset_tracking)
             self.video_processor.process_video(video_path, canvas, window)
         except Exception as e:
             print(f"Ошибка обработки видео: {e}")
@@ -129,37 +238,119 @@ class VideoApp:
 
     def select_static_video(self):
         """Выбор видео для обработки статичных объектов."""
-        video_path = filedialog.askopenfilename(
-            title="Выберите видео для статичных объектов",
-            filetypes=[("Видео файлы", "*.mp4 *.avi")]
-        )
+        video_path = self.choose_source("Выберите видео для статичных объектов")
         if video_path:
             self.open_video_window(self.process_static_video, video_path)
 
     def process_static_video(self, video_path, canvas, window):
         """Обработка статичных объектов."""
-        static_object_detection.start_static_object_detection(video_path, canvas, window)
+        static_object_detection.start_static_object_detection(video_path, canvas, window, metrics=self.metrics,
+                                                              result_cache=self.result_cache,
+                                                              detection_log=self.log_path(video_path, "static"),
+                                                              adaptive=self.adaptive)
 
     def select_terrain_video(self):
         """Выбор видео для обработки рельефа."""
+        video_path = self.choose_source("Выберите видео для распознавания рельефа и типа поверхности")
+        if video_path:
+            self.open_video_window(self.process_terrain_video, video_path, resource="terrain")
+
+    def process_terrain_video(self, video_path, canvas, window):
+        """Обработка рельефа и типа поверхности."""
         if self.terrain_processor is None:
             print("Загрузка модели для распознавания рельефа и типа поверхности...")
             self.terrain_processor = TerrainModelLoader()
             print("Модель для рельефа и типа поверхности успешно загружена.")
-        
-        video_path = filedialog.askopenfilename(
-            title="Выберите видео для распознавания рельефа и типа поверхности",
-            filetypes=[("Видео файлы", "*.mp4 *.avi")]
+        video_processor = self.terrain_processor.get_video_processor()
+        if self.metrics is not None:
+            video_processor.enable_metrics(**self.metrics)
+        if self.result_cache is not None:
+            video_processor.enable_result_cache(self.result_cache)
+        video_processor.enable_detection_log(self.log_path(video_path, "terrain"))
+        if self.adaptive is not None and video_processor.adaptive is None:
+            video_processor.enable_adaptive_resolution(**self.adaptive)
+        current_session().add_cleanup(video_processor.terrain_grid.reset)
+        video_processor.start_video_stream(video_path, canvas, window)
+
+    def select_combined_video(self):
+        """Выбор видео для одновременной обработки всеми анализами."""
+        video_path = self.choose_source("Выберите видео для всех анализов")
+        if video_path:
+            self.open_video_window(self.process_combined_video, video_path, resource="combined")
+
+    def process_combined_video(self, video_path, canvas, window):
+        """Мобильные, статичные объекты и рельеф на одном декодированном потоке."""
+        try:
+            if self.combined_processor is None:
+                print("Загрузка моделей для всех анализов...")
+                self.combined_processor = load_combined_processor()
+                print("Модели успешно загружены.")
+
+            if self.metrics is not None:
+                self.combined_processor.enable_metrics(**self.metrics)
+            if self.result_cache is not None:
+                self.combined_processor.enable_result_cache(self.result_cache)
+            self.combined_processor.enable_detection_log(self.log_path(video_path, "combined"))
+            current_session().add_cleanup(self.combined_processor.reset)
+            self.combined_processor.process_video(video_path, canvas, window)
+        except Exception as e:
+            print(f"Ошибка обработки видео: {e}")
+            window.destroy()
+
+    def select_replay_log(self):
+        """Выбор журнала .rslog (и видео, если записанный в журнале путь недоступен)."""
+        log_path = filedialog.askopenfilename(
+            title="Выберите журнал анализа",
+            filetypes=[("Журналы RoboSight", "*.rslog")]
         )
+        if not log_path:
+            return
+        try:
+            replayer = LogReplayer(log_path)
+        except Exception as e:
+            print(f"Ошибка чтения журнала: {e}")
+            return
+        video_path = replayer.source
+        if not video_path or not Path(video_path).exists():
+            video_path = filedialog.askopenfilename(
+                title="Выберите видео, для которого записан журнал",
+                filetypes=[("Видео файлы", "*.mp4 *.avi")]
+            )
         if video_path:
-            self.open_video_window(self.process_terrain_video, video_path)
+            self.open_video_window(
+                lambda path, canvas, window: self.process_replay(replayer, path, canvas, window), video_path
+            )
 
-    def process_terrain_video(self, video_path, canvas, window):
-        """Обработка рельефа и типа поверхности."""
-        video_processor = self.terrain_processor.get_video_processor()
-        video_processor.start_video_stream(video_path, canvas, window)
+    def process_replay(self, replayer, video_path, canvas, window):
+        """Воспроизведение видео с разметкой из журнала, модели не загружаются."""
+        try:
+            if self.metrics is not None:
+                replayer.enable_metrics(**self.metrics)
+            replayer.process_video(video_path, canvas, window)
+        except Exception as e:
+            print(f"Ошибка воспроизведения журнала: {e}")
+            window.destroy()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RoboSight")
+    parser.add_argument("--hud", action="store_true", help="показывать метрики производительности на кадре")
+    parser.add_argument("--metrics", help="файл метрик: .prom (Prometheus) или .json")
+    parser.add_argument("--cache", nargs="?", const=str(CACHE_DIR),
+                        help="кэш результатов для повторно открываемых видео (каталог, по умолчанию %(const)s)")
+    parser.add_argument("--cache-size", type=float, default=20.0, help="лимит размера кэша, ГиБ")
+    parser.add_argument("--target-fps", type=float,
+                        help="подбирать размер входа моделей и шаг кадров под эту частоту кадров")
+    parser.add_argument("--adaptive-log", help="журнал переключений размера входа (JSON Lines)")
+    parser.add_argument("--max-sessions", type=int, default=2,
+                        help="число одновременных обработок; остальные ждут свободного потока")
+    parser.add_argument("--log-dir", help="каталог для журналов .rslog каждой обработки (просмотр без моделей)")
+    args = parser.parse_args()
+    metrics = {"hud": args.hud, "path": args.metrics} if args.hud or args.metrics else None
+    adaptive = {"target_fps": args.target_fps, "log_path": args.adaptive_log} if args.target_fps else None
+    result_cache = ResultCache(args.cache, max_bytes=int(args.cache_size * 1024 ** 3)) if args.cache else None
+
     root = tk.Tk()
-    app = VideoApp(root)
+    app = VideoApp(root, preload_models=True, metrics=metrics, result_cache=result_cache, log_dir=args.log_dir,
+                   adaptive=adaptive, max_sessions=args.max_sessions)
+    root.protocol("WM_DELETE_WINDOW", app.close)
     root.mainloop()
@@ -0,0 +1,168 @@
+import cv2
+import numpy as np
+
+from module_mobile_object import DetectionMerger
+
+# Способы переноса боксов между ключевыми кадрами
+LUCAS_KANADE = "lk"
+HOMOGRAPHY = "homography"
+
+
+class KeyframeDetector:
+    """Детекция статичных объектов только на ключевых кадрах.
+
+    detect(frame) возвращает список (box, label, conf, size), как
+    ObjectDetectionProcessor._process_frame. Ключевой кадр выбирается по
+    интервалу, по смене сцены (средняя разность уменьшенного серого кадра
+    с ключевым выше scene_change_threshold) или когда не удалось оценить
+    движение. Между ключевыми кадрами боксы переносятся с предыдущего кадра
+    разреженным потоком Лукаса-Канаде: method="lk" сдвигает каждый бокс на
+    медианное смещение точек внутри него, method="homography" применяет ко
+    всем боксам общую гомографию кадра.
+
+    evaluate_every > 0 включает контрольную полную детекцию на каждом N-м
+    перенесённом кадре, по которой считается доля совпадений (hit rate).
+    """
+
+    def __init__(self, detect, interval=10, scene_change_threshold=25.0, method=LUCAS_KANADE,
+                 probe_width=320, evaluate_every=0, match_iou=0.5):
+        if method not in (LUCAS_KANADE, HOMOGRAPHY):
+            raise ValueError(f"Unknown propagation method: {method}")
+        self.detect = detect
+        self.interval = interval
+        self.scene_change_threshold = scene_change_threshold
+        self.method = method
+        self.probe_width = probe_width
+        self.evaluate_every = evaluate_every
+        self.match_iou = match_iou
+        self._iou = DetectionMerger(pixel_offset=False).pairwise_iou
+
+        self._detections = []
+        self._prev_probe = None
+        self._key_probe = None
+        self._scale = 1.0
+        self._since_key = 0
+
+        self.frames = 0
+        self.keyframes = 0
+        self.scene_changes = 0
+        self._evaluations = []
+
+    def _probe(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        self._scale = frame.shape[1] / self.probe_width
+        height = max(1, int(round(frame.shape[0] / self._scale)))
+        return cv2.resize(gray, (self.probe_width, height), interpolation=cv2.INTER_AREA)
+
+    def _keyframe(self, frame, probe):
+        self._detections = self.detect(frame)
+        self._key_probe = probe
+        self._prev_probe = probe
+        self._since_key = 0
+        self.keyframes += 1
+        return self._detections
+
+    def _track_points(self, probe):
+        points = cv2.goodFeaturesToTrack(self._prev_probe, maxCorners=200, qualityLevel=0.01, minDistance=5)
+        if points is None or len(points) < 8:
+            return None
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_probe, probe, points, None)
+        good = status.ravel() == 1
+        if good.sum() < 8:
+            return None
+        # Координаты точек в масштабе исходного кадра
+        return points[good].reshape(-1, 2) * self._scale, moved[good].reshape(-1, 2) * self._scale
+
+    def _propagate(self, frame, tracked):
+        previous, current = tracked
+        height, width = frame.shape[:2]
+        if self.method == HOMOGRAPHY:
+            homography, _ = cv2.findHomography(previous, current, cv2.RANSAC, 3.0)
+            if homography is None:
+                return None
+
+        propagated = []
+        for box, label, conf, size in self._detections:
+            if self.method == HOMOGRAPHY:
+                corners = np.float32([[box[0], box[1]], [box[2], box[1]], [box[2], box[3]], [box[0], box[3]]])
+                corners = cv2.perspectiveTransform(corners.reshape(-1, 1, 2), homography).reshape(-1, 2)
+                x1, y1 = corners.min(axis=0)
+                x2, y2 = corners.max(axis=0)
+            else:
+                inside = ((previous[:, 0] >= box[0]) & (previous[:, 0] <= box[2]) &
+                          (previous[:, 1] >= box[1]) & (previous[:, 1] <= box[3]))
+                # Без точек внутри бокса используется общее движение кадра
+                displacement = current[inside] - previous[inside] if inside.sum() >= 3 else current - previous
+                dx, dy = np.median(displacement, axis=0)
+                x1, y1, x2, y2 = box[0] + dx, box[1] + dy, box[2] + dx, box[3] + dy
+
+            new_box = np.array([
+                np.clip(x1, 0, width - 1), np.clip(y1, 0, height - 1),
+                np.clip(x2, 0, width - 1), np.clip(y2, 0, height - 1),
+            ]).round().astype(int)
+            if new_box[2] <= new_box[0] or new_box[3] <= new_box[1]:
+                continue  # объект ушёл из кадра
+            new_size = (new_box[2] - new_box[0]) * (new_box[3] - new_box[1])
+            propagated.append((new_box, label, conf, new_size))
+        return propagated
+
+    def _evaluate(self, frame, propagated):
+        reference = self.detect(frame)
+        matched = 0
+        if propagated and reference:
+            boxes = np.array([d[0] for d in propagated] + [d[0] for d in reference], dtype=np.float32)
+            iou = self._iou(boxes)[:len(propagated), len(propagated):]
+            same_label = np.array([[p[1] == r[1] for r in reference] for p in propagated])
+            iou = np.where(same_label, iou, 0)
+            # Жадное сопоставление по убыванию IoU
+            used_rows, used_cols = set(), set()
+            for flat in np.argsort(-iou, axis=None):
+                row, col = np.unravel_index(flat, iou.shape)
+                if iou[row, col] < self.match_iou:
+                    break
+                if row in used_rows or col in used_cols:
+                    continue
+                used_rows.add(row)
+                used_cols.add(col)
+                matched += 1
+        self._evaluations.append((matched, len(propagated), len(reference)))
+
+    def __call__(self, frame):
+        self.frames += 1
+        probe = self._probe(frame)
+        if self._prev_probe is None or self._prev_probe.shape != probe.shape or self._since_key + 1 >= self.interval:
+            return self._keyframe(frame, probe)
+
+        if float(cv2.absdiff(probe, self._key_probe).mean()) > self.scene_change_threshold:
+            self.scene_changes += 1
+            return self._keyframe(frame, probe)
+
+        if self._detections:
+            tracked = self._track_points(probe)
+            propagated = self._propagate(frame, tracked) if tracked is not None else None
+        else:
+            propagated = []
+        if propagated is None:
+            return self._keyframe(frame, probe)
+
+        self._detections = propagated
+        self._prev_probe = probe
+        self._since_key += 1
+        if self.evaluate_every and self._since_key % self.evaluate_every == 0:
+            self._evaluate(frame, propagated)
+        return propagated
+
+    def stats(self):
+        """Число вызовов моделей и доля совпадений с полной покадровой детекцией."""
+        matched = sum(e[0] for e in self._evaluations)
+        propagated = sum(e[1] for e in self._evaluations)
+        reference = sum(e[2] for e in self._evaluations)
+        return {
+            "frames": self.frames,
+            "keyframes": self.keyframes,
+            "scene_changes": self.scene_changes,
+            "detection_ratio": self.keyframes / max(self.frames, 1),
+            "evaluations": len(self._evaluations),
+            "hit_rate": matched / reference if reference else None,
+            "precision": matched / propagated if propagated else None,
+        }
@@ -0,0 +1,212 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+
+class _StageTimer:
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.stage, (time.perf_counter() - self.start) * 1000)
+        return False
+
+
+class PerformanceMetrics:
+    """Метрики цикла обработки кадров: скользящие p50/p95 по стадиям и счётчики.
+
+    Стадии измеряются контекстом stage(name) из любых потоков конвейера;
+    в окне хранятся последние window измерений каждой стадии. Модели
+    учитываются отдельно: record_model(name, ms) добавляет стадию
+    model:<name> и счётчик вызовов. frame_presented() учитывает выведенный
+    кадр, число отброшенных кадров (часы воспроизведения и очереди
+    конвейера) и раз в write_interval секунд перезаписывает файл метрик:
+    .prom - текстовый формат Prometheus (node_exporter textfile), иначе JSON.
+    Выключенный слой - NULL_METRICS: все вызовы пустые.
+    """
+
+    enabled = True
+
+    def __init__(self, name, window=120, hud=False, path=None, write_interval=1.0, hud_interval=0.5):
+        self.name = name
+        self.window = window
+        self.hud = hud
+        self.path = Path(path) if path else None
+        self.write_interval = write_interval
+        self.hud_interval = hud_interval
+
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._model_calls = {}
+        self.frames_in = 0
+        self.frames_out = 0
+        self.dropped = 0
+        self._started = time.perf_counter()
+        self._last_write = 0.0
+        self._hud_lines = []
+        self._hud_updated = 0.0
+
+    # Сбор
+
+    def stage(self, stage):
+        return _StageTimer(self, stage)
+
+    def record(self, stage, ms):
+        samples = self._samples.get(stage)
+        if samples is None:
+            with self._lock:
+                samples = self._samples.setdefault(stage, deque(maxlen=self.window))
+        samples.append(ms)
+
+    def record_model(self, model, ms):
+        self.record(f"model:{model}", ms)
+        with self._lock:
+            self._model_calls[model] = self._model_calls.get(model, 0) + 1
+
+    def frame_decoded(self):
+        with self._lock:
+            self.frames_in += 1
+
+    def frame_presented(self, clock=None, pipeline=None):
+        dropped = clock.dropped if clock is not None else 0
+        if pipeline is not None:
+            dropped += sum(stats.dropped for stats in pipeline.stages.values())
+        with self._lock:
+            self.frames_out += 1
+            self.dropped = dropped
+        now = time.perf_counter()
+        if self.path is not None and now - self._last_write >= self.write_interval:
+            self._last_write = now
+            self.write()
+
+    # Отчёт
+
+    def snapshot(self):
+        with self._lock:
+            samples = {stage: np.fromiter(values, dtype=np.float64) for stage, values in self._samples.items()}
+            snapshot = {
+                "pipeline": self.name,
+                "uptime_s": time.perf_counter() - self._started,
+                "frames_in": self.frames_in,
+                "frames_out": self.frames_out,
+                "dropped": self.dropped,
+                "model_calls": dict(self._model_calls),
+            }
+        snapshot["fps"] = snapshot["frames_out"] / max(snapshot["uptime_s"], 1e-9)
+        snapshot["stages"] = {
+            stage: {
+                "p50_ms": float(np.percentile(values, 50)),
+                "p95_ms": float(np.percentile(values, 95)),
+                "samples": len(values),
+            }
+            for stage, values in samples.items() if len(values)
+        }
+        return snapshot
+
+    def to_prometheus(self, snapshot=None):
+        snapshot = snapshot or self.snapshot()
+        label = f'pipeline="{snapshot["pipeline"]}"'
+        lines = [
+            "# TYPE robosight_stage_ms gauge",
+            *(
+                f'robosight_stage_ms{{{label},stage="{stage}",quantile="{q}"}} {row[key]:.3f}'
+                for stage, row in snapshot["stages"].items()
+                for q, key in (("0.5", "p50_ms"), ("0.95", "p95_ms"))
+            ),
+            "# TYPE robosight_frames_total counter",
+            f'robosight_frames_total{{{label},direction="in"}} {snapshot["frames_in"]}',
+            f'robosight_frames_total{{{label},direction="out"}} {snapshot["frames_out"]}',
+            "# TYPE robosight_dropped_frames_total counter",
+            f'robosight_dropped_frames_total{{{label}}} {snapshot["dropped"]}',
+            "# TYPE robosight_model_calls_total counter",
+            *(
+                f'robosight_model_calls_total{{{label},model="{model}"}} {calls}'
+                for model, calls in snapshot["model_calls"].items()
+            ),
+            "# TYPE robosight_fps gauge",
+            f'robosight_fps{{{label}}} {snapshot["fps"]:.3f}',
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """Атомарная перезапись файла метрик: читатель не увидит недописанный файл."""
+        if self.path is None:
+            return
+        snapshot = self.snapshot()
+        if self.path.suffix == ".prom":
+            text = self.to_prometheus(snapshot)
+        else:
+            text = json.dumps(snapshot, ensure_ascii=False, indent=2)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_name(self.path.name + ".tmp")
+        temporary.write_text(text, encoding="utf-8")
+        os.replace(temporary, self.path)
+
+    def draw_hud(self, frame):
+        """Наложение метрик на кадр; текст пересчитывается не чаще hud_interval."""
+        if not self.hud:
+            return frame
+        now = time.perf_counter()
+        if now - self._hud_updated >= self.hud_interval:
+            self._hud_updated = now
+            snapshot = self.snapshot()
+            self._hud_lines = [
+                f"{snapshot['fps']:.1f} FPS  in {snapshot['frames_in']}  out {snapshot['frames_out']}  "
+                f"dropped {snapshot['dropped']}",
+                *(f"{stage}: p50 {row['p50_ms']:.1f} / p95 {row['p95_ms']:.1f} ms"
+                  for stage, row in snapshot["stages"].items()),
+            ]
+        for i, line in enumerate(self._hud_lines):
+            y = 20 + 18 * i
+            cv2.putText(frame, line, (10, y), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (0, 0, 0), 3)
+            cv2.putText(frame, line, (10, y), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (255, 255, 255), 1)
+        return frame
+
+    def close(self):
+        self.write()
+
+
+class NullMetrics:
+    """Выключенные метрики: те же методы без какой-либо работы."""
+
+    enabled = False
+    _context = nullcontext()
+
+    def stage(self, stage):
+        return self._context
+
+    def record(self, stage, ms):
+        pass
+
+    def record_model(self, model, ms):
+        pass
+
+    def frame_decoded(self):
+        pass
+
+    def frame_presented(self, clock=None, pipeline=None):
+        pass
+
+    def draw_hud(self, frame):
+        return frame
+
+    def snapshot(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+NULL_METRICS = NullMetrics()
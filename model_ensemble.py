@@ -0,0 +1,275 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+
+
+class ModelOutput:
+    """Результат одной модели ансамбля в координатах исходного кадра."""
+
+    def __init__(self, name, names, boxes, scores, ids, class_ids, latency_ms):
+        self.name = name
+        self.names = names            # словарь class_id -> имя класса модели
+        self.boxes = boxes            # (N, 4) float32, xyxy
+        self.scores = scores          # (N,) float32
+        self.ids = ids                # (N,) int или None, если трекер не выдал id
+        self.class_ids = class_ids    # (N,) int
+        self.latency_ms = latency_ms
+
+    def __len__(self):
+        return len(self.boxes)
+
+
+class SharedLetterbox:
+    """Letterbox текущего кадра, общий для нескольких ансамблей.
+
+    begin(frame) объявляет новый кадр; ансамбли с тем же размером входа и
+    цветом полей получают для него один и тот же тензор вместо повторного
+    препроцессинга. Для других кадров letterbox считается как обычно.
+    """
+
+    def __init__(self):
+        self.frame = None
+        self._results = {}
+        self.hits = 0
+        self.misses = 0
+
+    def begin(self, frame):
+        self.frame = frame
+        self._results = {}
+
+    def get(self, ensemble, frame):
+        if frame is not self.frame:
+            return ensemble.letterbox(frame)
+        key = (ensemble.imgsz, ensemble.pad_value)
+        result = self._results.get(key)
+        if result is None:
+            result = self._results[key] = ensemble.letterbox(frame)
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+
+class ModelEnsemble:
+    """Параллельный запуск нескольких YOLO-моделей на одном кадре.
+
+    Кадр один раз приводится к letterbox-тензору (BCHW, RGB, 0..1), который
+    затем передаётся всем моделям - ultralytics не повторяет препроцессинг
+    для тензорного входа. Модели выполняются в пуле потоков: torch отпускает
+    GIL во время инференса, поэтому задержка кадра близка к задержке самой
+    медленной модели, а не к их сумме.
+    """
+
+    def __init__(self, models, imgsz=640, names=None, concurrent=True, reuse_letterbox=True,
+                 max_workers=None, pad_value=114):
+        self.models = list(models)
+        self.imgsz = imgsz
+        self.names = list(names) if names is not None else [self._model_name(m, i) for i, m in enumerate(self.models)]
+        self.concurrent = concurrent
+        self.reuse_letterbox = reuse_letterbox
+        self.max_workers = max_workers or max(1, len(self.models))
+        self.pad_value = pad_value
+        self.shared_letterbox = None  # SharedLetterbox, общий с другими ансамблями
+
+        self._executor = None
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @staticmethod
+    def _model_path(model):
+        # У моделей, загруженных из ONNX, ckpt_path пуст, путь хранится в model_name
+        for attr in ("ckpt_path", "model_name"):
+            path = getattr(model, attr, None)
+            if isinstance(path, (str, Path)) and path:
+                return Path(path)
+        return None
+
+    @classmethod
+    def _model_name(cls, model, index):
+        path = cls._model_path(model)
+        return path.stem if path is not None else f"model{index}"
+
+    @property
+    def resizable(self):
+        """Можно ли менять imgsz: ONNX-модели экспортированы с фиксированным размером входа."""
+        paths = (self._model_path(model) for model in self.models)
+        return not any(path is not None and path.suffix == ".onnx" for path in paths)
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ensemble")
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def letterbox(self, frame, imgsz=None):
+        """BGR-кадр -> (тензор 1x3xSxS, коэффициент масштаба, (pad_x, pad_y)); S = imgsz или self.imgsz."""
+        imgsz = imgsz or self.imgsz
+        height, width = frame.shape[:2]
+        ratio = min(imgsz / height, imgsz / width)
+        new_width, new_height = int(round(width * ratio)), int(round(height * ratio))
+        pad_x, pad_y = (imgsz - new_width) / 2, (imgsz - new_height) / 2
+
+        if (new_width, new_height) != (width, height):
+            frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+        top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+        left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+        padded = cv2.copyMakeBorder(frame, top, bottom, left, right, cv2.BORDER_CONSTANT,
+                                    value=(self.pad_value,) * 3)
+
+        # BGR -> RGB, HWC -> CHW; ultralytics не меняет порядок каналов у тензоров
+        rgb = np.ascontiguousarray(padded[:, :, ::-1].transpose(2, 0, 1))
+        tensor = torch.from_numpy(rgb).float().div_(255.0).unsqueeze(0)
+        return tensor, ratio, (left, top)
+
+    @staticmethod
+    def scale_boxes(boxes, ratio, pad, frame_shape):
+        """Перевод боксов из координат letterbox в координаты исходного кадра."""
+        boxes = boxes.astype(np.float32, copy=True)
+        xs, ys = boxes[:, 0::2], boxes[:, 1::2]
+        xs -= pad[0]
+        ys -= pad[1]
+        boxes /= ratio
+        np.clip(xs, 0, frame_shape[1] - 1, out=xs)
+        np.clip(ys, 0, frame_shape[0] - 1, out=ys)
+        return boxes
+
+    def _run_model(self, index, source, letterbox_info, frame_shape, method, kwargs):
+        model = self.models[index]
+        start = time.perf_counter()
+        results = getattr(model, method)(source, imgsz=self.imgsz, verbose=False, **kwargs)
+        latency_ms = (time.perf_counter() - start) * 1000
+        return self._output(index, results[0], letterbox_info, frame_shape, latency_ms)
+
+    def _output(self, index, result, letterbox_info, frame_shape, latency_ms):
+        model = self.models[index]
+        result_boxes = result.boxes
+        if result_boxes is None or len(result_boxes) == 0:
+            empty = np.empty(0, dtype=np.float32)
+            return ModelOutput(self.names[index], model.names, np.empty((0, 4), dtype=np.float32), empty,
+                               None, empty.astype(int), latency_ms)
+
+        boxes = result_boxes.xyxy.cpu().numpy()
+        if letterbox_info is not None:
+            boxes = self.scale_boxes(boxes, *letterbox_info, frame_shape)
+        ids = result_boxes.id.cpu().numpy().astype(int) if result_boxes.id is not None else None
+        return ModelOutput(
+            self.names[index],
+            model.names,
+            boxes,
+            result_boxes.conf.cpu().numpy(),
+            ids,
+            result_boxes.cls.cpu().numpy().astype(int),
+            latency_ms,
+        )
+
+    def _run_model_batch(self, index, batch, imgsz, letterboxed, frames, kwargs):
+        model = self.models[index]
+        start = time.perf_counter()
+        results = model.predict(batch, imgsz=imgsz, verbose=False, **kwargs)
+        latency_ms = (time.perf_counter() - start) * 1000
+        return [
+            self._output(index, result, (ratio, pad), frame.shape[:2], latency_ms)
+            for result, (_, ratio, pad), frame in zip(results, letterboxed, frames)
+        ]
+
+    def predict_batch(self, frames, imgsz=None, **kwargs):
+        """Один вызов каждой модели на пакете кадров; возвращает по кадру список ModelOutput.
+
+        Кадры могут иметь разные размеры: каждый приводится к letterbox
+        imgsz x imgsz отдельно (по умолчанию self.imgsz; меньший размер - для
+        вырезанных фрагментов кадра). latency_ms у выходов - время вызова на весь пакет.
+        """
+        imgsz = imgsz or self.imgsz
+        start = time.perf_counter()
+        letterboxed = [self.letterbox(frame, imgsz) for frame in frames]
+        batch = torch.cat([tensor for tensor, _, _ in letterboxed])
+        preprocess_ms = (time.perf_counter() - start) * 1000
+
+        args = (batch, imgsz, letterboxed, frames, kwargs)
+        if self.concurrent and len(self.models) > 1:
+            executor = self._get_executor()
+            futures = [executor.submit(self._run_model_batch, i, *args) for i in range(len(self.models))]
+            per_model = [future.result() for future in futures]
+        else:
+            per_model = [self._run_model_batch(i, *args) for i in range(len(self.models))]
+
+        total_ms = (time.perf_counter() - start) * 1000
+        outputs = [list(frame_outputs) for frame_outputs in zip(*per_model)] if per_model else [[] for _ in frames]
+        if outputs:
+            self._record(outputs[0], preprocess_ms, total_ms)
+        return outputs
+
+    def run(self, frame, method="predict", **kwargs):
+        """Запуск всех моделей на кадре; возвращает список ModelOutput в порядке моделей."""
+        start = time.perf_counter()
+        if self.reuse_letterbox:
+            if self.shared_letterbox is not None:
+                source, ratio, pad = self.shared_letterbox.get(self, frame)
+            else:
+                source, ratio, pad = self.letterbox(frame)
+            letterbox_info = (ratio, pad)
+        else:
+            source, letterbox_info = frame, None
+        preprocess_ms = (time.perf_counter() - start) * 1000
+
+        args = (source, letterbox_info, frame.shape[:2], method, kwargs)
+        if self.concurrent and len(self.models) > 1:
+            executor = self._get_executor()
+            futures = [executor.submit(self._run_model, i, *args) for i in range(len(self.models))]
+            outputs = [future.result() for future in futures]
+        else:
+            outputs = [self._run_model(i, *args) for i in range(len(self.models))]
+
+        total_ms = (time.perf_counter() - start) * 1000
+        self._record(outputs, preprocess_ms, total_ms)
+        return outputs
+
+    def track(self, frame, **kwargs):
+        return self.run(frame, method="track", **kwargs)
+
+    def predict(self, frame, **kwargs):
+        return self.run(frame, method="predict", **kwargs)
+
+    def reset_stats(self):
+        with self._lock:
+            self.frames = 0
+            self.model_ms = {name: 0.0 for name in self.names}
+            self.preprocess_ms = 0.0
+            self.total_ms = 0.0
+            self.last_latency = {}
+
+    def _record(self, outputs, preprocess_ms, total_ms):
+        with self._lock:
+            self.frames += 1
+            self.preprocess_ms += preprocess_ms
+            self.total_ms += total_ms
+            self.last_latency = {output.name: output.latency_ms for output in outputs}
+            self.last_latency["preprocess"] = preprocess_ms
+            self.last_latency["total"] = total_ms
+            for output in outputs:
+                self.model_ms[output.name] = self.model_ms.get(output.name, 0.0) + output.latency_ms
+
+    def latency_report(self):
+        """Средние задержки (мс/кадр) по моделям, итоговая и ускорение относительно последовательного запуска."""
+        with self._lock:
+            frames = max(self.frames, 1)
+            per_model = {name: total / frames for name, total in self.model_ms.items()}
+            sequential_ms = sum(per_model.values()) + self.preprocess_ms / frames
+            total_ms = self.total_ms / frames
+            return {
+                "frames": self.frames,
+                "per_model_ms": per_model,
+                "preprocess_ms": self.preprocess_ms / frames,
+                "total_ms": total_ms,
+                "sequential_ms": sequential_ms,
+                "speedup": sequential_ms / total_ms if total_ms > 0 else 1.0,
+            }
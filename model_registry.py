@@ -0,0 +1,161 @@
+import copy
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ModelEntry:
+    """Загруженная модель и время её загрузки и прогрева."""
+
+    def __init__(self, path, tag, mtime, model, load_ms, warmup_ms):
+        self.path = path
+        self.tag = tag
+        self.mtime = mtime
+        self.model = model
+        self.load_ms = load_ms
+        self.warmup_ms = warmup_ms
+
+
+class ModelRegistry:
+    """Общий для процесса кэш моделей.
+
+    Модель загружается один раз и хранится по ключу (путь, mtime, tag):
+    tag различает разные способы загрузки одного файла, например режимы
+    движка рельефа. Изменённый на диске файл загружается заново. Если
+    модель уже загружается в другом потоке (например, фоновой
+    предзагрузкой), вызывающий поток дожидается этой загрузки, а не
+    запускает вторую.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._preload_thread = None
+
+    @staticmethod
+    def _key(path, tag):
+        path = Path(path).resolve()
+        return str(path), tag, path.stat().st_mtime_ns
+
+    def get(self, path, factory, tag="", warmup=None):
+        """Модель для файла path: factory(path) загружает её, warmup(model) прогревает."""
+        key = self._key(path, tag)
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                # Устаревшие версии того же файла больше не нужны
+                for stale in [k for k in self._futures if k[:2] == key[:2]]:
+                    del self._futures[stale]
+                future = Future()
+                self._futures[key] = future
+
+        if owner:
+            try:
+                future.set_result(self._load(key, factory, warmup))
+            except Exception as e:
+                with self._lock:
+                    self._futures.pop(key, None)
+                future.set_exception(e)
+        return future.result().model
+
+    @staticmethod
+    def _load(key, factory, warmup):
+        path, tag, mtime = key
+        start = time.perf_counter()
+        model = factory(path)
+        load_ms = (time.perf_counter() - start) * 1000
+
+        warmup_ms = 0.0
+        if warmup is not None:
+            start = time.perf_counter()
+            warmup(model)
+            warmup_ms = (time.perf_counter() - start) * 1000
+        logger.info("Модель %s загружена за %.0f мс, прогрев %.0f мс", path, load_ms, warmup_ms)
+        return ModelEntry(path, tag, mtime, model, load_ms, warmup_ms)
+
+    def preload(self, loaders):
+        """Фоновая загрузка: loaders - функции без аргументов, обращающиеся к реестру."""
+        def run():
+            for loader in loaders:
+                try:
+                    loader()
+                except Exception as e:
+                    logger.warning("Не удалось предзагрузить модель: %s", e)
+
+        self._preload_thread = threading.Thread(target=run, name="model-preload", daemon=True)
+        self._preload_thread.start()
+        return self._preload_thread
+
+    def wait_preload(self, timeout=None):
+        if self._preload_thread is not None:
+            self._preload_thread.join(timeout)
+
+    def timings(self):
+        """Время загрузки и прогрева по каждой загруженной модели."""
+        with self._lock:
+            futures = list(self._futures.values())
+        return [
+            {
+                "path": entry.path,
+                "tag": entry.tag,
+                "load_ms": entry.load_ms,
+                "warmup_ms": entry.warmup_ms,
+            }
+            for entry in (f.result() for f in futures if f.done() and f.exception() is None)
+        ]
+
+    def clear(self):
+        with self._lock:
+            self._futures.clear()
+
+
+# Реестр моделей процесса
+REGISTRY = ModelRegistry()
+
+
+def load_yolo(path, imgsz=640, warmup=True, backend="torch"):
+    """YOLO-модель из реестра: загружается и объединяет слои (fuse) один раз.
+
+    backend="onnx" или "onnx-int8" загружает экспортированную ONNX-версию
+    весов (см. inference_backends.py) с тем же API predict/track.
+    """
+    from ultralytics import YOLO
+
+    def factory(model_path):
+        if backend != "torch":
+            from inference_backends import ONNX_INT8, load_yolo_onnx
+            return load_yolo_onnx(model_path, imgsz, int8=backend == ONNX_INT8)
+        model = YOLO(model_path)
+        model.fuse()
+        return model
+
+    def warm(model):
+        model.predict(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), imgsz=imgsz, verbose=False)
+
+    tag = "yolo" if backend == "torch" else f"yolo-{backend}-{imgsz}"
+    return REGISTRY.get(path, factory, tag=tag, warmup=warm if warmup else None)
+
+
+def own_predictor(model):
+    """Копия модели из реестра с общими весами и собственным предиктором.
+
+    Ultralytics хранит предиктор и трекеры track(persist=True) в объекте
+    модели, и они не потокобезопасны. У каждого обработчика должна быть
+    своя копия: предиктор (с трекерами) создаётся при её первом вызове
+    поверх тех же загруженных весов.
+    """
+    model = copy.copy(model)
+    if hasattr(model, "predictor"):
+        model.predictor = None
+    callbacks = getattr(model, "callbacks", None)
+    if isinstance(callbacks, dict):
+        # track() регистрирует трекер колбэком: списки колбэков тоже у каждой копии свои
+        model.callbacks = {event: list(functions) for event, functions in callbacks.items()}
+    return model
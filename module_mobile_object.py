@@ -1,141 +1,424 @@
 import cv2
-from ultralytics import YOLO
-import random
 import numpy as np
-from PIL import Image, ImageTk
-import threading
-import tkinter as tk
+import time
 from pathlib import Path
+from metrics import NULL_METRICS, PerformanceMetrics
+from model_ensemble import ModelEnsemble
+from model_registry import load_yolo, own_predictor
+from pipeline import OFFLINE, StagedPipeline
+from playback_clock import PlaybackClock
+from presenter import TkPresenter, fit_frame, track_color
+from columnar_log import open_log_writer
+from frame_source import open_source
+from result_cache import NULL_CACHE_ENTRY, model_paths
+from track_store import TrackStore
 
 class DetectionMerger:
-    def __init__(self, iou_threshold=0.5):
+    """Объединение детекций нескольких моделей жадным подавлением по IoU.
+
+    Детекции представляются массивом (N, 6): x1, y1, x2, y2, score, obj_id,
+    плюс массивом целочисленных кодов классов. IoU считается одной попарной
+    матрицей, после чего боксы перебираются по убыванию score, и каждый
+    оставленный бокс подавляет все менее уверенные, пересекающиеся с ним
+    сильнее порога.
+    """
+
+    def __init__(self, iou_threshold=0.5, class_aware=False, pixel_offset=True):
         self.iou_threshold = iou_threshold
+        # class_aware=True - объединяются только боксы одного класса,
+        # False - боксы разных моделей подавляют друг друга (как раньше)
+        self.class_aware = class_aware
+        # Соглашение "+1 пиксель": бокс (x1, x2) включает оба края
+        self.pixel_offset = pixel_offset
+
+    def pairwise_iou(self, boxes):
+        """Матрица IoU (N, N) для боксов (N, 4) в формате xyxy."""
+        boxes = np.asarray(boxes, dtype=np.float32)
+        offset = np.float32(1.0 if self.pixel_offset else 0.0)
+        x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+        areas = (x2 - x1 + offset) * (y2 - y1 + offset)
+
+        inter_w = np.minimum(x2[:, None], x2[None, :])
+        inter_w -= np.maximum(x1[:, None], x1[None, :])
+        inter_w += offset
+        np.maximum(inter_w, 0, out=inter_w)
+
+        inter_h = np.minimum(y2[:, None], y2[None, :])
+        inter_h -= np.maximum(y1[:, None], y1[None, :])
+        inter_h += offset
+        np.maximum(inter_h, 0, out=inter_h)
+
+        inter = np.multiply(inter_w, inter_h, out=inter_w)
+        del inter_h
+        union = areas[:, None] + areas[None, :]
+        union -= inter
+        np.maximum(union, np.finfo(np.float32).eps, out=union)
+        return np.divide(inter, union, out=inter)
+
+    def merge_array(self, boxes, class_codes=None):
+        """Индексы оставленных детекций, упорядоченные по убыванию score.
+
+        boxes - массив (N, 6), class_codes - массив (N,) целых кодов классов.
+        """
+        boxes = np.asarray(boxes)
+        if len(boxes) == 0:
+            return np.empty(0, dtype=np.intp)
+
+        order = np.argsort(-boxes[:, 4], kind="stable")
+        iou = self.pairwise_iou(boxes[order, :4])
+        if self.class_aware and class_codes is not None:
+            codes = np.asarray(class_codes)[order]
+            iou[codes[:, None] != codes[None, :]] = 0
+
+        suppressed = np.zeros(len(order), dtype=bool)
+        keep = []
+        for i in range(len(order)):
+            if suppressed[i]:
+                continue
+            keep.append(i)
+            suppressed[i + 1:] |= iou[i, i + 1:] > self.iou_threshold
+        return order[keep]
+
+    @staticmethod
+    def to_array(detections):
+        """Список [x1, y1, x2, y2, score, obj_id, class_name] -> (boxes, class_codes, class_names)."""
+        boxes = np.array([detection[:6] for detection in detections], dtype=np.float64).reshape(-1, 6)
+        class_names, class_codes = np.unique([detection[6] for detection in detections], return_inverse=True)
+        return boxes, class_codes.reshape(-1), class_names
 
     def merge_detections(self, detections):
-        merged_boxes = []
-        for detection in detections:
-            x1, y1, x2, y2, score, obj_id, class_name = detection
-            add_new = True
-            for i, merged_box in enumerate(merged_boxes):
-                mx1, my1, mx2, my2, mscore, mid, mclass_name = merged_box
-                inter_x1 = max(x1, mx1)
-                inter_y1 = max(y1, my1)
-                inter_x2 = min(x2, mx2)
-                inter_y2 = min(y2, my2)
-                inter_area = max(0, inter_x2 - inter_x1 + 1) * max(0, inter_y2 - inter_y1 + 1)
-
-                box_area = (x2 - x1 + 1) * (y2 - y1 + 1)
-                merged_area = (mx2 - mx1 + 1) * (my2 - my1 + 1)
-                iou = inter_area / float(box_area + merged_area - inter_area)
-
-                if iou > self.iou_threshold:
-                    if score > mscore:
-                        merged_boxes[i] = [x1, y1, x2, y2, score, obj_id, class_name]
-                    add_new = False
-                    break
-
-            if add_new:
-                merged_boxes.append([x1, y1, x2, y2, score, obj_id, class_name])
-        return merged_boxes
+        if not detections:
+            return []
+        boxes, class_codes, _ = self.to_array(detections)
+        keep = self.merge_array(boxes, class_codes)
+        return [list(detections[i]) for i in keep]
 
 
 class VideoProcessor:
-    def __init__(self, models, merger, show_video=False, save_video=False):
+    def __init__(self, models, merger, show_video=False, save_video=False, policy=OFFLINE, realtime=True):
         self.models = models
         self.merger = merger
+        # Модели ансамбля выполняются параллельно на общем letterbox-тензоре
+        self.ensemble = ModelEnsemble(models, imgsz=608)
         self.show_video = show_video
+        # save_video - путь к MP4 для записи размеченного видео (False - не сохранять)
         self.save_video = save_video
-        self.previous_positions = {}
-        self.previous_timestamps = {}
+        # Положения и сглаженные скорости треков; треки, пропавшие на 30 кадров, удаляются
+        self.tracks = TrackStore(max_age=30)
+        # Политика конвейера: live - отбрасывать кадры при отставании, offline - каждый кадр
+        self.policy = policy
+        self.pipeline_stats = None
+        # realtime - вывод на холст в темпе исходного видео с пропуском просроченных кадров
+        self.realtime = realtime
+        self.playback_stats = None
+        self.display_size = (800, 600)  # размер кадра на холсте
+        # Метрики по стадиям (см. enable_metrics); по умолчанию выключены
+        self.metrics = NULL_METRICS
+        # Детекция только в областях движения (см. enable_motion_gate); по умолчанию выключена
+        self.motion_gate = None
+        self._gate_tracker = None
+        self._gated_detections = []
+        # Дисковый кэш детекций для повторно открываемых видео (см. enable_result_cache)
+        self.result_cache = None
+        self.cache_stats = None
+        # Путь к журналу .rslog с детекциями, id и скоростями (см. enable_detection_log)
+        self.detection_log = None
+        # Подбор размера входа и шага кадров под целевую частоту (см. enable_adaptive_resolution)
+        self.adaptive = None
+        self._held = None
+        self._held_records = []
+        self._skipped = False
+        # Размер (ширина, высота), до которого источник уменьшает кадры при декодировании (None - исходный)
+        self.decode_size = None
+
+    def enable_detection_log(self, path):
+        """Запись детекций, id треков и скоростей каждого кадра в журнал .rslog (см. columnar_log)."""
+        self.detection_log = path
+        return path
+
+    def enable_result_cache(self, cache):
+        """Детекции кадров берутся из ResultCache, если видео уже обрабатывалось с теми же моделями."""
+        self.result_cache = cache
+        return cache
+
+    def _open_result_cache(self, video_path, frame_count=None, step=1):
+        # С адаптивным размером входа детекции зависят от нагрузки оборудования и не кэшируются
+        if self.result_cache is None or self.adaptive is not None or not Path(str(video_path)).is_file():
+            return NULL_CACHE_ENTRY
+        gate = self.motion_gate
+        params = {"imgsz": self.ensemble.imgsz, "conf": 0.7, "iou": 0.4, "merge_iou": self.merger.iou_threshold,
+                  "motion_gate": [gate.var_threshold, gate.min_blob_area] if gate is not None else None}
+        if self.decode_size is not None:
+            params["decode_size"] = list(self.decode_size)
+        entry = self.result_cache.open(video_path, "mobile", model_paths(self.models), params)
+        # Id треков частично посчитанной записи не согласуются с живым запуском:
+        # такая запись пересчитывается целиком
+        entry.require_complete(frame_count, step)
+        return entry
+
+    def enable_motion_gate(self, **options):
+        """Пропуск неподвижных кадров и детекция на фрагментах вокруг движения и треков (см. MotionGate).
+
+        На фрагментах трекер ultralytics неприменим (координаты меняются от
+        кадра к кадру), поэтому модели вызываются через predict, а id
+        треков назначает IoUTracker в координатах кадра.
+        """
+        from motion_gate import MotionGate
+        from multistream import IoUTracker
+        self.motion_gate = MotionGate(**options)
+        self._gate_tracker = IoUTracker()
+        self._gated_detections = []
+        return self.motion_gate
+
+    def enable_adaptive_resolution(self, target_fps, sizes=(608, 512, 416, 320), strides=(1, 2, 3), **options):
+        """Размер входа ансамбля и шаг кадров подбираются под target_fps (см. ResolutionController).
+
+        На кадрах между запусками моделей возвращаются детекции последнего
+        запуска, а треки не обновляются (повтор положения занизил бы скорость).
+        Для ONNX-моделей размер входа фиксирован, меняется только шаг кадров.
+        """
+        from adaptive_resolution import ResolutionController
+        if not self.ensemble.resizable:
+            sizes = (self.ensemble.imgsz,)
+        self.adaptive = ResolutionController("mobile", target_fps, sizes, strides, initial=self.ensemble.imgsz,
+                                             multiple_of=32, **options)
+        self._held = None
+        self._skipped = False
+        return self.adaptive
+
+    def enable_metrics(self, **options):
+        """Сбор p50/p95 по стадиям, счётчиков кадров и вызовов моделей (см. PerformanceMetrics)."""
+        self.metrics = PerformanceMetrics("mobile", **options)
+        return self.metrics
+
+    def detect(self, frame):
+        """Трекинг всеми моделями и объединение детекций в один список."""
+        if self.adaptive is not None:
+            return self._detect_adaptive(frame)
+        return self._detect(frame)
+
+    def _detect_adaptive(self, frame):
+        self._skipped = not self.adaptive.step() and self._held is not None
+        if self._skipped:
+            return self._held
+        self.ensemble.imgsz = self.adaptive.size
+        start = time.perf_counter()
+        detections = self._detect(frame)
+        self.adaptive.observe((time.perf_counter() - start) * 1000)
+        self._held = detections
+        return detections
+
+    def _detect(self, frame):
+        if self.motion_gate is not None:
+            return self._detect_gated(frame)
+        all_detections = []
+        outputs = self.ensemble.track(frame, iou=0.4, conf=0.7, persist=True)
+        if self.metrics.enabled:
+            self.metrics.record("letterbox", self.ensemble.last_latency["preprocess"])
+            for output in outputs:
+                self.metrics.record_model(output.name, output.latency_ms)
+        for output in outputs:
+            if output.ids is not None:
+                boxes = output.boxes.astype(int)
+                for box, score, obj_id, class_id in zip(boxes, output.scores, output.ids, output.class_ids):
+                    x1, y1, x2, y2 = box
+                    class_name = output.names[class_id]
+                    all_detections.append([x1, y1, x2, y2, score, obj_id, class_name])
+
+        with self.metrics.stage("merge"):
+            return self.merger.merge_detections(all_detections)
+
+    def _detect_cached(self, cache, index, frame):
+        """Детекции кадра из записи кэша; на кадрах из кэша модели и трекер ultralytics не запускаются."""
+        detections = cache.get_detections(index)
+        if detections is None:
+            detections = self.detect(frame)
+            cache.put_detections(index, detections)
+        return detections
+
+    def _detect_gated(self, frame):
+        with self.metrics.stage("motion_gate"):
+            regions = self.motion_gate.regions(frame, [d[:4] for d in self._gated_detections])
+        if regions is None:
+            # Движения нет: объекты остаются на прежних местах без запуска моделей
+            return [list(detection) for detection in self._gated_detections]
+
+        crops = [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in regions]
+        imgsz = self.motion_gate.input_size(regions, frame.shape, self.ensemble.imgsz)
+        outputs = self.ensemble.predict_batch(crops, imgsz=imgsz, iou=0.4, conf=0.7)
+        if self.metrics.enabled:
+            self.metrics.record("letterbox", self.ensemble.last_latency["preprocess"])
+            for output in outputs[0]:
+                self.metrics.record_model(output.name, output.latency_ms)
+
+        all_detections = []
+        for (offset_x, offset_y, _, _), crop_outputs in zip(regions, outputs):
+            for output in crop_outputs:
+                # Боксы фрагмента переводятся в координаты кадра до объединения
+                boxes = output.boxes.astype(int) + np.array([offset_x, offset_y, offset_x, offset_y])
+                for (x1, y1, x2, y2), score, class_id in zip(boxes, output.scores, output.class_ids):
+                    all_detections.append([x1, y1, x2, y2, score, 0, output.names[class_id]])
+
+        with self.metrics.stage("merge"):
+            merged = self.merger.merge_detections(all_detections)
+            ids = self._gate_tracker.update(np.array([d[:4] for d in merged]).reshape(-1, 4),
+                                            [d[6] for d in merged])
+            for detection, obj_id in zip(merged, ids):
+                detection[5] = int(obj_id)
+        self._gated_detections = merged
+        return merged
+
+    def update_tracks(self, detections, timestamp):
+        """Обновление треков по детекциям кадра; возвращает записи для журнала детекций."""
+        if self.adaptive is not None and self._skipped:
+            # Кадр без запуска моделей: записи последнего запуска
+            return self._held_records
+        records = []
+        self.tracks.next_frame()
+        for x1, y1, x2, y2, score, obj_id, class_name in detections:
+            # Вычисление центра объекта
+            center_x, center_y = (x1 + x2) // 2, (y1 + y2) // 2
+
+            # Сглаженная скорость по временным меткам кадров (между ними могут быть пропущенные кадры)
+            velocity_x, velocity_y = self.tracks.update(obj_id, (center_x, center_y), timestamp)
+            speed = (velocity_x ** 2 + velocity_y ** 2) ** 0.5
+
+            records.append({
+                "id": int(obj_id), "class": class_name,
+                "x1": int(x1), "y1": int(y1), "x2": int(x2), "y2": int(y2),
+                "score": round(float(score), 4), "speed": round(float(speed), 2),
+            })
+        self._held_records = records
+        return records
+
+    @staticmethod
+    def draw_records(frame, records, scale=(1.0, 1.0)):
+        """Отрисовка записей детекций; scale - масштаб кадра относительно исходного."""
+        sx, sy = scale
+        for record in records:
+            x1, y1 = int(record["x1"] * sx), int(record["y1"] * sy)
+            x2, y2 = int(record["x2"] * sx), int(record["y2"] * sy)
+            cv2.rectangle(frame, (x1, y1), (x2, y2), track_color(record["id"]), 2)
+
+            # Отображение информации
+            cv2.putText(frame, f"Id {record['id']} | {record['class']} | Speed: {record['speed']:.2f} px/s",
+                        (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
+
+    def annotate(self, frame, detections, timestamp):
+        """Отрисовка детекций на кадре; возвращает записи для журнала детекций."""
+        records = self.update_tracks(detections, timestamp)
+        self.draw_records(frame, records)
+        return records
+
+    def reset_tracking(self):
+        """Сброс трекеров и истории позиций: модели из реестра переходят от видео к видео."""
+        for model in self.models:
+            predictor = getattr(model, "predictor", None)
+            for tracker in getattr(predictor, "trackers", None) or []:
+                tracker.reset()
+        self.tracks.clear()
+        if self.motion_gate is not None:
+            self.motion_gate.reset()
+            self._gate_tracker.reset()
+            self._gated_detections = []
+        # Детекции прошлого видео не переносятся на первый кадр нового
+        self._held = None
+        self._held_records = []
+        self._skipped = False
 
     def process_video(self, input_video_path, canvas, root):
-        cap = cv2.VideoCapture(input_video_path)
-        if not cap.isOpened():
-            raise Exception("Error: Could not open video file.")
+        # Все кадры источника одного размера; при decode_size кадр уменьшается уже при декодировании
+        cap = open_source(input_video_path, decode_size=self.decode_size)
+        self.reset_tracking()
 
-        prev_frame_shape = None
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_time = 1 / fps  # Время одного кадра
+        # Часы воспроизведения задают время кадров; без холста видео обрабатывается без ожиданий
+        clock = PlaybackClock(cap.get(cv2.CAP_PROP_FPS))
+        fps = clock.fps
+        realtime = self.realtime and canvas is not None
+        state = {"writer": None}
+        cache = self._open_result_cache(input_video_path, cap.frame_count)
+        # Пока запись кэша не полная, кадры не пропускаются даже при отставании: иначе она не станет полной
+        catch_up = realtime and not cache.recording
+        log = open_log_writer(self.detection_log, "mobile", cap, input_video_path)
 
-        while True:
-            ret, frame = cap.read()
+        def decode():
+            with self.metrics.stage("decode"):
+                ret, frame, timestamp = clock.read(cap, catch_up=catch_up)
             if not ret:
-                break
-
-            # Проверка размеров кадров
-            if prev_frame_shape is not None and frame.shape[:2] != prev_frame_shape:
-                frame = cv2.resize(frame, (prev_frame_shape[1], prev_frame_shape[0]))
-            else:
-                prev_frame_shape = frame.shape[:2]
-
-            all_detections = []
-            for model in self.models:
-                results = model.track(frame, iou=0.4, conf=0.7, persist=True, imgsz=608, verbose=False)
-                if results[0].boxes.id is not None:
-                    boxes = results[0].boxes.xyxy.cpu().numpy().astype(int)
-                    scores = results[0].boxes.conf.cpu().numpy()
-                    ids = results[0].boxes.id.cpu().numpy().astype(int)
-                    class_ids = results[0].boxes.cls.cpu().numpy().astype(int)
-
-                    for box, score, obj_id, class_id in zip(boxes, scores, ids, class_ids):
-                        x1, y1, x2, y2 = box
-                        class_name = model.names[class_id]
-                        all_detections.append([x1, y1, x2, y2, score, obj_id, class_name])
-
-            merged_detections = self.merger.merge_detections(all_detections)
-
-            for detection in merged_detections:
-                x1, y1, x2, y2, score, obj_id, class_name = detection
-                random.seed(int(obj_id))
-                color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
-                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-
-                # Вычисление центра объекта
-                center_x, center_y = (x1 + x2) // 2, (y1 + y2) // 2
-
-                # Вычисление скорости
-                if obj_id in self.previous_positions:
-                    prev_x, prev_y = self.previous_positions[obj_id]
-                    distance = ((center_x - prev_x) ** 2 + (center_y - prev_y) ** 2) ** 0.5
-                    speed = distance / frame_time
-                else:
-                    speed = 0.0
-
-                # Обновление позиции объекта
-                self.previous_positions[obj_id] = (center_x, center_y)
-
-                # Отображение информации
-                cv2.putText(frame, f"Id {obj_id} | {class_name} | Speed: {speed:.2f} px/s",
-                            (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
-
-            # Конвертация кадра для tkinter
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            frame = cv2.resize(frame, (800, 600))
-            img = ImageTk.PhotoImage(image=Image.fromarray(frame))
-            canvas.create_image(0, 0, anchor=tk.NW, image=img)
-            canvas.image = img
-
-            if cv2.waitKey(1) & 0xFF == ord("q"):
-                break
-
-        cap.release()
-
-
-def load_mobile_models():
-    # Корневая директория проекта
-    project_root = Path(__file__).parent.resolve()
-
-    # Пути к файлам моделей
-    model_paths = [
-        project_root / "models" / "mobile_models" / "fox.pt",
-        project_root / "models" / "mobile_models" / "people.pt",
-        project_root / "models" / "mobile_models" / "rabbit.pt"
-    ]
-
-    # Загружаем модели
-    models = [YOLO(str(path)) for path in model_paths]
-    for model in models:
-        model.fuse()
+                return None
+            self.metrics.frame_decoded()
+            return clock.frame_index, timestamp, frame
+
+        # Один элемент изображения на холсте, обновляемый в главном потоке Tk
+        presenter = TkPresenter(canvas, root, self.display_size, self.metrics) if canvas is not None else None
+
+        def infer(item):
+            index, timestamp, frame = item
+            merged_detections = self._detect_cached(cache, index, frame)
+            records = self.update_tracks(merged_detections, timestamp)
+            log.write(index, timestamp, records)
+
+            with self.metrics.stage("draw"):
+                if self.save_video:
+                    # Для записи разметка рисуется в исходном разрешении
+                    self.draw_records(frame, records)
+                elif presenter is not None:
+                    # Для показа кадр уменьшается до размера холста до отрисовки
+                    frame, scale = fit_frame(frame, self.display_size)
+                    self.draw_records(frame, records, scale)
+            self.metrics.draw_hud(frame)
+
+            if self.save_video:
+                if state["writer"] is None:
+                    state["writer"] = cv2.VideoWriter(str(self.save_video), cv2.VideoWriter_fourcc(*"mp4v"), fps,
+                                                      (frame.shape[1], frame.shape[0]))
+                state["writer"].write(frame)
+            return timestamp, frame
+
+        def present(item):
+            if presenter is not None:
+                timestamp, frame = item
+                # Конвертация кадра для tkinter
+                with self.metrics.stage("tk_convert"):
+                    rgb = presenter.prepare(frame)
+                if realtime:
+                    clock.wait(timestamp)
+                presenter.post(rgb)
+            self.metrics.frame_presented(clock, pipeline)
+
+        pipeline = StagedPipeline(decode, infer, present, policy=OFFLINE if cache.recording else self.policy,
+                                  name="mobile")
+        try:
+            self.pipeline_stats = pipeline.run()
+        finally:
+            self.playback_stats = clock.stats()
+            self.metrics.close()
+            cache.close()
+            self.cache_stats = cache.stats()
+            log.close()
+            if presenter is not None:
+                presenter.close()
+            if state["writer"] is not None:
+                state["writer"].release()
+            cap.release()
+
+
+# Корневая директория проекта
+PROJECT_ROOT = Path(__file__).parent.resolve()
+
+# Пути к файлам моделей
+MOBILE_MODEL_PATHS = [
+    PROJECT_ROOT / "models" / "mobile_models" / "fox.pt",
+    PROJECT_ROOT / "models" / "mobile_models" / "people.pt",
+    PROJECT_ROOT / "models" / "mobile_models" / "rabbit.pt"
+]
+
+def load_mobile_models(backend="torch", imgsz=608):
+    # Веса загружаются и объединяются (fuse) один раз за процесс через реестр,
+    # предикторы и трекеры у каждого обработчика свои.
+    # ONNX-модели экспортируются с фиксированным размером входа imgsz
+    models = [own_predictor(load_yolo(path, imgsz=imgsz, backend=backend)) for path in MOBILE_MODEL_PATHS]
     merger = DetectionMerger(iou_threshold=0.5)
     video_processor = VideoProcessor(models, merger, show_video=False, save_video=False)
-    return video_processor, merger
\ No newline at end of file
+    video_processor.ensemble.imgsz = imgsz
+    return video_processor, merger
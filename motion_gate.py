@@ -0,0 +1,146 @@
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """Выбор областей кадра для детекции мобильных объектов по движению.
+
+    Вычитание фона (MOG2) выполняется на уменьшенном до probe_width сером
+    кадре. regions() возвращает None, если переднего плана нет (доля
+    пикселей переднего плана ниже min_foreground или ни одного пятна), -
+    тогда модели не запускаются. Иначе области вокруг пятен движения
+    площадью не меньше min_blob_area (в пикселях пробы) и вокруг боксов
+    существующих треков расширяются на padding, объединяются при
+    пересечении и возвращаются как список боксов (x1, y1, x2, y2) в
+    координатах кадра. Если области занимают больше max_crop_fraction
+    кадра, или на каждом refresh_interval-м кадре, возвращается весь кадр.
+
+    var_threshold - чувствительность вычитателя фона: чем меньше, тем
+    слабее изменения яркости считаются движением.
+    """
+
+    def __init__(self, var_threshold=16.0, min_foreground=0.0005, min_blob_area=12, probe_width=320, history=300,
+                 padding=0.3, min_crop=64, max_crop_fraction=0.5, refresh_interval=100):
+        self.var_threshold = var_threshold
+        self.min_foreground = min_foreground
+        self.min_blob_area = min_blob_area
+        self.probe_width = probe_width
+        self.history = history
+        self.padding = padding
+        self.min_crop = min_crop
+        self.max_crop_fraction = max_crop_fraction
+        self.refresh_interval = refresh_interval
+        self._kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+        self.reset()
+
+    def reset(self):
+        self._subtractor = cv2.createBackgroundSubtractorMOG2(history=self.history, varThreshold=self.var_threshold,
+                                                              detectShadows=False)
+        self._since_full = 0
+        self.frames = 0
+        self.skipped = 0
+        self.full_frames = 0
+        self.crop_frames = 0
+        self.crops = 0
+        self._frame_pixels = 0
+        self._sent_pixels = 0
+        self.last_foreground = 0.0
+
+    def foreground(self, frame):
+        """Маска переднего плана пробы и коэффициент масштаба пробы относительно кадра."""
+        scale = self.probe_width / frame.shape[1]
+        height = max(1, int(round(frame.shape[0] * scale)))
+        probe = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (self.probe_width, height),
+                           interpolation=cv2.INTER_AREA)
+        mask = self._subtractor.apply(probe)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self._kernel)
+        return mask, scale
+
+    def _blobs(self, mask, scale):
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        boxes = []
+        for x, y, w, h, area in stats[1:count]:
+            if area >= self.min_blob_area:
+                boxes.append((x / scale, y / scale, (x + w) / scale, (y + h) / scale))
+        return boxes
+
+    def _expand(self, box, width, height):
+        x1, y1, x2, y2 = box
+        pad_x = max((x2 - x1) * self.padding, (self.min_crop - (x2 - x1)) / 2, 0)
+        pad_y = max((y2 - y1) * self.padding, (self.min_crop - (y2 - y1)) / 2, 0)
+        return [max(0, int(x1 - pad_x)), max(0, int(y1 - pad_y)),
+                min(width, int(np.ceil(x2 + pad_x))), min(height, int(np.ceil(y2 + pad_y)))]
+
+    @staticmethod
+    def merge_regions(regions):
+        """Объединение пересекающихся прямоугольников до тех пор, пока пересечения есть."""
+        regions = [list(region) for region in regions]
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(regions)):
+                for j in range(i + 1, len(regions)):
+                    a, b = regions[i], regions[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        regions[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del regions[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return [tuple(region) for region in regions]
+
+    def regions(self, frame, track_boxes=()):
+        """Области кадра для детекции: None - пропустить кадр, иначе список (x1, y1, x2, y2)."""
+        height, width = frame.shape[:2]
+        self.frames += 1
+        self._frame_pixels += width * height
+        mask, scale = self.foreground(frame)
+        self.last_foreground = float(np.count_nonzero(mask)) / mask.size
+        self._since_full += 1
+
+        full = (0, 0, width, height)
+        if self.frames == 1 or (self.refresh_interval and self._since_full >= self.refresh_interval):
+            return self._send([full], full=True)
+
+        blobs = self._blobs(mask, scale) if self.last_foreground >= self.min_foreground else []
+        if not blobs:
+            self.skipped += 1
+            return None
+
+        regions = self.merge_regions(
+            [self._expand(box, width, height) for box in list(blobs) + [tuple(b) for b in track_boxes]]
+        )
+        area = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in regions)
+        if area > self.max_crop_fraction * width * height:
+            return self._send([full], full=True)
+        return self._send(regions)
+
+    def _send(self, regions, full=False):
+        if full:
+            self.full_frames += 1
+            self._since_full = 0
+        else:
+            self.crop_frames += 1
+            self.crops += len(regions)
+        self._sent_pixels += sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in regions)
+        return regions
+
+    @staticmethod
+    def input_size(regions, frame_shape, imgsz, stride=32):
+        """Размер входа модели для фрагментов при той же плотности пикселей, что у полного кадра."""
+        scale = imgsz / max(frame_shape[:2])
+        side = max(max(x2 - x1, y2 - y1) for x1, y1, x2, y2 in regions) * scale
+        return int(min(imgsz, max(stride * 2, np.ceil(side / stride) * stride)))
+
+    def stats(self):
+        """Доля кадров и пикселей кадра, отправленных в модели."""
+        return {
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "full_frames": self.full_frames,
+            "crop_frames": self.crop_frames,
+            "crops": self.crops,
+            "frame_ratio": (self.full_frames + self.crop_frames) / max(self.frames, 1),
+            "pixel_ratio": self._sent_pixels / max(self._frame_pixels, 1),
+        }
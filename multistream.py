@@ -0,0 +1,365 @@
+"""Пакетная обработка нескольких видеопотоков (камер) одним вызовом каждой модели."""
+import threading
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from model_ensemble import ModelEnsemble
+from module_mobile_object import DetectionMerger, VideoProcessor
+from frame_source import open_source
+from playback_clock import PlaybackClock
+
+# Политики выбора потоков, когда готовых кадров больше, чем помещается в пакет
+ROUND_ROBIN = "round_robin"
+DEADLINE = "deadline"
+
+
+class StreamSource:
+    """Источник кадров одного потока: описание для frame_source.open_source (файл, индекс устройства, URL).
+
+    Чтение идёт в отдельном потоке, планировщик забирает последний кадр
+    через take(). realtime=True - кадры поступают в темпе видео, и
+    незабранный кадр заменяется свежим (считается отброшенным);
+    realtime=False - чтение ждёт, пока планировщик заберёт кадр, и
+    обрабатывается каждый кадр (офлайн-обработка файлов).
+    """
+
+    def __init__(self, source, name=None, realtime=True):
+        self.source = source
+        if name is None:
+            name = f"cam{source}" if isinstance(source, int) else Path(source).stem
+        self.name = name
+        self.realtime = realtime
+        self.on_frame = None  # вызывается после поступления нового кадра
+
+        self._cond = threading.Condition()
+        self._pending = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.cap = None
+        self.ended = False
+        self.frames_read = 0
+        self.dropped = 0
+
+    def start(self):
+        self.cap = open_source(self.source)
+        self._thread = threading.Thread(target=self._reader, name=f"source-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def _reader(self):
+        clock = PlaybackClock(self.cap.get(cv2.CAP_PROP_FPS))
+        try:
+            while not self._stop.is_set():
+                ret, frame, pts = clock.read(self.cap, catch_up=False)
+                if not ret:
+                    break
+                if self.realtime:
+                    clock.wait(pts)
+                self._put((self.frames_read, pts, frame, time.perf_counter()))
+                self.frames_read += 1
+        finally:
+            with self._cond:
+                self.ended = True
+                self._cond.notify_all()
+            if self.on_frame is not None:
+                self.on_frame()
+
+    def _put(self, item):
+        with self._cond:
+            if self._pending is not None:
+                if self.realtime:
+                    self.dropped += 1
+                else:
+                    while self._pending is not None and not self._stop.is_set():
+                        self._cond.wait(0.1)
+            self._pending = item
+            self._cond.notify_all()
+        if self.on_frame is not None:
+            self.on_frame()
+
+    def ready(self):
+        return self._pending is not None
+
+    def finished(self):
+        return self.ended and self._pending is None
+
+    def take(self):
+        """(номер кадра, pts, кадр, момент захвата) или None, если нового кадра нет."""
+        with self._cond:
+            item, self._pending = self._pending, None
+            self._cond.notify_all()
+        return item
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(1.0)
+        if self.cap is not None:
+            self.cap.release()
+
+
+class IoUTracker:
+    """Трекер одного потока: детекция наследует id трека того же класса с наибольшим IoU.
+
+    Трек без совпадений живёт max_age пакетов, затем удаляется.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_age=30):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self._iou = DetectionMerger(pixel_offset=False).pairwise_iou
+        self.reset()
+
+    def reset(self):
+        self._boxes = np.empty((0, 4), dtype=np.float32)
+        self._classes = []
+        self._ids = np.empty(0, dtype=np.int64)
+        self._ages = np.empty(0, dtype=np.int64)
+        self._next_id = 1
+
+    def update(self, boxes, classes):
+        """Id для боксов (N, 4) с метками classes."""
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        ids = np.zeros(len(boxes), dtype=np.int64)
+        matched = np.zeros(len(self._boxes), dtype=bool)
+
+        if len(boxes) and len(self._boxes):
+            iou = self._iou(np.concatenate([boxes, self._boxes]))[:len(boxes), len(boxes):]
+            same_class = np.array([[c == t for t in self._classes] for c in classes])
+            iou = np.where(same_class, iou, 0)
+            for flat in np.argsort(-iou, axis=None):
+                row, col = np.unravel_index(flat, iou.shape)
+                if iou[row, col] < self.iou_threshold:
+                    break
+                if ids[row] or matched[col]:
+                    continue
+                ids[row] = self._ids[col]
+                matched[col] = True
+
+        for row in np.flatnonzero(ids == 0):
+            ids[row] = self._next_id
+            self._next_id += 1
+
+        # Несопоставленные треки стареют, сопоставленные и новые обновляются
+        keep = ~matched & (self._ages + 1 <= self.max_age)
+        self._boxes = np.concatenate([boxes, self._boxes[keep]])
+        self._classes = list(classes) + [c for c, k in zip(self._classes, keep) if k]
+        self._ids = np.concatenate([ids, self._ids[keep]])
+        self._ages = np.concatenate([np.zeros(len(boxes), dtype=np.int64), self._ages[keep] + 1])
+        return ids
+
+
+class StreamState:
+    """Состояние одного потока: объединение детекций, трекер, скорости и задержки."""
+
+    def __init__(self, source, merger, latency_target_ms=None, window=240):
+        self.source = source
+        self.tracker = IoUTracker()
+        # VideoProcessor без моделей: объединение детекций, хранилище треков и отрисовка для потока
+        self.processor = VideoProcessor([], merger)
+        self.latency_target_ms = latency_target_ms
+        self.window = window
+        self.latencies = []
+        self.processed = 0
+        self.target_misses = 0
+        self.last_taken = time.perf_counter()
+
+    def records(self, outputs, timestamp):
+        detections = []
+        for output in outputs:
+            for box, score, class_id in zip(output.boxes.astype(int), output.scores, output.class_ids):
+                detections.append([*box, score, 0, output.names[class_id]])
+        merged = self.processor.merger.merge_detections(detections)
+        if merged:
+            ids = self.tracker.update(np.array([d[:4] for d in merged]), [d[6] for d in merged])
+            for detection, track_id in zip(merged, ids):
+                detection[5] = int(track_id)
+        else:
+            self.tracker.update(np.empty((0, 4)), [])
+        return self.processor.update_tracks(merged, timestamp)
+
+    def record_latency(self, latency_ms):
+        self.processed += 1
+        self.latencies.append(latency_ms)
+        if len(self.latencies) > self.window:
+            del self.latencies[:len(self.latencies) - self.window]
+        if self.latency_target_ms is not None and latency_ms > self.latency_target_ms:
+            self.target_misses += 1
+
+    def urgency(self, now):
+        """Доля бюджета задержки, уже потраченная ожиданием (для политики deadline)."""
+        target = self.latency_target_ms or 100.0
+        return (now - self.last_taken) * 1000 / target
+
+
+class MultiStreamScheduler:
+    """Планировщик нескольких потоков: один пакетный вызов каждой модели на все готовые кадры.
+
+    Из каждого потока берётся последний кадр; кадры собираются в пакет
+    (не больше max_batch, ожидание добора пакета - до gather_ms) и
+    передаются ModelEnsemble.predict_batch. Результаты кадра возвращаются
+    в состояние его потока: собственный DetectionMerger, трекер по IoU и
+    хранилище треков, так что id треков разных потоков не смешиваются.
+    Если готовых кадров больше max_batch, политика round_robin берёт
+    потоки по кругу, deadline - потоки, дольше всех ждущие относительно
+    своего latency_target_ms.
+    """
+
+    def __init__(self, models, sources, imgsz=608, names=None, max_batch=None, policy=ROUND_ROBIN,
+                 latency_targets=None, gather_ms=5.0, merger_factory=None, conf=0.7, iou=0.4):
+        if policy not in (ROUND_ROBIN, DEADLINE):
+            raise ValueError(f"Unknown scheduling policy: {policy}")
+        self.ensemble = ModelEnsemble(models, imgsz=imgsz, names=names)
+        self.sources = list(sources)
+        self.max_batch = max_batch or len(self.sources)
+        self.policy = policy
+        self.gather_ms = gather_ms
+        self.predict_options = {"conf": conf, "iou": iou}
+        merger_factory = merger_factory or (lambda: DetectionMerger(iou_threshold=0.5))
+        latency_targets = latency_targets or {}
+        self.streams = [StreamState(source, merger_factory(), latency_targets.get(source.name))
+                        for source in self.sources]
+
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._next = 0
+        self.batches = 0
+        self.batch_sizes = []
+        self.elapsed_s = 0.0
+
+    def _select(self, ready):
+        if len(ready) <= self.max_batch:
+            return ready
+        if self.policy == DEADLINE:
+            now = time.perf_counter()
+            return sorted(ready, key=lambda state: state.urgency(now), reverse=True)[:self.max_batch]
+        # round_robin: первым идёт поток, следующий за последним выбранным
+        order = sorted(ready, key=lambda state: (self.streams.index(state) - self._next) % len(self.streams))
+        selected = order[:self.max_batch]
+        self._next = (self.streams.index(selected[-1]) + 1) % len(self.streams)
+        return selected
+
+    def _gather(self):
+        """Готовые потоки; после первого готового кадра ждёт до gather_ms остальных."""
+        while not self._stop.is_set():
+            ready = [state for state in self.streams if state.source.ready()]
+            if ready:
+                if len(ready) < min(self.max_batch, len(self.streams)) and self.gather_ms > 0:
+                    deadline = time.perf_counter() + self.gather_ms / 1000
+                    while time.perf_counter() < deadline:
+                        self._wakeup.wait(max(deadline - time.perf_counter(), 0))
+                        self._wakeup.clear()
+                        ready = [state for state in self.streams if state.source.ready()]
+                        if len(ready) >= min(self.max_batch, len(self.streams)):
+                            break
+                return ready
+            if all(state.source.finished() for state in self.streams):
+                return []
+            self._wakeup.wait(0.05)
+            self._wakeup.clear()
+        return []
+
+    def step(self):
+        """Один пакет: сбор кадров, инференс и раздача результатов; [] - все потоки закончились."""
+        selected = self._select(self._gather())
+        items = []
+        for state in selected:
+            item = state.source.take()
+            if item is not None:
+                state.last_taken = time.perf_counter()
+                items.append((state, item))
+        if not items:
+            return []
+
+        outputs = self.ensemble.predict_batch([item[2] for _, item in items], **self.predict_options)
+        finished = time.perf_counter()
+        results = []
+        for (state, (index, pts, frame, captured_at)), frame_outputs in zip(items, outputs):
+            records = state.records(frame_outputs, pts)
+            state.record_latency((finished - captured_at) * 1000)
+            results.append((state.source.name, index, pts, frame, records))
+        self.batches += 1
+        self.batch_sizes.append(len(items))
+        return results
+
+    def run(self, on_result=None, max_batches=None, duration_s=None):
+        """Обработка до конца всех потоков (или лимита); on_result(имя, номер, pts, кадр, записи)."""
+        for source in self.sources:
+            source.on_frame = self._wakeup.set
+            source.start()
+        start = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                if max_batches is not None and self.batches >= max_batches:
+                    break
+                if duration_s is not None and time.perf_counter() - start >= duration_s:
+                    break
+                results = self.step()
+                if not results:
+                    if all(state.source.finished() for state in self.streams):
+                        break
+                    continue
+                if on_result is not None:
+                    for result in results:
+                        on_result(*result)
+        finally:
+            self.elapsed_s = time.perf_counter() - start
+            for source in self.sources:
+                source.stop()
+            self.ensemble.close()
+        return self.stats()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def stats(self):
+        elapsed = max(self.elapsed_s, 1e-9)
+        processed = sum(state.processed for state in self.streams)
+        streams = {}
+        for state in self.streams:
+            latencies = np.array(state.latencies) if state.latencies else np.zeros(1)
+            streams[state.source.name] = {
+                "processed": state.processed,
+                "dropped": state.source.dropped,
+                "fps": state.processed / elapsed,
+                "latency_p50_ms": float(np.percentile(latencies, 50)),
+                "latency_p95_ms": float(np.percentile(latencies, 95)),
+                "latency_target_ms": state.latency_target_ms,
+                "target_misses": state.target_misses,
+            }
+        return {
+            "streams": streams,
+            "batches": self.batches,
+            "mean_batch": float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+            "throughput_fps": processed / elapsed,
+            "elapsed_s": self.elapsed_s,
+            "model_ms": self.ensemble.latency_report()["per_model_ms"],
+        }
+
+
+def scaling_report(models, make_sources, counts=(1, 2, 4), duration_s=10.0, **options):
+    """Суммарная пропускная способность в зависимости от числа потоков.
+
+    make_sources(k) возвращает k новых StreamSource; для каждого k
+    планировщик работает duration_s секунд.
+    """
+    rows = []
+    for count in counts:
+        stats = MultiStreamScheduler(models, make_sources(count), **options).run(duration_s=duration_s)
+        rows.append({
+            "streams": count,
+            "throughput_fps": stats["throughput_fps"],
+            "per_stream_fps": stats["throughput_fps"] / count,
+            "mean_batch": stats["mean_batch"],
+            "latency_p95_ms": max(s["latency_p95_ms"] for s in stats["streams"].values()),
+        })
+    base = rows[0]["throughput_fps"] if rows and rows[0]["throughput_fps"] > 0 else None
+    for row in rows:
+        row["scaling"] = row["throughput_fps"] / base if base else None
+    return rows
@@ -0,0 +1,319 @@
+"""Параллельная офлайн-обработка длинных записей: сегменты видео в пуле процессов.
+
+Видео делится на сегменты по ключевым кадрам (ffprobe, если установлен,
+иначе равными частями), каждый сегмент обрабатывается в отдельном
+процессе со своими экземплярами моделей, затем результаты сшиваются в
+одно размеченное видео и один журнал детекций.
+
+Трекер ultralytics в каждом сегменте начинает нумерацию заново. Поэтому
+сегмент начинается на overlap кадров раньше своей границы: эти кадры
+уже обработаны предыдущим сегментом, и id треков сопоставляются по IoU
+боксов на общих кадрах (TrackIdReconciler). Заодно на них прогревается
+оценка скоростей. Треки сегментов рисуются только при сшивке, уже с
+глобальными id.
+"""
+import os
+import pickle
+import shutil
+import subprocess
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from module_mobile_object import DetectionMerger, VideoProcessor
+from robosight import PIPELINES, StageTimer, open_detection_log
+
+# Режимы, в записях которых есть id треков мобильных объектов
+TRACKED_MODES = ("mobile", "combined")
+
+
+def probe_keyframes(path):
+    """Номера ключевых кадров видео (по порядку показа) или None, если ffprobe недоступен."""
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe is None:
+        return None
+    command = [ffprobe, "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts,flags",
+               "-of", "csv=p=0", str(path)]
+    try:
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    packets = []
+    for line in output.splitlines():
+        pts, _, flags = line.partition(",")
+        if pts.strip().lstrip("-").isdigit():
+            packets.append((int(pts), "K" in flags))
+    packets.sort()
+    return [index for index, (_, key) in enumerate(packets) if key]
+
+
+def plan_segments(total_frames, segments, keyframes=None):
+    """Границы сегментов [(start, end), ...]; при известных ключевых кадрах границы сдвигаются к ним."""
+    segments = max(1, min(segments, total_frames))
+    bounds = []
+    for i in range(1, segments):
+        bound = round(i * total_frames / segments)
+        if keyframes:
+            bound = min(keyframes, key=lambda keyframe: abs(keyframe - bound))
+        if 0 < bound < total_frames and (not bounds or bound > bounds[-1]):
+            bounds.append(bound)
+    edges = [0] + bounds + [total_frames]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def track_records(mode, records):
+    """Записи мобильных объектов (с id треков) из записи кадра."""
+    if mode == "combined":
+        return records["mobile"]
+    return records
+
+
+class TrackIdReconciler:
+    """Перевод локальных id треков сегментов в глобальные id всего видео.
+
+    Для каждого сегмента, кроме первого, боксы общих кадров сопоставляются
+    жадно по IoU (с учётом класса); локальный id получает глобальный id,
+    с которым совпадал на большинстве общих кадров. Остальные локальные id
+    получают новые глобальные id.
+    """
+
+    def __init__(self, iou_threshold=0.5):
+        self.iou_threshold = iou_threshold
+        self._iou = DetectionMerger(pixel_offset=False).pairwise_iou
+        self.mapping = {}
+        self.next_id = 1
+        self.matched = 0
+        self.created = 0
+
+    def _pairs(self, previous, current):
+        if not previous or not current:
+            return []
+        boxes = np.array([[r["x1"], r["y1"], r["x2"], r["y2"]] for r in current + previous], dtype=np.float32)
+        iou = self._iou(boxes)[:len(current), len(current):]
+        pairs, used_current, used_previous = [], set(), set()
+        for flat in np.argsort(-iou, axis=None):
+            row, col = np.unravel_index(flat, iou.shape)
+            if iou[row, col] < self.iou_threshold:
+                break
+            if row in used_current or col in used_previous or current[row]["class"] != previous[col]["class"]:
+                continue
+            used_current.add(row)
+            used_previous.add(col)
+            pairs.append((current[row]["id"], previous[col]["id"]))
+        return pairs
+
+    def begin_segment(self, previous=None, overlap=None):
+        """Новый сегмент; previous и overlap - {кадр: записи треков} одних и тех же кадров.
+
+        Записи previous уже с глобальными id, overlap - с локальными id нового сегмента.
+        """
+        self.mapping = {}
+        votes = {}
+        for frame, records in (overlap or {}).items():
+            for pair in self._pairs((previous or {}).get(frame, []), records):
+                votes[pair] = votes.get(pair, 0) + 1
+        used = set()
+        for (local, global_id), _ in sorted(votes.items(), key=lambda item: -item[1]):
+            if local in self.mapping or global_id in used:
+                continue
+            self.mapping[local] = global_id
+            used.add(global_id)
+            self.matched += 1
+
+    def relabel(self, records):
+        """Копии записей с глобальными id вместо локальных.
+
+        Записи не меняются на месте: при пропуске кадров (rates комбинированного
+        режима) один и тот же список записей повторяется в нескольких кадрах.
+        """
+        relabeled = []
+        for record in records:
+            local = record["id"]
+            if local not in self.mapping:
+                self.mapping[local] = self.next_id
+                self.next_id += 1
+                self.created += 1
+            relabeled.append({**record, "id": self.mapping[local]})
+        return relabeled
+
+
+def _process_segment(mode, input_path, start, end, overlap, options, threads, work_dir, index, write_video):
+    """Обработка одного сегмента в процессе пула: клип сегмента и файл записей."""
+    import torch
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(1)
+
+    pipeline = PIPELINES[mode](**options)
+    tracked = mode in TRACKED_MODES
+    if tracked:
+        # Модели из реестра переиспользуются процессом от сегмента к сегменту
+        if mode == "mobile":
+            pipeline.processor.reset_tracking()
+            pipeline.draw_tracks = False
+        else:
+            pipeline.processor.reset()
+            pipeline.processor.draw_tracks = False
+
+    cap = cv2.VideoCapture(str(input_path))
+    if not cap.isOpened():
+        raise Exception("Error: Could not open video file.")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    first = max(0, start - overlap) if tracked else start
+    if first > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+
+    timer = StageTimer()
+    clip_path = Path(work_dir) / f"segment{index:04d}.mp4"
+    records_path = Path(work_dir) / f"segment{index:04d}.pkl"
+    writer = None
+    overlap_records = {}
+    records_list = []
+    try:
+        for frame_index in range(first, end):
+            with timer.measure("decode"):
+                ret, frame = cap.read()
+            if not ret:
+                break
+            timestamp = frame_index / fps
+            annotated, records = pipeline.process(frame, timestamp, timer)
+            if frame_index < start:
+                overlap_records[frame_index] = track_records(mode, records)
+                continue
+
+            if write_video:
+                with timer.measure("write"):
+                    if writer is None:
+                        height, width = annotated.shape[:2]
+                        writer = cv2.VideoWriter(str(clip_path), cv2.VideoWriter_fourcc(*"mp4v"), fps,
+                                                 (width, height))
+                    writer.write(annotated)
+            records_list.append((frame_index, timestamp, records))
+            timer.frames += 1
+    finally:
+        cap.release()
+        if writer is not None:
+            writer.release()
+
+    with open(records_path, "wb") as file:
+        pickle.dump(records_list, file, protocol=pickle.HIGHEST_PROTOCOL)
+    return {
+        "index": index,
+        "start": start,
+        "frames": timer.frames,
+        "clip": str(clip_path) if writer is not None else None,
+        "records": str(records_path),
+        "overlap": overlap_records,
+        "stage_s": timer.totals,
+        "model_ms": pipeline.model_report(),
+    }
+
+
+def _stitch(mode, results, frame_size, fps, output_path, log_path, overlap, timer, reconciler, source=None):
+    """Сшивка клипов и записей сегментов по порядку, с перенумерацией id треков."""
+    tracked = mode in TRACKED_MODES
+    writer = None
+    # Маски рельефа сегментов не сохраняются: в журнал .rslog попадают только детекции
+    log = open_detection_log(log_path, mode, source=source) if log_path else None
+    tail = deque(maxlen=max(overlap, 1))  # последние кадры предыдущего сегмента с глобальными id
+    try:
+        for result in results:
+            if tracked:
+                reconciler.begin_segment(dict(tail), result["overlap"])
+            with open(result["records"], "rb") as file:
+                segment_records = pickle.load(file)
+
+            clip = cv2.VideoCapture(result["clip"]) if output_path and result["clip"] else None
+            for frame_index, timestamp, records in segment_records:
+                if tracked:
+                    tracks = reconciler.relabel(track_records(mode, records))
+                    records = {**records, "mobile": tracks} if mode == "combined" else tracks
+                    tail.append((frame_index, tracks))
+                if log is not None:
+                    with timer.measure("log"):
+                        log.write(frame_index, timestamp, records)
+                if clip is not None:
+                    with timer.measure("stitch"):
+                        ret, frame = clip.read()
+                        if not ret:
+                            continue
+                        if tracked:
+                            scale = (frame.shape[1] / frame_size[0], frame.shape[0] / frame_size[1])
+                            VideoProcessor.draw_records(frame, tracks, scale)
+                        if writer is None:
+                            writer = cv2.VideoWriter(str(output_path), cv2.VideoWriter_fourcc(*"mp4v"), fps,
+                                                     (frame.shape[1], frame.shape[0]))
+                        writer.write(frame)
+            if clip is not None:
+                clip.release()
+    finally:
+        if writer is not None:
+            writer.release()
+        if log is not None:
+            log.close()
+
+
+def run_parallel(mode, input_path, output_path=None, log_path=None, max_frames=None, options=None, workers=None,
+                 segments=None, overlap=10, iou_threshold=0.5):
+    """Обработка видеофайла сегментами в workers процессах; отчёт в формате run_headless.
+
+    segments - число сегментов (по умолчанию по одному на процесс), overlap -
+    число кадров перекрытия для сопоставления id треков.
+    """
+    workers = workers or os.cpu_count() or 1
+    cap = cv2.VideoCapture(str(input_path))
+    if not cap.isOpened():
+        raise Exception("Error: Could not open video file.")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frame_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    cap.release()
+    if max_frames is not None:
+        total = min(total, max_frames)
+    if total <= 0:
+        raise Exception("Error: Could not determine frame count.")
+
+    plan = plan_segments(total, segments or workers, probe_keyframes(input_path))
+    # Потоки torch делятся между процессами, чтобы они не конкурировали за ядра
+    threads = max(1, (os.cpu_count() or 1) // min(workers, len(plan)))
+
+    timer = StageTimer()
+    reconciler = TrackIdReconciler(iou_threshold)
+    start_time = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="robosight-") as work_dir:
+        # spawn: дочерние процессы не наследуют состояние torch и потоков родителя
+        with ProcessPoolExecutor(max_workers=min(workers, len(plan)), mp_context=get_context("spawn")) as pool:
+            futures = [
+                pool.submit(_process_segment, mode, str(input_path), start, end, overlap, options or {}, threads,
+                            work_dir, index, bool(output_path))
+                for index, (start, end) in enumerate(plan)
+            ]
+            results = [future.result() for future in futures]
+        process_wall = time.perf_counter() - start_time
+        _stitch(mode, results, frame_size, fps, output_path, log_path, overlap, timer, reconciler, input_path)
+
+    # Время стадий сегментов суммируется по процессам (процессорное время на кадр)
+    for result in results:
+        for stage, seconds in result["stage_s"].items():
+            timer.totals[stage] = timer.totals.get(stage, 0.0) + seconds
+        timer.frames += result["frames"]
+    report = timer.report(time.perf_counter() - start_time)
+
+    model_ms = {}
+    for result in results:
+        for name, ms in result["model_ms"].items():
+            model_ms[name] = model_ms.get(name, 0.0) + ms * result["frames"]
+    report["model_ms"] = {name: total_ms / max(timer.frames, 1) for name, total_ms in model_ms.items()}
+    report["extra"] = {"parallel": {
+        "workers": min(workers, len(plan)),
+        "segments": len(plan),
+        "process_s": round(process_wall, 2),
+        "ids_matched": reconciler.matched,
+        "ids_created": reconciler.created,
+    }}
+    return report
@@ -0,0 +1,181 @@
+import queue
+import threading
+import time
+
+from sessions import current_session
+
+# Политики обработки: live - отбрасывать устаревшие кадры, offline - обрабатывать каждый кадр
+LIVE = "live"
+OFFLINE = "offline"
+
+_END = object()  # Маркер конца потока, передаётся по очередям между стадиями
+
+
+class StageStats:
+    """Счётчики одной стадии конвейера."""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.dropped = 0
+        self.busy_s = 0.0
+
+
+class StagedPipeline:
+    """Конвейер decode -> inference -> presentation на трёх потоках.
+
+    Стадии связаны ограниченными очередями. decode() возвращает очередной
+    элемент или None в конце потока, infer(item) - результат обработки,
+    present(result) выводит его и может вернуть False для остановки.
+    В режиме live при заполненной очереди из неё выбрасывается самый старый
+    кадр, так что инференс всегда получает свежий кадр; в режиме offline
+    стадии ждут друг друга и обрабатывается каждый кадр.
+
+    Конвейер, созданный в потоке сеанса SessionManager, останавливается
+    при отмене сеанса, а процессорное время его стадий учитывается в сеансе.
+    """
+
+    def __init__(self, decode, infer, present, policy=OFFLINE, queue_size=2, name="pipeline"):
+        if policy not in (LIVE, OFFLINE):
+            raise ValueError(f"Unknown pipeline policy: {policy}")
+        self.policy = policy
+        self.name = name
+        self._functions = {"decode": decode, "inference": infer, "present": present}
+        self.decode_queue = queue.Queue(maxsize=queue_size)
+        self.present_queue = queue.Queue(maxsize=queue_size)
+        self.stages = {stage: StageStats(stage) for stage in self._functions}
+
+        self._stop = threading.Event()
+        self._threads = []
+        self._started_at = None
+        self._finished_at = None
+        self.error = None
+        self.session = current_session()
+
+    # Передача элементов между стадиями
+
+    def _put(self, target, item, stats):
+        if item is _END or self.policy == OFFLINE:
+            while not self._stop.is_set():
+                try:
+                    target.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+            return
+
+        # live: вытесняем устаревший кадр вместо ожидания
+        while True:
+            try:
+                target.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    target.get_nowait()
+                except queue.Empty:
+                    continue
+                stats.dropped += 1
+
+    def _get(self, source):
+        while not self._stop.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _timed(self, stage, *args):
+        stats = self.stages[stage]
+        start = time.perf_counter()
+        try:
+            return self._functions[stage](*args)
+        finally:
+            stats.busy_s += time.perf_counter() - start
+
+    # Рабочие потоки стадий
+
+    def _guard(self, worker):
+        def run():
+            try:
+                with self.session.track_thread():
+                    worker()
+            except Exception as e:
+                self.error = e
+                self._stop.set()
+        return run
+
+    def _decode_worker(self):
+        while not self._stop.is_set():
+            item = self._timed("decode")
+            if item is None:
+                break
+            self.stages["decode"].items += 1
+            self._put(self.decode_queue, item, self.stages["decode"])
+        self._put(self.decode_queue, _END, self.stages["decode"])
+
+    def _inference_worker(self):
+        while True:
+            item = self._get(self.decode_queue)
+            if item is _END:
+                break
+            result = self._timed("inference", item)
+            self.stages["inference"].items += 1
+            self._put(self.present_queue, result, self.stages["inference"])
+        self._put(self.present_queue, _END, self.stages["inference"])
+
+    def _present_worker(self):
+        while True:
+            result = self._get(self.present_queue)
+            if result is _END:
+                break
+            keep_going = self._timed("present", result)
+            self.stages["present"].items += 1
+            if keep_going is False:
+                self._stop.set()
+                break
+        self._finished_at = time.perf_counter()
+
+    # Управление
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        self.session.attach(self)
+        workers = (self._decode_worker, self._inference_worker, self._present_worker)
+        for stage, worker in zip(self.stages, workers):
+            thread = threading.Thread(target=self._guard(worker), name=f"{self.name}-{stage}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        """Запуск конвейера и ожидание его завершения."""
+        self.start()
+        self.join()
+        return self.stats()
+
+    def stats(self):
+        """Глубина очередей, загрузка и счётчики по стадиям."""
+        end = self._finished_at or time.perf_counter()
+        elapsed = max(end - (self._started_at or end), 1e-9)
+        return {
+            "policy": self.policy,
+            "elapsed_s": elapsed,
+            "queue_depth": {"decode": self.decode_queue.qsize(), "present": self.present_queue.qsize()},
+            "stages": {
+                name: {
+                    "items": stats.items,
+                    "dropped": stats.dropped,
+                    "busy_ms": stats.busy_s * 1000,
+                    "utilisation": min(stats.busy_s / elapsed, 1.0),
+                }
+                for name, stats in self.stages.items()
+            },
+        }
@@ -0,0 +1,99 @@
+import threading
+import time
+
+from frame_source import FrameSource
+
+
+class PlaybackClock:
+    """Воспроизведение видео в реальном времени по временным меткам кадров.
+
+    Кадр с номером i должен быть показан в момент start + i / fps. Если
+    обработка отстаёт, read() пропускает просроченные кадры через
+    cap.grab() - без декодирования изображения; если опережает, wait()
+    спит ровно оставшийся до временной метки запас.
+
+    Если cap - источник кадров (frame_source), время кадра берётся из его
+    pts, а у живых источников (камера, поток) кадры не пропускаются: они
+    и так отдают последний полученный кадр.
+    """
+
+    def __init__(self, fps, default_fps=25.0):
+        self.fps = fps if fps and fps > 0 else default_fps
+        self.frame_interval = 1.0 / self.fps
+        self._start = None
+        self._lock = threading.Lock()
+        self.next_index = 0  # номер кадра, который вернёт следующий read()
+        self.frame_index = None  # номер кадра видео, возвращённого последним read()
+        self.decoded = 0
+        self.dropped = 0
+        self.presented = 0
+        self.late = 0
+        self.slept_s = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._start is None:
+                self._start = time.perf_counter()
+
+    def elapsed(self):
+        return time.perf_counter() - self._start if self._start is not None else 0.0
+
+    def due_index(self):
+        """Номер кадра, который по расписанию должен выводиться сейчас."""
+        return int(self.elapsed() * self.fps)
+
+    def read(self, cap, catch_up=True):
+        """Чтение следующего актуального кадра: (ret, frame, pts).
+
+        catch_up=False - читать кадры подряд, без пропусков (офлайн-обработка).
+        Номер прочитанного кадра в видео - frame_index (с учётом шага
+        источника; не восстанавливайте его как round(pts * fps)).
+        """
+        self.start()
+        source = isinstance(cap, FrameSource)
+        due = self.due_index() if catch_up and not (source and cap.live) else 0
+        while self.next_index < due:
+            if not cap.grab():
+                return False, None, None
+            # grab() источника с предвыборкой пропускает сразу шаг кадров
+            self.next_index = cap.index if source else self.next_index + 1
+            self.dropped += 1
+
+        ret, frame = cap.read()
+        if not ret:
+            return False, None, None
+        if source:
+            # Источник с шагом кадров мог пропустить кадры внутри read()
+            pts = cap.pts
+            self.frame_index = cap.frame_index
+            self.next_index = cap.index
+        else:
+            pts = self.next_index * self.frame_interval
+            self.frame_index = self.next_index
+            self.next_index += 1
+        self.decoded += 1
+        return True, frame, pts
+
+    def wait(self, pts):
+        """Ожидание временной метки кадра; возвращает запас (отрицательный - опоздание)."""
+        self.start()
+        slack = pts - self.elapsed()
+        if slack > 0:
+            time.sleep(slack)
+            self.slept_s += slack
+        else:
+            self.late += 1
+        self.presented += 1
+        return slack
+
+    def stats(self):
+        elapsed = self.elapsed()
+        return {
+            "target_fps": self.fps,
+            "achieved_fps": self.presented / elapsed if elapsed > 0 else 0.0,
+            "decoded": self.decoded,
+            "presented": self.presented,
+            "dropped": self.dropped,
+            "late": self.late,
+            "slept_s": self.slept_s,
+        }
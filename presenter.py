@@ -0,0 +1,116 @@
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+
+from metrics import NULL_METRICS
+
+# Таблица цветов для id треков и меток классов: вместо random.seed на каждый бокс
+TRACK_COLORS = np.random.default_rng(12345).integers(0, 256, size=(256, 3), dtype=np.uint8)
+
+
+def track_color(index):
+    """BGR-цвет для id трека или номера метки."""
+    return tuple(int(c) for c in TRACK_COLORS[int(index) % len(TRACK_COLORS)])
+
+
+def label_colors(labels):
+    """Цвета меток в порядке списка labels."""
+    return {label: track_color(i) for i, label in enumerate(labels)}
+
+
+def fit_frame(frame, display_size):
+    """Кадр в размере display_size и коэффициенты масштаба (sx, sy) для координат исходного кадра."""
+    width, height = display_size
+    source_height, source_width = frame.shape[:2]
+    if (source_width, source_height) == (width, height):
+        return frame, (1.0, 1.0)
+    resized = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    return resized, (width / source_width, height / source_height)
+
+
+class TkPresenter:
+    """Вывод кадров на холст Tk одним элементом изображения.
+
+    На холсте создаётся один элемент image с одним PhotoImage; следующие
+    кадры того же размера копируются в него через PhotoImage.paste, так что
+    элементы и изображения не накапливаются. submit() (или prepare() и
+    post()) вызывается из любого потока: кадр приводится к размеру вывода,
+    переводится в RGB и кладётся в почтовый ящик на один кадр -
+    непоказанный кадр заменяется более свежим. Показ выполняется в главном
+    потоке Tk через root.after.
+    """
+
+    def __init__(self, canvas, root, display_size=(800, 600), metrics=NULL_METRICS):
+        self.canvas = canvas
+        self.root = root
+        self.display_size = display_size
+        self.metrics = metrics
+
+        self._lock = threading.Lock()
+        self._pending = None
+        self._scheduled = False
+        self._closed = False
+        self._photo = None
+        self._item = None
+
+        self.submitted = 0
+        self.presented = 0
+        self.replaced = 0
+
+    def prepare(self, frame):
+        """BGR-кадр -> RGB-кадр размера вывода (в потоке вызывающего)."""
+        frame, _ = fit_frame(frame, self.display_size)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    def submit(self, frame):
+        """BGR-кадр на вывод; возвращает False, если вывод закрыт."""
+        return self.post(self.prepare(frame))
+
+    def post(self, rgb):
+        """Подготовленный prepare() кадр в почтовый ящик главного потока."""
+        with self._lock:
+            if self._closed:
+                return False
+            if self._pending is not None:
+                self.replaced += 1
+            self._pending = rgb
+            self.submitted += 1
+            schedule = not self._scheduled
+            self._scheduled = True
+        if schedule:
+            self.root.after(0, self._flush)
+        return True
+
+    def _flush(self):
+        with self._lock:
+            rgb, self._pending = self._pending, None
+            self._scheduled = False
+            if rgb is None or self._closed:
+                return
+        with self.metrics.stage("render"):
+            self.show(rgb)
+        self.presented += 1
+
+    def show(self, rgb):
+        """Показ RGB-кадра; вызывается только из главного потока Tk."""
+        image = Image.fromarray(rgb)
+        if self._photo is None or (self._photo.width(), self._photo.height()) != image.size:
+            self._photo = ImageTk.PhotoImage(image)
+            if self._item is None:
+                self._item = self.canvas.create_image(0, 0, anchor="nw", image=self._photo)
+            else:
+                self.canvas.itemconfigure(self._item, image=self._photo)
+            # Ссылка на изображение, иначе его удалит сборщик мусора
+            self.canvas.image = self._photo
+        else:
+            self._photo.paste(image)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._pending = None
+
+    def stats(self):
+        return {"submitted": self.submitted, "presented": self.presented, "replaced": self.replaced}
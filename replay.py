@@ -0,0 +1,115 @@
+import cv2
+import numpy as np
+
+from columnar_log import ColumnarLog
+from frame_source import open_source
+from metrics import NULL_METRICS, PerformanceMetrics
+from module_mobile_object import VideoProcessor
+from pipeline import OFFLINE, StagedPipeline
+from playback_clock import PlaybackClock
+from presenter import TkPresenter, fit_frame
+from static_object_detection import STATIC_LABELS, ObjectDetectionProcessor
+from terrain_module import TERRAIN_PALETTE
+
+
+class LogReplayer:
+    """Воспроизведение видео с разметкой из журнала .rslog без загрузки моделей.
+
+    Для каждого кадра из журнала берутся детекции (мобильные объекты с id и
+    скоростью, статичные объекты) и маска рельефа и рисуются так же, как
+    при обработке. Кадр, отсутствующий в журнале (пропущенный при записи),
+    показывается с разметкой предыдущего кадра; маска рельефа держится до
+    следующей записанной маски.
+    """
+
+    def __init__(self, log_path, display_size=(800, 600), policy=OFFLINE, realtime=True):
+        self.log = ColumnarLog(log_path)
+        self.display_size = display_size
+        self.policy = policy
+        self.realtime = realtime
+        # Процессор без моделей - только для отрисовки статичных объектов в тех же цветах
+        self._static = ObjectDetectionProcessor([], list(STATIC_LABELS), None)
+        self.metrics = NULL_METRICS
+        self.pipeline_stats = None
+        self.playback_stats = None
+        self.reset()
+
+    def reset(self):
+        self._records = {"mobile": [], "static": []}
+        self._mask = None
+
+    def enable_metrics(self, **options):
+        """Сбор p50/p95 по стадиям и счётчиков кадров (см. PerformanceMetrics)."""
+        self.metrics = PerformanceMetrics("replay", **options)
+        return self.metrics
+
+    @property
+    def source(self):
+        """Путь к исходному видео, записанный в журнале."""
+        return self.log.meta.get("source")
+
+    def render(self, frame, frame_index):
+        """Кадр размера display_size с разметкой кадра frame_index из журнала."""
+        display, scale = fit_frame(frame, self.display_size)
+        if display is frame:
+            display = frame.copy()
+        logged_size = self.log.meta.get("frame_size")
+        if logged_size:
+            # Координаты записаны в кадрах того размера, который видел обработчик (он мог уменьшать их при декодировании)
+            scale = (self.display_size[0] / logged_size[0], self.display_size[1] / logged_size[1])
+
+        if self.log.position(frame_index) is not None:
+            self._records = self.log.records(frame_index)
+            mask = self.log.mask(frame_index)
+            if mask is not None:
+                self._mask = mask
+
+        if self._mask is not None:
+            color_mask = cv2.resize(np.take(TERRAIN_PALETTE, self._mask, axis=0), self.display_size,
+                                    interpolation=cv2.INTER_NEAREST)
+            cv2.addWeighted(display, 0.7, color_mask, 0.3, 0, dst=display)
+        static = [(np.array([r["x1"], r["y1"], r["x2"], r["y2"]]), r["class"], r["score"], r["size"])
+                  for r in self._records["static"]]
+        self._static._draw_detections(display, static, scale)
+        VideoProcessor.draw_records(display, self._records["mobile"], scale)
+        return display
+
+    def process_video(self, input_video_path, canvas, root):
+        # Кадры нужны только в размере вывода
+        cap = open_source(input_video_path, decode_size=self.display_size)
+        self.reset()
+
+        clock = PlaybackClock(cap.get(cv2.CAP_PROP_FPS))
+        presenter = TkPresenter(canvas, root, self.display_size, self.metrics)
+
+        def decode():
+            with self.metrics.stage("decode"):
+                ret, frame, timestamp = clock.read(cap, catch_up=self.realtime)
+            if not ret:
+                return None
+            self.metrics.frame_decoded()
+            return clock.frame_index, timestamp, frame
+
+        def infer(item):
+            index, timestamp, frame = item
+            with self.metrics.stage("draw"):
+                display = self.render(frame, index)
+            return timestamp, self.metrics.draw_hud(display)
+
+        def present(item):
+            timestamp, display = item
+            with self.metrics.stage("tk_convert"):
+                rgb = presenter.prepare(display)
+            if self.realtime:
+                clock.wait(timestamp)
+            presenter.post(rgb)
+            self.metrics.frame_presented(clock, pipeline)
+
+        pipeline = StagedPipeline(decode, infer, present, policy=self.policy, name="replay")
+        try:
+            self.pipeline_stats = pipeline.run()
+        finally:
+            self.playback_stats = clock.stats()
+            self.metrics.close()
+            presenter.close()
+            cap.release()
@@ -0,0 +1,523 @@
+"""Дисковый кэш результатов инференса для повторно открываемых видео.
+
+Ключ записи кэша - хэш содержимого видео, анализ, хэши весов моделей и
+параметры инференса (conf, iou, imgsz, target_size и т.п.). Результаты
+хранятся блоками по chunk_frames кадров в файлах .npy, которые читаются
+через memmap: детекции - структурированный массив DETECTION_DTYPE,
+маски рельефа - массив uint8 (кадры, H, W), плюс признак "кадр
+посчитан". Размер кэша ограничивается удалением давно не
+использовавшихся записей (LRU).
+
+Писать в запись может один обработчик: он держит файл блокировки
+writer.lock в каталоге записи. Остальные открывают её только для чтения.
+
+Просмотр и очистка кэша:
+    python result_cache.py list
+    python result_cache.py prune --max-size 5
+    python result_cache.py clear
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Каталог кэша по умолчанию; переопределяется переменной окружения ROBOSIGHT_CACHE
+CACHE_DIR = Path(os.environ.get("ROBOSIGHT_CACHE", Path.home() / ".cache" / "robosight" / "results"))
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+CHUNK_FRAMES = 64
+LOCK_NAME = "writer.lock"
+
+# Блокировки записей, которые держит этот процесс (общие для всех ResultCache)
+_writers = set()
+_writers_lock = threading.Lock()
+
+# Одна строка - одна детекция кадра; имена классов хранятся в meta.json записи
+DETECTION_DTYPE = np.dtype([
+    ("frame", "<u4"),
+    ("x1", "<f4"), ("y1", "<f4"), ("x2", "<f4"), ("y2", "<f4"),
+    ("score", "<f4"),
+    ("track_id", "<i4"),
+    ("class_id", "<u2"),
+])
+
+
+def _hash_file(path, block=1 << 20):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        for data in iter(lambda: file.read(block), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _write_json(path, data):
+    tmp = Path(f"{path}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=1), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _save_array(path, array):
+    tmp = Path(f"{path}.tmp")
+    with open(tmp, "wb") as file:
+        np.save(file, array)
+    os.replace(tmp, path)
+
+
+def _stale_lock(lock_path):
+    """Блокировка осталась от завершившегося процесса."""
+    try:
+        pid = int(lock_path.read_text())
+    except (OSError, ValueError):
+        return False
+    if pid == os.getpid():
+        # Блокировки своего процесса учитываются в _writers
+        return True
+    if os.name != "posix":
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+
+def model_paths(models):
+    """Пути к весам моделей ансамбля (ckpt_path у torch-моделей, model_name у ONNX)."""
+    paths = []
+    for model in models:
+        for attr in ("ckpt_path", "model_name"):
+            path = getattr(model, attr, None)
+            if isinstance(path, (str, Path)) and path and Path(path).exists():
+                paths.append(path)
+                break
+    return paths
+
+
+class _Chunk:
+    """Блок кадров записи: признаки готовности, детекции и маски."""
+
+    def __init__(self, done, detections, masks):
+        self.done = done
+        self.detections = detections
+        self.masks = masks
+        self.dirty = False
+
+    def frame_detections(self, index):
+        frames = self.detections["frame"]
+        start, end = np.searchsorted(frames, index, "left"), np.searchsorted(frames, index, "right")
+        return self.detections[start:end]
+
+    def writable(self):
+        if not self.dirty:
+            self.done = np.array(self.done)
+            self.detections = np.array(self.detections)
+            self.masks = np.array(self.masks) if self.masks is not None else None
+            self.dirty = True
+
+
+class CacheEntry:
+    """Результаты одного анализа одного видео с фиксированными моделями и параметрами.
+
+    get_*() возвращает None для непосчитанного кадра. Записанные блоки
+    сохраняются при переходе к другому блоку и в close().
+
+    Результаты с состоянием между кадрами (id треков, ключевые кадры)
+    воспроизводятся только целиком: require_complete(frame_count, step)
+    включает чтение, если посчитаны все кадры видео (каждый step-й), иначе
+    get_*() возвращают None и запись пересчитывается заново. Пока запись
+    не полная (recording), обработчик не должен пропускать кадры.
+
+    Запись, открытая только для чтения (read_only: её уже пишет другой
+    сеанс), воспроизводится, если она полная, а иначе только пропускает
+    обработку мимо кэша: put_*() ничего не сохраняют.
+    """
+
+    def __init__(self, cache, key, path, meta, read_only=False):
+        self.cache = cache
+        self.key = key
+        self.path = path
+        self.meta = meta
+        self.chunk_frames = meta["chunk_frames"]
+        self._classes = {name: i for i, name in enumerate(meta["classes"])}
+        self._chunk_index = None
+        self._chunk = None
+        self.replay = True  # False - кадры только записываются, см. require_complete
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+
+    def _file(self, chunk_index, kind):
+        return self.path / f"{chunk_index:06d}.{kind}.npy"
+
+    def _load(self, chunk_index):
+        if chunk_index == self._chunk_index:
+            return self._chunk
+        self._flush()
+        done_path = self._file(chunk_index, "done")
+        if done_path.exists():
+            mask_path = self._file(chunk_index, "mask")
+            chunk = _Chunk(
+                np.load(done_path, mmap_mode="r"),
+                np.load(self._file(chunk_index, "det"), mmap_mode="r"),
+                np.load(mask_path, mmap_mode="r") if mask_path.exists() else None,
+            )
+        else:
+            chunk = _Chunk(np.zeros(self.chunk_frames, dtype=bool), np.empty(0, dtype=DETECTION_DTYPE), None)
+        self._chunk_index, self._chunk = chunk_index, chunk
+        return chunk
+
+    def _flush(self):
+        chunk = self._chunk
+        if chunk is None or not chunk.dirty:
+            return
+        _save_array(self._file(self._chunk_index, "det"), chunk.detections)
+        if chunk.masks is not None:
+            _save_array(self._file(self._chunk_index, "mask"), chunk.masks)
+        # Признаки готовности пишутся последними: по ним блок считается существующим
+        _save_array(self._file(self._chunk_index, "done"), chunk.done)
+        chunk.dirty = False
+        _write_json(self.path / "meta.json", self.meta)  # таблица классов могла пополниться
+
+    def _slot(self, index):
+        chunk = self._load(index // self.chunk_frames)
+        return chunk, index % self.chunk_frames
+
+    def has(self, index):
+        chunk, slot = self._slot(index)
+        return bool(chunk.done[slot])
+
+    @property
+    def recording(self):
+        return not self.replay and not self.read_only
+
+    def covers(self, frame_count, step=1):
+        """Посчитаны ли кадры 0, step, 2 * step, ... < frame_count (False, если длина видео неизвестна)."""
+        if not frame_count:
+            return False
+        for chunk_index in range((frame_count + self.chunk_frames - 1) // self.chunk_frames):
+            first = chunk_index * self.chunk_frames
+            count = min(self.chunk_frames, frame_count - first)
+            if chunk_index == self._chunk_index:
+                done = self._chunk.done
+            else:
+                done_path = self._file(chunk_index, "done")
+                if not done_path.exists():
+                    return False
+                done = np.load(done_path, mmap_mode="r")
+            if not np.all(done[(-first) % step:count:step]):
+                return False
+        return True
+
+    def require_complete(self, frame_count, step=1):
+        """Чтение только полностью посчитанной записи; возвращает True, если запись воспроизводится."""
+        self.replay = self.covers(frame_count, step)
+        return self.replay
+
+    def get_detections(self, index):
+        """Детекции кадра [x1, y1, x2, y2, score, track_id, class_name] или None."""
+        chunk, slot = self._slot(index)
+        if not self.replay or not chunk.done[slot]:
+            self.misses += 1
+            return None
+        self.hits += 1
+        classes = self.meta["classes"]
+        return [
+            [int(row["x1"]), int(row["y1"]), int(row["x2"]), int(row["y2"]), float(row["score"]),
+             int(row["track_id"]), classes[row["class_id"]]]
+            for row in chunk.frame_detections(index)
+        ]
+
+    def put_detections(self, index, detections):
+        """Сохранение детекций кадра в формате get_detections()."""
+        if self.read_only:
+            return
+        rows = np.empty(len(detections), dtype=DETECTION_DTYPE)
+        for row, (x1, y1, x2, y2, score, track_id, class_name) in zip(rows, detections):
+            row["frame"] = index
+            row["x1"], row["y1"], row["x2"], row["y2"] = x1, y1, x2, y2
+            row["score"] = score
+            row["track_id"] = track_id
+            row["class_id"] = self._class_id(class_name)
+
+        chunk, slot = self._slot(index)
+        chunk.writable()
+        kept = chunk.detections[chunk.detections["frame"] != index]
+        detections = np.concatenate([kept, rows])
+        chunk.detections = detections[np.argsort(detections["frame"], kind="stable")]
+        chunk.done[slot] = True
+
+    def get_mask(self, index):
+        """Маска классов кадра (представление memmap, только чтение) или None."""
+        chunk, slot = self._slot(index)
+        if not self.replay or not chunk.done[slot] or chunk.masks is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return chunk.masks[slot]
+
+    def put_mask(self, index, mask):
+        if self.read_only:
+            return
+        chunk, slot = self._slot(index)
+        chunk.writable()
+        if chunk.masks is None or chunk.masks.shape[1:] != mask.shape:
+            chunk.masks = np.zeros((self.chunk_frames,) + mask.shape, dtype=np.uint8)
+            chunk.done[:] = False
+        chunk.masks[slot] = mask
+        chunk.done[slot] = True
+
+    def _class_id(self, name):
+        class_id = self._classes.get(name)
+        if class_id is None:
+            class_id = self._classes[name] = len(self.meta["classes"])
+            self.meta["classes"].append(name)
+        return class_id
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        """Сохранение незаписанного блока, снятие блокировки и соблюдение лимита размера кэша."""
+        if self.read_only:
+            self._chunk_index, self._chunk = None, None
+            return
+        self._flush()
+        self._chunk_index, self._chunk = None, None
+        self.meta["last_used"] = time.time()
+        self.meta["bytes"] = self.cache.entry_bytes(self.path)
+        _write_json(self.path / "meta.json", self.meta)
+        self.cache.enforce_limit(keep=self.key)
+        self.cache.release(self.path)
+
+
+class NullCacheEntry:
+    """Запись-заглушка, когда кэш выключен: ничего не хранит."""
+
+    hits = misses = 0
+    replay = recording = False
+    read_only = True
+
+    def has(self, index):
+        return False
+
+    def require_complete(self, frame_count, step=1):
+        return False
+
+    def get_detections(self, index):
+        return None
+
+    def put_detections(self, index, detections):
+        pass
+
+    def get_mask(self, index):
+        return None
+
+    def put_mask(self, index, mask):
+        pass
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+NULL_CACHE_ENTRY = NullCacheEntry()
+
+
+class ResultCache:
+    """Каталог записей кэша с лимитом размера max_bytes.
+
+    Хэши файлов (видео и весов) запоминаются в index.json по размеру и
+    mtime, так что большое видео хэшируется один раз.
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, chunk_frames=CHUNK_FRAMES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.chunk_frames = chunk_frames
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _index_path(self):
+        return self.root / "index.json"
+
+    def file_hash(self, path):
+        """Хэш содержимого файла, запомненный по (путь, размер, mtime)."""
+        path = Path(path).resolve()
+        stat = path.stat()
+        with self._lock:
+            index_path = self._index_path()
+            index = json.loads(index_path.read_text(encoding="utf-8")) if index_path.exists() else {}
+            known = index.get(str(path))
+            if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+                return known[2]
+        digest = _hash_file(path)
+        with self._lock:
+            index = json.loads(index_path.read_text(encoding="utf-8")) if index_path.exists() else {}
+            index[str(path)] = [stat.st_size, stat.st_mtime_ns, digest]
+            _write_json(index_path, index)
+        return digest
+
+    def open(self, video_path, analysis, weights=(), params=None):
+        """Запись для видео, анализа, весов моделей и параметров инференса.
+
+        Если запись уже пишет другой обработчик, она открывается только для чтения.
+        """
+        identity = {
+            "video": self.file_hash(video_path),
+            "analysis": analysis,
+            "weights": [self.file_hash(path) for path in weights],
+            "params": params or {},
+        }
+        key = hashlib.blake2b(json.dumps(identity, sort_keys=True).encode(), digest_size=16).hexdigest()
+        path = self.root / key
+        path.mkdir(parents=True, exist_ok=True)
+        writer = self.acquire(path)
+        meta_path = path / "meta.json"
+        if meta_path.exists():
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        else:
+            meta = {**identity, "source": str(video_path), "chunk_frames": self.chunk_frames, "classes": [],
+                    "created": time.time(), "bytes": 0}
+        if writer:
+            meta["last_used"] = time.time()
+            _write_json(meta_path, meta)
+        return CacheEntry(self, key, path, meta, read_only=not writer)
+
+    @staticmethod
+    def acquire(path):
+        """Захват записи для записи; False, если её держит другой сеанс или процесс."""
+        lock_path = Path(path) / LOCK_NAME
+        with _writers_lock:
+            if lock_path in _writers:
+                return False
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not _stale_lock(lock_path):
+                    return False
+                lock_path.unlink(missing_ok=True)
+                try:
+                    fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                except FileExistsError:
+                    return False
+            with os.fdopen(fd, "w") as file:
+                file.write(str(os.getpid()))
+            _writers.add(lock_path)
+            return True
+
+    @staticmethod
+    def release(path):
+        lock_path = Path(path) / LOCK_NAME
+        with _writers_lock:
+            if lock_path in _writers:
+                _writers.discard(lock_path)
+                lock_path.unlink(missing_ok=True)
+
+    def locked(self, key):
+        return (self.root / key / LOCK_NAME).exists()
+
+    @staticmethod
+    def entry_bytes(path):
+        return sum(file.stat().st_size for file in Path(path).iterdir() if file.is_file())
+
+    def entries(self):
+        """Записи кэша от недавно использованных к давним."""
+        entries = []
+        for meta_path in self.root.glob("*/meta.json"):
+            try:
+                meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            entries.append({
+                "key": meta_path.parent.name,
+                "analysis": meta.get("analysis"),
+                "source": meta.get("source"),
+                "frames": sum(int(np.load(done, mmap_mode="r").sum())
+                              for done in meta_path.parent.glob("*.done.npy")),
+                "bytes": self.entry_bytes(meta_path.parent),
+                "last_used": meta.get("last_used", 0.0),
+            })
+        return sorted(entries, key=lambda entry: entry["last_used"], reverse=True)
+
+    def size_bytes(self):
+        return sum(self.entry_bytes(path) for path in self.root.iterdir() if path.is_dir())
+
+    def remove(self, key):
+        shutil.rmtree(self.root / key, ignore_errors=True)
+
+    def prune(self, max_bytes=None, older_than_s=None, keep=None):
+        """Удаление записей старше older_than_s и давних записей сверх max_bytes; возвращает удалённые."""
+        removed = []
+        entries = self.entries()
+        total = sum(entry["bytes"] for entry in entries)
+        now = time.time()
+        for entry in reversed(entries):
+            # Записи, которые сейчас пишутся, не удаляются
+            if entry["key"] == keep or self.locked(entry["key"]):
+                continue
+            expired = older_than_s is not None and now - entry["last_used"] > older_than_s
+            if expired or (max_bytes is not None and total > max_bytes):
+                self.remove(entry["key"])
+                total -= entry["bytes"]
+                removed.append(entry)
+        return removed
+
+    def enforce_limit(self, keep=None):
+        if self.max_bytes is not None and self.size_bytes() > self.max_bytes:
+            return self.prune(self.max_bytes, keep=keep)
+        return []
+
+    def clear(self):
+        for entry in self.entries():
+            self.remove(entry["key"])
+
+
+def _format_size(size):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--root", default=str(CACHE_DIR), help="каталог кэша")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="записи кэша от недавних к давним")
+    prune = commands.add_parser("prune", help="удалить давние записи")
+    prune.add_argument("--max-size", type=float, help="оставить не больше N ГиБ")
+    prune.add_argument("--older-than", type=float, help="удалить записи, не использованные N дней")
+    commands.add_parser("clear", help="удалить все записи")
+    args = parser.parse_args(argv)
+
+    cache = ResultCache(args.root, max_bytes=None)
+    if args.command == "list":
+        entries = cache.entries()
+        print(f"{'key':<32} {'analysis':<9} {'frames':>7} {'size':>10} {'last used':<16} source")
+        for entry in entries:
+            used = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["last_used"]))
+            print(f"{entry['key']:<32} {entry['analysis']:<9} {entry['frames']:>7} "
+                  f"{_format_size(entry['bytes']):>10} {used:<16} {entry['source']}")
+        print(f"Всего: {len(entries)} записей, {_format_size(sum(e['bytes'] for e in entries))}")
+    elif args.command == "prune":
+        max_bytes = args.max_size * 1024 ** 3 if args.max_size is not None else None
+        older_than = args.older_than * 86400 if args.older_than is not None else None
+        removed = cache.prune(max_bytes, older_than)
+        print(f"Удалено записей: {len(removed)}, освобождено {_format_size(sum(e['bytes'] for e in removed))}")
+    else:
+        cache.clear()
+        print("Кэш очищен")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
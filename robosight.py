@@ -0,0 +1,447 @@
+"""Пакетная обработка видео RoboSight без графического интерфейса.
+
+Примеры:
+    python robosight.py mobile run.mp4 --output run_mobile.mp4 --log run_mobile.jsonl
+    python robosight.py static run.mp4 --log run_static.csv
+    python robosight.py terrain run.mp4 --output run_terrain.mp4
+    python robosight.py combined run.mp4 --terrain-rate 5 --log run_all.jsonl
+    python robosight.py mobile long_run.mp4 --workers 8 --log long_run.jsonl
+    python robosight.py combined run.mp4 --log run_all.rslog
+"""
+import argparse
+import csv
+import json
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import cv2
+
+from frame_source import open_source
+
+
+class StageTimer:
+    """Накопление времени по стадиям обработки кадра."""
+
+    def __init__(self):
+        self.totals = {}
+        self.frames = 0
+
+    @contextmanager
+    def measure(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[stage] = self.totals.get(stage, 0.0) + time.perf_counter() - start
+
+    def report(self, wall_time):
+        frames = max(self.frames, 1)
+        return {
+            "frames": self.frames,
+            "wall_s": wall_time,
+            "fps": self.frames / wall_time if wall_time > 0 else 0.0,
+            "stage_ms": {stage: total * 1000 / frames for stage, total in self.totals.items()},
+        }
+
+
+# Столбцы CSV для объединённых записей комбинированного режима
+COMBINED_FIELDS = ["frame", "time", "analysis", "id", "class", "x1", "y1", "x2", "y2", "score", "speed", "size",
+                   "fraction"]
+
+
+class DetectionLog:
+    """Покадровый журнал детекций: JSON lines (по кадру на строку) или CSV (по детекции на строку).
+
+    Бинарный журнал .rslog с масками рельефа пишет columnar_log.ColumnarLogWriter (см. open_detection_log).
+
+    records - список записей одного конвейера или объединённая запись
+    комбинированного режима (словарь по анализам); в CSV она раскладывается
+    на строки со столбцом analysis.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.as_csv = self.path.suffix.lower() == ".csv"
+        self.file = open(self.path, "w", newline="", encoding="utf-8")
+        self.csv_writer = None
+
+    def write(self, frame_index, timestamp, records, mask=None, grid=None):
+        # Маски и сетки рельефа в текстовые журналы не пишутся (только в .rslog), только доли классов
+        combined = isinstance(records, dict)
+        if not self.as_csv:
+            line = {"frame": frame_index, "time": round(timestamp, 4)}
+            if combined:
+                line.update(records)
+            else:
+                line["detections"] = records
+            self.file.write(json.dumps(line, ensure_ascii=False) + "\n")
+            return
+
+        if combined:
+            records = [
+                {"analysis": analysis, **record}
+                for analysis, rows in records.items() if isinstance(rows, list)
+                for record in rows
+            ]
+        for record in records:
+            row = {"frame": frame_index, "time": round(timestamp, 4), **record}
+            if self.csv_writer is None:
+                fieldnames = COMBINED_FIELDS if combined else list(row)
+                self.csv_writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+                self.csv_writer.writeheader()
+            self.csv_writer.writerow(row)
+
+    def close(self):
+        self.file.close()
+
+
+def open_detection_log(path, mode, cap=None, source=None):
+    """Журнал по расширению: .rslog - бинарный (columnar_log), иначе JSON lines или CSV."""
+    if Path(path).suffix.lower() == ".rslog":
+        from columnar_log import open_log_writer
+        return open_log_writer(path, mode, cap, source)
+    return DetectionLog(path)
+
+
+class MobilePipeline:
+    """Мобильные объекты: трекинг тремя YOLO-моделями, объединение и оценка скорости."""
+
+    def __init__(self, motion_gate=False, motion_threshold=16.0, motion_min_area=12, backend="torch",
+                 target_fps=None, adaptive_log=None):
+        from module_mobile_object import load_mobile_models
+        self.processor, _ = load_mobile_models(backend)
+        if motion_gate:
+            self.processor.enable_motion_gate(var_threshold=motion_threshold, min_blob_area=motion_min_area)
+        if target_fps:
+            self.processor.enable_adaptive_resolution(target_fps, log_path=adaptive_log)
+        # False - треки не рисуются (их id перенумеровываются при сшивке сегментов)
+        self.draw_tracks = True
+
+    def process(self, frame, timestamp, timer):
+        with timer.measure("inference"):
+            detections = self.processor.detect(frame)
+        with timer.measure("draw"):
+            records = self.processor.update_tracks(detections, timestamp)
+            if self.draw_tracks:
+                self.processor.draw_records(frame, records)
+        return frame, records
+
+    def model_report(self):
+        return self.processor.ensemble.latency_report()["per_model_ms"]
+
+    def extra_report(self):
+        report = {}
+        if self.processor.motion_gate is not None:
+            report["motion_gate"] = self.processor.motion_gate.stats()
+        if self.processor.adaptive is not None:
+            report["adaptive"] = self.processor.adaptive.stats()
+        return report
+
+
+class StaticPipeline:
+    """Статичные объекты: деревья, камни и кусты."""
+
+    def __init__(self, keyframe_interval=None, scene_change=25.0, propagation="lk", hit_rate_check=0,
+                 backend="torch", target_fps=None, adaptive_log=None):
+        from static_object_detection import ObjectDetectionProcessor, load_static_models
+        models, labels = load_static_models(backend)
+        self.processor = ObjectDetectionProcessor(models, labels, None)
+        if keyframe_interval is not None:
+            self.processor.enable_keyframes(interval=keyframe_interval, scene_change_threshold=scene_change,
+                                            method=propagation, evaluate_every=hit_rate_check)
+        if target_fps:
+            self.processor.enable_adaptive_resolution(target_fps, log_path=adaptive_log)
+
+    def process(self, frame, timestamp, timer):
+        with timer.measure("inference"):
+            detections = self.processor.detect(frame)
+        with timer.measure("draw"):
+            self.processor._draw_detections(frame, detections)
+        return frame, self.processor.detection_records(detections)
+
+    def model_report(self):
+        return self.processor.ensemble.latency_report()["per_model_ms"]
+
+    def extra_report(self):
+        report = {}
+        if self.processor.keyframe_detector is not None:
+            report["keyframes"] = self.processor.keyframe_detector.stats()
+        if self.processor.adaptive is not None:
+            report["adaptive"] = self.processor.adaptive.stats()
+        return report
+
+
+class TerrainPipeline:
+    """Сегментация рельефа и типа поверхности."""
+
+    def __init__(self, reuse_threshold=None, refresh_interval=10, reuse_method="diff", drift_check=0,
+                 backend="torch", target_fps=None, adaptive_log=None, grid=(32, 32), grid_decay=0.8):
+        from terrain_engine import EAGER
+        from terrain_module import TerrainModelLoader
+        # ONNX-бэкенды совпадают по имени с режимами движка рельефа
+        self.processor = TerrainModelLoader(EAGER if backend == "torch" else backend).get_video_processor()
+        if reuse_threshold is not None:
+            self.processor.enable_temporal_reuse(threshold=reuse_threshold, refresh_interval=refresh_interval,
+                                                 method=reuse_method, drift_check_interval=drift_check)
+        if target_fps:
+            self.processor.enable_adaptive_resolution(target_fps, log_path=adaptive_log)
+        # --grid задаётся как столбцы x строки, TerrainGrid принимает (строки, столбцы)
+        self.processor.enable_terrain_grid(grid_shape=grid[::-1], decay=grid_decay)
+
+    def process(self, frame, timestamp, timer):
+        with timer.measure("preprocess"):
+            frame = self.processor.standardize_frame(frame)
+        with timer.measure("inference"):
+            mask = self.processor.segment(frame)
+        with timer.measure("grid"):
+            records = self.processor.update_grid(mask)
+        # Для бинарного журнала
+        self.last_mask = mask
+        self.last_grid = self.processor.terrain_grid.probabilities
+        with timer.measure("draw"):
+            width, height = self.processor.target_size
+            overlay = self.processor.render(frame, mask, width, height)
+        return overlay, records
+
+    def model_report(self):
+        return {}
+
+    def extra_report(self):
+        report = {}
+        if self.processor.temporal_reuse is not None:
+            report["temporal_reuse"] = self.processor.temporal_reuse.stats()
+        if self.processor.adaptive is not None:
+            report["adaptive"] = self.processor.adaptive.stats()
+        return report
+
+
+class CombinedPipeline:
+    """Все три анализа на одном декодированном кадре с составным выводом."""
+
+    def __init__(self, mobile_rate=1, static_rate=1, terrain_rate=5, backend="torch"):
+        from combined_module import load_combined_processor
+        rates = {"mobile": mobile_rate, "static": static_rate, "terrain": terrain_rate}
+        self.processor = load_combined_processor(rates, backend)
+
+    def process(self, frame, timestamp, timer):
+        display, record = self.processor.process(frame, timestamp, measure=timer.measure)
+        # Маска рельефа для бинарного журнала - только на кадрах, где она пересчитывалась
+        fresh_terrain = record["fresh"]["terrain"]
+        self.last_mask = self.processor._terrain_mask if fresh_terrain else None
+        self.last_grid = self.processor.terrain.terrain_grid.probabilities if fresh_terrain else None
+        return display, record
+
+    def model_report(self):
+        return self.processor.model_report()
+
+    def extra_report(self):
+        letterbox = self.processor.shared_letterbox
+        return {"shared_letterbox": {"hits": letterbox.hits, "misses": letterbox.misses}}
+
+
+PIPELINES = {
+    "mobile": MobilePipeline,
+    "static": StaticPipeline,
+    "terrain": TerrainPipeline,
+    "combined": CombinedPipeline,
+}
+
+
+def run_headless(mode, input_path, output_path=None, log_path=None, max_frames=None, options=None, stride=1,
+                 decode_size=None):
+    """Обработка источника кадров выбранным конвейером без отображения и без ограничения частоты кадров.
+
+    Кадры читаются наперёд в отдельном потоке; stride > 1 - обрабатывается
+    каждый stride-й кадр (остальные пропускаются без декодирования),
+    decode_size - уменьшение кадров при декодировании.
+    """
+    pipeline = PIPELINES[mode](**(options or {}))
+
+    cap = open_source(input_path, decode_size=decode_size, stride=stride, prefetch=4)
+    fps = cap.fps
+
+    timer = StageTimer()
+    writer = None
+    log = open_detection_log(log_path, mode, cap, input_path) if log_path else None
+    start = time.perf_counter()
+    try:
+        while max_frames is None or timer.frames < max_frames:
+            with timer.measure("decode"):
+                ret, frame = cap.read()
+            if not ret:
+                break
+
+            timestamp = cap.pts
+            annotated, records = pipeline.process(frame, timestamp, timer)
+
+            if output_path:
+                with timer.measure("write"):
+                    if writer is None:
+                        height, width = annotated.shape[:2]
+                        writer = cv2.VideoWriter(str(output_path), cv2.VideoWriter_fourcc(*"mp4v"), fps / stride,
+                                                 (width, height))
+                    writer.write(annotated)
+            if log is not None:
+                with timer.measure("log"):
+                    log.write(cap.frame_index, timestamp, records, mask=getattr(pipeline, "last_mask", None),
+                              grid=getattr(pipeline, "last_grid", None))
+            timer.frames += 1
+    finally:
+        cap.release()
+        if writer is not None:
+            writer.release()
+        if log is not None:
+            log.close()
+
+    report = timer.report(time.perf_counter() - start)
+    report["model_ms"] = pipeline.model_report()
+    report["extra"] = pipeline.extra_report() if hasattr(pipeline, "extra_report") else {}
+    return report
+
+
+def format_report(report):
+    lines = [f"Обработано кадров: {report['frames']} за {report['wall_s']:.2f} с ({report['fps']:.2f} FPS)"]
+    for stage, ms in report["stage_ms"].items():
+        lines.append(f"  {stage:<12} {ms:8.2f} мс/кадр")
+    for name, ms in report["model_ms"].items():
+        lines.append(f"    {name:<10} {ms:8.2f} мс/кадр")
+    for name, values in report["extra"].items():
+        lines.append(f"  {name}: " + ", ".join(f"{key}={value}" for key, value in values.items()))
+    return "\n".join(lines)
+
+
+def parse_size(text):
+    """Размер "960x540" -> (960, 540)."""
+    width, _, height = text.lower().partition("x")
+    if not width.isdigit() or not height.isdigit():
+        raise argparse.ArgumentTypeError(f"Invalid size: {text}")
+    return int(width), int(height)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="robosight", description=__doc__.splitlines()[0])
+    parser.add_argument("mode", choices=sorted(PIPELINES), help="конвейер обработки")
+    parser.add_argument("input", help="видеофайл, номер камеры, каталог изображений, URL потока или sim://видеофайл")
+    parser.add_argument("--output", "-o", help="путь к размеченному MP4")
+    parser.add_argument("--log", "-l", help="журнал детекций: .jsonl, .csv или бинарный .rslog (с масками рельефа)")
+    parser.add_argument("--max-frames", type=int, help="обработать не больше N кадров")
+    parser.add_argument("--stride", type=int, default=1, help="обрабатывать каждый N-й кадр (остальные не декодируются)")
+    parser.add_argument("--decode-size", type=parse_size,
+                        help="уменьшать кадры при декодировании до ШИРИНАxВЫСОТА (с сохранением пропорций)")
+    parser.add_argument("--backend", choices=["torch", "onnx", "onnx-int8"], default="torch",
+                        help="бэкенд инференса; ONNX-модели готовит python inference_backends.py")
+
+    parallel = parser.add_argument_group("parallel")
+    parallel.add_argument("--workers", type=int, default=1,
+                          help="обрабатывать сегменты видео в N процессах (см. parallel_offline.py)")
+    parallel.add_argument("--segments", type=int, help="число сегментов (по умолчанию по одному на процесс)")
+    parallel.add_argument("--overlap", type=int, default=10,
+                          help="кадров перекрытия сегментов для сопоставления id треков")
+
+    mobile = parser.add_argument_group("mobile")
+    mobile.add_argument("--motion-gate", action="store_true",
+                        help="пропускать кадры без движения и детектировать только вокруг движения и треков")
+    mobile.add_argument("--motion-threshold", type=float, default=16.0,
+                        help="порог вычитателя фона: меньше - чувствительнее")
+    mobile.add_argument("--motion-min-area", type=int, default=12,
+                        help="минимальная площадь пятна движения в пикселях пробы шириной 320")
+
+    static = parser.add_argument_group("static")
+    static.add_argument("--keyframe-interval", type=int,
+                        help="запускать модели только на каждом N-м кадре и при смене сцены")
+    static.add_argument("--scene-change", type=float, default=25.0,
+                        help="порог смены сцены (средняя разность яркости)")
+    static.add_argument("--propagation", choices=["lk", "homography"], default="lk",
+                        help="перенос боксов между ключевыми кадрами")
+    static.add_argument("--hit-rate-check", type=int, default=0,
+                        help="контрольная полная детекция на каждом N-м перенесённом кадре")
+
+    terrain = parser.add_argument_group("terrain")
+    terrain.add_argument("--reuse-threshold", type=float,
+                         help="порог изменения кадра, ниже которого маска рельефа переиспользуется")
+    terrain.add_argument("--refresh-interval", type=int, default=10,
+                         help="принудительный инференс каждые N кадров")
+    terrain.add_argument("--reuse-method", choices=["diff", "flow"], default="diff")
+    terrain.add_argument("--grid", type=parse_size, default=(32, 32),
+                         help="сетка вероятностей классов и проходимости СТОЛБЦЫxСТРОКИ (пишется в .rslog)")
+    terrain.add_argument("--grid-decay", type=float, default=0.8,
+                         help="затухание сетки: доля прежних вероятностей при обновлении кадром")
+    terrain.add_argument("--drift-check", type=int, default=0,
+                         help="контрольный полный инференс на каждом N-м пропущенном кадре")
+
+    adaptive = parser.add_argument_group("adaptive")
+    adaptive.add_argument("--target-fps", type=float,
+                          help="подбирать размер входа моделей и шаг кадров под эту частоту (mobile, static, terrain)")
+    adaptive.add_argument("--adaptive-log", help="журнал переключений размера входа и шага (JSON Lines)")
+
+    combined = parser.add_argument_group("combined")
+    combined.add_argument("--mobile-rate", type=int, default=1, help="мобильные объекты на каждом N-м кадре")
+    combined.add_argument("--static-rate", type=int, default=1, help="статичные объекты на каждом N-м кадре")
+    combined.add_argument("--terrain-rate", type=int, default=5, help="рельеф на каждом N-м кадре")
+    return parser
+
+
+def pipeline_options(args):
+    return {"backend": args.backend, **_mode_options(args)}
+
+
+def _mode_options(args):
+    adaptive = {"target_fps": args.target_fps, "adaptive_log": args.adaptive_log} if args.target_fps else {}
+    if args.mode == "combined":
+        return {
+            "mobile_rate": args.mobile_rate,
+            "static_rate": args.static_rate,
+            "terrain_rate": args.terrain_rate,
+        }
+    if args.mode == "terrain":
+        return {
+            "reuse_threshold": args.reuse_threshold,
+            "refresh_interval": args.refresh_interval,
+            "reuse_method": args.reuse_method,
+            "drift_check": args.drift_check,
+            "grid": args.grid,
+            "grid_decay": args.grid_decay,
+            **adaptive,
+        }
+    if args.mode == "static":
+        return {
+            "keyframe_interval": args.keyframe_interval,
+            "scene_change": args.scene_change,
+            "propagation": args.propagation,
+            "hit_rate_check": args.hit_rate_check,
+            **adaptive,
+        }
+    if args.mode == "mobile":
+        return {
+            "motion_gate": args.motion_gate,
+            "motion_threshold": args.motion_threshold,
+            "motion_min_area": args.motion_min_area,
+            **adaptive,
+        }
+    return {}
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.workers > 1 and (args.stride != 1 or args.decode_size):
+        # Сегменты читаются отдельными процессами целиком: шаг и уменьшение кадров там не поддерживаются
+        parser.error("--stride and --decode-size cannot be combined with --workers > 1")
+    if getattr(args, "motion_gate", False) and args.backend != "torch":
+        # Фрагменты движения идут пакетами разного размера, а ONNX-модели экспортированы с пакетом 1 и одним размером
+        parser.error("--motion-gate requires --backend torch")
+    if args.workers > 1:
+        from parallel_offline import run_parallel
+        report = run_parallel(args.mode, args.input, args.output, args.log, args.max_frames, pipeline_options(args),
+                              workers=args.workers, segments=args.segments, overlap=args.overlap)
+    else:
+        report = run_headless(args.mode, args.input, args.output, args.log, args.max_frames,
+                              pipeline_options(args), stride=args.stride, decode_size=args.decode_size)
+    print(format_report(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
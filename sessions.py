@@ -0,0 +1,271 @@
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Состояния сеанса
+PENDING = "pending"
+RUNNING = "running"
+CANCELLING = "cancelling"
+FINISHED = "finished"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+_local = threading.local()
+
+
+def current_session():
+    """Сеанс, который выполняется в текущем потоке пула, или NULL_SESSION."""
+    return getattr(_local, "session", NULL_SESSION)
+
+
+def _thread_clock(ident):
+    # Часы процессорного времени потока; на платформах без pthread учитывается только завершённая работа
+    try:
+        return time.pthread_getcpuclockid(ident)
+    except (AttributeError, OSError):
+        return None
+
+
+class Session:
+    """Одна обработка видео в потоке пула SessionManager.
+
+    Отмена кооперативная: cancel() выставляет флаг и останавливает все
+    StagedPipeline, запущенные в сеансе (конвейер регистрируется сам при
+    start(), в том числе если отмена пришла раньше, во время загрузки
+    моделей). Обработчики освобождают источники и журналы в своих finally;
+    функции add_cleanup() выполняются после target в обратном порядке
+    регистрации, даже если обработка завершилась ошибкой.
+
+    Процессорное время считается по потоку пула и потокам стадий
+    конвейеров сеанса: законченная работа суммируется при выходе из
+    track_thread(), работающие потоки опрашиваются через их часы.
+    """
+
+    def __init__(self, session_id, name, target, args=()):
+        self.id = session_id
+        self.name = name
+        self.target = target
+        self.args = args
+        self.state = PENDING
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._pipelines = []
+        self._cleanups = []
+        self._threads = {}  # ident -> (часы потока, процессорное время на входе)
+        self._cpu_done = 0.0
+        self._sample = (time.perf_counter(), 0.0)
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def cancel(self):
+        """Запрос остановки; обработка завершится после текущего кадра каждой стадии."""
+        with self._lock:
+            self._cancel.set()
+            if self.state == RUNNING:
+                self.state = CANCELLING
+            pipelines = list(self._pipelines)
+        for pipeline in pipelines:
+            pipeline.stop()
+
+    def attach(self, pipeline):
+        """Регистрация конвейера сеанса (вызывается из StagedPipeline.start)."""
+        with self._lock:
+            self._pipelines.append(pipeline)
+        if self.cancelled:
+            pipeline.stop()
+
+    def add_cleanup(self, func):
+        """Функция освобождения ресурсов, выполняется при завершении сеанса."""
+        with self._lock:
+            self._cleanups.append(func)
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    @contextmanager
+    def track_thread(self):
+        """Учёт процессорного времени текущего потока, пока он работает на сеанс."""
+        ident = threading.get_ident()
+        clock = _thread_clock(ident)
+        start = time.thread_time()
+        with self._lock:
+            self._threads[ident] = (clock, time.clock_gettime(clock) if clock is not None else 0.0)
+        try:
+            yield
+        finally:
+            with self._lock:
+                del self._threads[ident]
+                self._cpu_done += time.thread_time() - start
+
+    def cpu_seconds(self):
+        """Процессорное время сеанса, с."""
+        with self._lock:
+            total = self._cpu_done
+            for clock, start in self._threads.values():
+                if clock is not None:
+                    total += time.clock_gettime(clock) - start
+        return total
+
+    def cpu_percent(self):
+        """Загрузка процессора с прошлого вызова, % одного ядра (несколько потоков дают больше 100)."""
+        now, cpu = time.perf_counter(), self.cpu_seconds()
+        last_time, last_cpu = self._sample
+        self._sample = (now, cpu)
+        return 100.0 * (cpu - last_cpu) / max(now - last_time, 1e-9)
+
+    def run(self):
+        """Выполнение в потоке пула."""
+        with self._lock:
+            if self._cancel.is_set():
+                self.state = CANCELLED
+                self.finished_at = time.time()
+                self._done.set()
+                return
+            self.state = RUNNING
+        self.started_at = time.time()
+        self._sample = (time.perf_counter(), 0.0)
+        _local.session = self
+        try:
+            with self.track_thread():
+                self.target(*self.args)
+        except Exception as e:
+            self.error = e
+            logger.warning("Сеанс %s (%s) завершился ошибкой: %s", self.id, self.name, e)
+        finally:
+            _local.session = NULL_SESSION
+            self._release()
+            with self._lock:
+                self.state = CANCELLED if self.cancelled else FAILED if self.error is not None else FINISHED
+                self._pipelines = []
+                self.finished_at = time.time()
+            self._done.set()
+
+    def _release(self):
+        with self._lock:
+            cleanups, self._cleanups = self._cleanups[::-1], []
+        for func in cleanups:
+            try:
+                func()
+            except Exception as e:
+                logger.warning("Сеанс %s: ошибка освобождения ресурсов: %s", self.id, e)
+
+    def stats(self):
+        end = self.finished_at or time.time()
+        return {
+            "id": self.id,
+            "name": self.name,
+            "state": self.state,
+            "elapsed_s": round(end - (self.started_at or end), 1),
+            "cpu_s": round(self.cpu_seconds(), 2),
+            "cpu_percent": round(self.cpu_percent(), 1) if not self.done else 0.0,
+        }
+
+
+class NullSession:
+    """Сеанс-заглушка для конвейеров, запущенных вне SessionManager."""
+
+    id = None
+    cancelled = False
+
+    def attach(self, pipeline):
+        pass
+
+    def add_cleanup(self, func):
+        pass
+
+    @contextmanager
+    def track_thread(self):
+        yield
+
+
+NULL_SESSION = NullSession()
+
+
+class SessionManager:
+    """Пул из max_workers переиспользуемых потоков для обработок видео.
+
+    submit() ставит сеанс в очередь пула: если все потоки заняты, сеанс
+    ждёт в состоянии pending. Сеансы с одинаковым resource (например,
+    общим обработчиком с трекерами и буферами) выполняются по очереди:
+    следующий передаётся пулу, когда завершится предыдущий, и до этого
+    не занимает поток. active() - сеансы, которые ещё не завершились;
+    stats() - их состояние и загрузка процессора.
+    """
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="session")
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._sessions = []
+        self._busy = set()
+        self._waiting = {}  # resource -> сеансы, ожидающие освобождения resource
+
+    def submit(self, name, target, *args, resource=None):
+        session = Session(next(self._ids), name, target, args)
+        with self._lock:
+            # Завершённые сеансы больше не показываются
+            self._sessions = [s for s in self._sessions if not s.done]
+            self._sessions.append(session)
+            if resource is not None and resource in self._busy:
+                self._waiting.setdefault(resource, deque()).append(session)
+                return session
+            if resource is not None:
+                self._busy.add(resource)
+        self._executor.submit(self._run, session, resource)
+        return session
+
+    def _run(self, session, resource):
+        session.run()
+        # Отменённые сеансы из очереди ресурса завершаются сразу, без передачи пулу
+        following = self._next(resource)
+        while following is not None and following.cancelled:
+            following.run()
+            following = self._next(resource)
+        if following is not None:
+            self._executor.submit(self._run, following, resource)
+
+    def _next(self, resource):
+        if resource is None:
+            return None
+        with self._lock:
+            waiting = self._waiting.get(resource)
+            if waiting:
+                return waiting.popleft()
+            self._busy.discard(resource)
+            self._waiting.pop(resource, None)
+            return None
+
+    def active(self):
+        with self._lock:
+            return [s for s in self._sessions if not s.done]
+
+    def stats(self):
+        return [session.stats() for session in self.active()]
+
+    def cancel_all(self):
+        for session in self.active():
+            session.cancel()
+
+    def shutdown(self, wait=True):
+        """Отмена всех сеансов и остановка пула."""
+        self.cancel_all()
+        self._executor.shutdown(wait=wait)
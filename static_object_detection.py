@@ -1,79 +1,223 @@
 import cv2
-import random
-import threading
-from PIL import Image, ImageTk
-from ultralytics import YOLO
+import numpy as np
+import time
 from pathlib import Path
 import logging
+from metrics import NULL_METRICS, PerformanceMetrics
+from model_ensemble import ModelEnsemble
+from model_registry import load_yolo, own_predictor
+from pipeline import OFFLINE, StagedPipeline
+from playback_clock import PlaybackClock
+from presenter import TkPresenter, fit_frame, label_colors
+from columnar_log import open_log_writer
+from frame_source import open_source
+from result_cache import NULL_CACHE_ENTRY, model_paths
 
 logging.getLogger('ultralytics').setLevel(logging.WARNING)
 
 class ObjectDetectionProcessor:
-    def __init__(self, models, labels, input_video_path, canvas, root, output_size=(800, 600)):
+    def __init__(self, models, labels, input_video_path, canvas=None, root=None, output_size=(800, 600),
+                 policy=OFFLINE, realtime=True, decode_size=None):
         self.models = models
         self.labels = labels
         self.input_video_path = input_video_path
         self.canvas = canvas
         self.root = root
         self.output_size = output_size  # Размер отображаемого видео
+        # Параллельный запуск моделей на общем letterbox-тензоре
+        self.ensemble = ModelEnsemble(models, names=labels)
+        self.label_colors = label_colors(labels)  # цвета меток вычисляются один раз
+        self.policy = policy  # live - отбрасывать кадры при отставании, offline - каждый кадр
+        self.pipeline_stats = None
+        self.keyframe_detector = None  # KeyframeDetector, если включён режим статичной сцены
+        self.realtime = realtime  # вывод в темпе исходного видео с пропуском просроченных кадров
+        self.playback_stats = None
+        self.metrics = NULL_METRICS  # метрики по стадиям, см. enable_metrics
+        self.result_cache = None  # ResultCache для повторно открываемых видео, см. enable_result_cache
+        self.cache_stats = None
+        self.detection_log = None  # путь к журналу .rslog, см. enable_detection_log
+        self.adaptive = None  # ResolutionController, см. enable_adaptive_resolution
+        self._held = None
 
-        self.cap = cv2.VideoCapture(input_video_path)
-        if not self.cap.isOpened():
-            raise Exception("Error: Could not open video file.")
-        
-        self.fps = int(self.cap.get(cv2.CAP_PROP_FPS))
+        # Без пути к видео процессор используется только для покадровой обработки
+        self.cap = None
+        self.decode_size = None
+        if input_video_path is None:
+            return
+
+        # Источник кадров (файл, камера, каталог изображений); decode_size - уменьшение при декодировании
+        self.decode_size = decode_size
+        self.cap = open_source(input_video_path, decode_size=decode_size)
+
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
         self.frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         self.frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
     def process_video(self):
-        # Обработка видео с использованием моделей и вывод на экран.
-        while True:
-            ret, frame = self.cap.read()
+        # Обработка видео конвейером: чтение, детекция и вывод на экран в отдельных потоках.
+        clock = PlaybackClock(self.fps)
+        cache = self._open_result_cache(self.input_video_path, self.cap.frame_count)
+        # Пока запись кэша не полная, кадры не пропускаются даже при отставании: иначе она не станет полной
+        catch_up = self.realtime and not cache.recording
+        log = open_log_writer(self.detection_log, "static", self.cap, self.input_video_path)
+
+        def decode():
+            with self.metrics.stage("decode"):
+                ret, frame, timestamp = clock.read(self.cap, catch_up=catch_up)
             if not ret:
-                break
+                return None
+            self.metrics.frame_decoded()
+            return clock.frame_index, timestamp, frame
+
+        # Один элемент изображения на холсте, обновляемый в главном потоке Tk через after()
+        presenter = TkPresenter(self.canvas, self.root, self.output_size, self.metrics)
+
+        def infer(item):
+            index, timestamp, frame = item
+            # Получаем детекции для текущего кадра (из кэша, если видео уже обрабатывалось)
+            all_detections = self._detect_cached(cache, index, frame)
+            log.write(index, timestamp, self.detection_records(all_detections))
+
+            # Кадр уменьшается до размера вывода до отрисовки детекций
+            with self.metrics.stage("draw"):
+                frame, scale = fit_frame(frame, self.output_size)
+                self._draw_detections(frame, all_detections, scale)
+            self.metrics.draw_hud(frame)
+            return timestamp, frame
+
+        def present(item):
+            timestamp, frame = item
+            with self.metrics.stage("tk_convert"):
+                # Преобразуем кадр в RGB для Tkinter
+                frame_rgb = presenter.prepare(frame)
+
+            # Ожидание времени показа кадра (при отставании кадры уже пропущены при чтении)
+            if self.realtime:
+                clock.wait(timestamp)
+
+            presenter.post(frame_rgb)
+            self.metrics.frame_presented(clock, pipeline)
+
+        pipeline = StagedPipeline(decode, infer, present, policy=OFFLINE if cache.recording else self.policy,
+                                  name="static")
+        try:
+            self.pipeline_stats = pipeline.run()
+        finally:
+            self.playback_stats = clock.stats()
+            self.metrics.close()
+            cache.close()
+            self.cache_stats = cache.stats()
+            log.close()
+            presenter.close()
+            self._release_resources()
 
-            # Получаем детекции для текущего кадра
-            all_detections = self._process_frame(frame)
+    def enable_keyframes(self, **options):
+        # Режим статичной сцены: модели запускаются только на ключевых кадрах (см. KeyframeDetector).
+        from keyframe_tracking import KeyframeDetector
+        self.keyframe_detector = KeyframeDetector(self._process_frame, **options)
+        return self.keyframe_detector
 
-            # Отрисовка детекций на кадре
-            self._draw_detections(frame, all_detections)
+    def enable_adaptive_resolution(self, target_fps, sizes=(640, 512, 416, 320), strides=(1, 2, 3), **options):
+        # Размер входа ансамбля и шаг кадров подбираются под target_fps (см. ResolutionController).
+        # Для ONNX-моделей размер входа фиксирован, меняется только шаг кадров.
+        from adaptive_resolution import ResolutionController
+        if not self.ensemble.resizable:
+            sizes = (self.ensemble.imgsz,)
+        self.adaptive = ResolutionController("static", target_fps, sizes, strides, initial=self.ensemble.imgsz,
+                                             multiple_of=32, **options)
+        self._held = None
+        return self.adaptive
 
-            # Преобразуем кадр в RGB для Tkinter
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            frame_resized = cv2.resize(frame_rgb, self.output_size)  # Изменяем размер на указанный пользователем
+    def enable_metrics(self, **options):
+        # Сбор p50/p95 по стадиям, счётчиков кадров и вызовов моделей (см. PerformanceMetrics).
+        self.metrics = PerformanceMetrics("static", **options)
+        return self.metrics
 
-            # Преобразуем в изображение Tkinter
-            img = ImageTk.PhotoImage(image=Image.fromarray(frame_resized))
+    def enable_detection_log(self, path):
+        # Запись детекций каждого кадра в журнал .rslog (см. columnar_log).
+        self.detection_log = path
+        return path
 
-            # Обновляем холст с использованием after() для синхронизации с главным потоком
-            self.update_canvas(img)
+    def enable_result_cache(self, cache):
+        # Детекции кадров берутся из ResultCache, если видео уже обрабатывалось с теми же моделями.
+        self.result_cache = cache
+        return cache
 
-            # Пропуск кадров (для улучшения производительности)
-            cv2.waitKey(int(1000 / self.fps))  # Фиксируем задержку для управления частотой кадров
+    def _open_result_cache(self, video_path, frame_count=None, step=1):
+        # С адаптивным размером входа детекции зависят от нагрузки оборудования и не кэшируются
+        if self.result_cache is None or self.adaptive is not None or not Path(str(video_path)).is_file():
+            return NULL_CACHE_ENTRY
+        keyframes = self.keyframe_detector
+        params = {"imgsz": self.ensemble.imgsz, "labels": self.labels,
+                  "keyframes": [keyframes.interval, keyframes.scene_change_threshold, keyframes.method]
+                  if keyframes is not None else None}
+        if self.decode_size is not None:
+            params["decode_size"] = list(self.decode_size)
+        entry = self.result_cache.open(video_path, "static", model_paths(self.models), params)
+        # Ключевые кадры частично посчитанной записи не согласуются с живым запуском:
+        # такая запись пересчитывается целиком
+        entry.require_complete(frame_count, step)
+        return entry
 
-            # Выход по нажатию клавиши 'q'
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
+    def _detect_cached(self, cache, index, frame):
+        # Детекции кадра из записи кэша или детекция с сохранением в кэш.
+        cached = cache.get_detections(index)
+        if cached is not None:
+            return [(np.array(d[:4]), d[6], d[4], self._calculate_size(d[:4])) for d in cached]
+        detections = self.detect(frame)
+        cache.put_detections(index, [[*box[:4], conf, 0, label] for box, label, conf, size in detections])
+        return detections
 
-        self._release_resources()
+    def detect(self, frame):
+        # Детекции для кадра: полный инференс или перенос с ключевого кадра.
+        if self.adaptive is not None:
+            return self._detect_adaptive(frame)
+        return self._detect(frame)
+
+    def _detect_adaptive(self, frame):
+        # На кадрах между запусками моделей (шаг контроллера) возвращаются детекции последнего запуска.
+        if not self.adaptive.step() and self._held is not None:
+            return self._held
+        self.ensemble.imgsz = self.adaptive.size
+        start = time.perf_counter()
+        self._held = self._detect(frame)
+        self.adaptive.observe((time.perf_counter() - start) * 1000)
+        return self._held
+
+    def _detect(self, frame):
+        if self.keyframe_detector is not None:
+            return self.keyframe_detector(frame)
+        return self._process_frame(frame)
 
     def _process_frame(self, frame):
         # Обработка одного кадра и получение всех детекций.
         all_detections = []
-        for model, label in zip(self.models, self.labels):
-            results = model(frame)  # Использование модели для детекции объектов
-
-            if results[0].boxes is not None:  # Проверка наличия детекций
-                boxes = results[0].boxes.xyxy.cpu().numpy().astype(int)
-                confidences = results[0].boxes.conf.cpu().numpy()
-
-                for box, conf in zip(boxes, confidences):
-                    object_label = f"{label}"
-                    size = self._calculate_size(box)
-                    all_detections.append((box, object_label, conf, size))
+        outputs = self.ensemble.predict(frame)
+        if self.metrics.enabled:
+            self.metrics.record("letterbox", self.ensemble.last_latency["preprocess"])
+            for output in outputs:
+                self.metrics.record_model(output.name, output.latency_ms)
+        for output, label in zip(outputs, self.labels):
+            boxes = output.boxes.astype(int)
+            for box, conf in zip(boxes, output.scores):
+                object_label = f"{label}"
+                size = self._calculate_size(box)
+                all_detections.append((box, object_label, conf, size))
 
         return all_detections
 
+    @staticmethod
+    def detection_records(detections):
+        # Записи для журнала детекций.
+        return [
+            {
+                "class": object_label,
+                "x1": int(box[0]), "y1": int(box[1]), "x2": int(box[2]), "y2": int(box[3]),
+                "score": round(float(conf), 4), "size": int(size),
+            }
+            for box, object_label, conf, size in detections
+        ]
+
     def _calculate_size(self, box):
         # Вычисление размера объекта по площади бокса.
         width = box[2] - box[0]
@@ -81,16 +225,17 @@ class ObjectDetectionProcessor:
         size = width * height  # Площадь объекта в пикселях
         return size
 
-    def _draw_detections(self, frame, detections):
-        # Отрисовка всех детекций на кадре.
+    def _draw_detections(self, frame, detections, scale=(1.0, 1.0)):
+        # Отрисовка всех детекций на кадре; scale - масштаб кадра относительно исходного.
+        sx, sy = scale
         for box, object_label, conf, size in detections:
-            random.seed(hash(object_label))
-            color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
+            color = self.label_colors.get(object_label, (0, 255, 0))
+            x1, y1, x2, y2 = int(box[0] * sx), int(box[1] * sy), int(box[2] * sx), int(box[3] * sy)
 
-            cv2.rectangle(frame, (box[0], box[1]), (box[2], box[3]), color, 2)
+            cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
 
-            center_x = (box[0] + box[2]) // 2
-            center_y = (box[1] + box[3]) // 2
+            center_x = (x1 + x2) // 2
+            center_y = (y1 + y2) // 2
 
             # Отображение метки и размера
             cv2.putText(
@@ -103,35 +248,43 @@ class ObjectDetectionProcessor:
                 2,
             )
 
-    def update_canvas(self, img):
-        # Обновление изображения на холсте Tkinter.
-        self.img_tk = img
-        self.canvas.create_image(0, 0, anchor="nw", image=self.img_tk)
-        self.root.update_idletasks()
-
     def _release_resources(self):
         # Освобождение ресурсов.
-        self.cap.release()
+        if self.cap is not None:
+            self.cap.release()
+        self.ensemble.close()
         cv2.destroyAllWindows()
 
-def start_static_object_detection(input_video_path, canvas, root, output_size=(800, 600)):
-    # Корневая директория проекта
-    project_root = Path(__file__).parent.resolve()
-    
-    # Пути к файлам моделей
-    model_paths = [
-        project_root / "models" / "static_models" / "tree.pt",
-        project_root / "models" / "static_models" / "stone.pt",
-        project_root / "models" / "static_models" / "bush.pt"
-    ]
-    
-    # Загружаем модели
-    models = [YOLO(str(path)) for path in model_paths]
-    labels = ["tree", "stone", "bush"]
-
-    for model in models:
-        model.fuse()
+# Корневая директория проекта
+PROJECT_ROOT = Path(__file__).parent.resolve()
+
+# Пути к файлам моделей и соответствующие метки
+STATIC_MODEL_PATHS = [
+    PROJECT_ROOT / "models" / "static_models" / "tree.pt",
+    PROJECT_ROOT / "models" / "static_models" / "stone.pt",
+    PROJECT_ROOT / "models" / "static_models" / "bush.pt"
+]
+STATIC_LABELS = ["tree", "stone", "bush"]
+
+def load_static_models(backend="torch", imgsz=640):
+    # Веса загружаются и объединяются (fuse) один раз за процесс через реестр,
+    # предикторы у каждого обработчика свои; ONNX-модели экспортируются с размером входа imgsz
+    models = [own_predictor(load_yolo(path, imgsz=imgsz, backend=backend)) for path in STATIC_MODEL_PATHS]
+    return models, list(STATIC_LABELS)
+
+def start_static_object_detection(input_video_path, canvas, root, output_size=(800, 600), metrics=None,
+                                  result_cache=None, detection_log=None, adaptive=None, decode_size=None):
+    models, labels = load_static_models()
 
     # Передаём размер вывода в объект процессора
-    processor = ObjectDetectionProcessor(models, labels, input_video_path, canvas, root, output_size)
+    processor = ObjectDetectionProcessor(models, labels, input_video_path, canvas, root, output_size,
+                                         decode_size=decode_size)
+    if metrics is not None:
+        processor.enable_metrics(**metrics)
+    if result_cache is not None:
+        processor.enable_result_cache(result_cache)
+    if detection_log is not None:
+        processor.enable_detection_log(detection_log)
+    if adaptive is not None:
+        processor.enable_adaptive_resolution(**adaptive)
     processor.process_video()
\ No newline at end of file
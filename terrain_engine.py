@@ -0,0 +1,196 @@
+import time
+
+import cv2
+import numpy as np
+import torch
+from torch import nn
+
+# Режимы инференса, выбираемые при загрузке модели
+EAGER = "eager"
+SCRIPT = "script"
+COMPILE = "compile"
+INT8 = "int8"
+TORCH_MODES = (EAGER, SCRIPT, COMPILE, INT8)
+# Экспортированная модель в ONNX Runtime (см. inference_backends)
+ONNX = "onnx"
+ONNX_INT8 = "onnx-int8"
+ONNX_MODES = (ONNX, ONNX_INT8)
+MODES = TORCH_MODES + ONNX_MODES
+
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+
+class TerrainInferenceEngine:
+    """CPU-инференс модели рельефа с переиспользуемыми входным и выходным буферами.
+
+    Препроцессинг выполняется одним проходом из BGR uint8 кадра прямо в
+    входной тензор формата channels_last: память такого тензора уже лежит
+    в порядке HWC, поэтому кадр копируется в него без перестановки осей, а
+    нормализация сводится к одному умножению и сложению. Порядок каналов и
+    коэффициенты нормализации совпадают с прежним путём ToTensor + Normalize.
+
+    Режимы: eager - fp32 в inference_mode; script - трассировка TorchScript
+    с заморозкой; compile - torch.compile; int8 - динамическая квантизация
+    линейных слоёв; onnx/onnx-int8 - model уже является сессией ONNX Runtime
+    (inference_backends.OnnxSegmentationModel), которой нужен обычный NCHW.
+
+    Буферы и возвращаемая infer() маска принадлежат движку, поэтому у
+    каждого обработчика свой движок: clone() создаёт его с той же
+    подготовленной моделью (prepared=True - model уже подготовлена).
+    """
+
+    def __init__(self, model, target_size=(512, 512), mode=EAGER, warmup=False, prepared=False):
+        if mode not in MODES:
+            raise ValueError(f"Unknown terrain inference mode: {mode}")
+        self.mode = mode
+        self.target_size = target_size  # (ширина, высота), как у cv2.resize
+        width, height = target_size
+
+        # (x / 255 - mean) / std = x * scale + bias
+        self._scale = torch.tensor([1.0 / (255.0 * s) for s in STD])
+        self._bias = torch.tensor([-m / s for m, s in zip(MEAN, STD)])
+        memory_format = torch.contiguous_format if mode in ONNX_MODES else torch.channels_last
+        self._input = torch.zeros((1, 3, height, width)).contiguous(memory_format=memory_format)
+        self._resized = None
+        self._mask = None
+
+        self.load_ms = 0.0
+        start = time.perf_counter()
+        self.model = model if prepared else self._prepare(model)
+        self.load_ms = (time.perf_counter() - start) * 1000
+        if warmup:
+            self.warmup()
+
+    def _prepare(self, model):
+        if self.mode in ONNX_MODES:
+            return model
+        model.eval()
+        if self.mode == INT8:
+            return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+        model = model.to(memory_format=torch.channels_last)
+        if self.mode == SCRIPT:
+            with torch.no_grad():
+                traced = torch.jit.trace(model, self._input, strict=False)
+            return torch.jit.freeze(traced.eval())
+        if self.mode == COMPILE:
+            return torch.compile(model)
+        return model
+
+    def clone(self):
+        """Движок с той же подготовленной моделью и собственными буферами."""
+        return TerrainInferenceEngine(self.model, self.target_size, self.mode, prepared=True)
+
+    @property
+    def resizable(self):
+        """Можно ли менять размер входа без повторной подготовки модели (eager и int8)."""
+        return self.mode in (EAGER, INT8)
+
+    def set_target_size(self, target_size):
+        """Новый размер входа (ширина, высота); буферы пересоздаются под него."""
+        if target_size == self.target_size:
+            return
+        if not self.resizable:
+            raise ValueError(f"Input size is fixed in {self.mode} mode")
+        width, height = target_size
+        self._input = torch.zeros((1, 3, height, width)).contiguous(memory_format=torch.channels_last)
+        self._resized = None
+        self.target_size = target_size
+
+    def warmup(self, iterations=1):
+        """Прогон на пустом кадре, чтобы первый реальный кадр не ждал ленивой инициализации."""
+        width, height = self.target_size
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            self.infer(frame)
+        return (time.perf_counter() - start) * 1000
+
+    def preprocess(self, frame):
+        """BGR uint8 кадр -> нормализованный входной тензор (переиспользуемый буфер)."""
+        width, height = self.target_size
+        if frame.shape[1] != width or frame.shape[0] != height:
+            if self._resized is None:
+                self._resized = np.empty((height, width, 3), dtype=np.uint8)
+            frame = cv2.resize(frame, (width, height), dst=self._resized, interpolation=cv2.INTER_AREA)
+
+        nhwc = self._input.permute(0, 2, 3, 1)
+        nhwc[0].copy_(torch.from_numpy(np.ascontiguousarray(frame)))
+        nhwc.mul_(self._scale).add_(self._bias)
+        return self._input
+
+    def postprocess(self, logits):
+        """Логиты (C, H, W) -> маска классов uint8 (переиспользуемый буфер)."""
+        if self._mask is None or self._mask.shape != logits.shape[1:]:
+            self._mask = torch.empty(logits.shape[1:], dtype=torch.uint8)
+        self._mask.copy_(torch.argmax(logits, dim=0))
+        return self._mask.numpy()
+
+    def infer(self, frame):
+        """Маска классов (H, W) uint8; перезаписывается следующим вызовом."""
+        with torch.inference_mode():
+            output = self.model(self.preprocess(frame))["out"][0]
+            return self.postprocess(output)
+
+
+def normalize_frame(frame, target_size=(512, 512)):
+    """BGR uint8 кадр -> новый входной массив (1, 3, H, W) float32, как TerrainInferenceEngine.preprocess."""
+    width, height = target_size
+    if frame.shape[1] != width or frame.shape[0] != height:
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    mean = np.array(MEAN, dtype=np.float32) * 255.0
+    std = np.array(STD, dtype=np.float32) * 255.0
+    normalized = (frame.astype(np.float32) - mean) / std
+    return np.ascontiguousarray(normalized.transpose(2, 0, 1)[None])
+
+
+def accuracy_latency_report(model_factory, frames, modes=TORCH_MODES, target_size=(512, 512), reference=EAGER):
+    """Сравнение режимов инференса на наборе кадров.
+
+    model_factory() должен возвращать новый экземпляр модели с весами -
+    режимы script/compile/int8 изменяют модель. Точность считается как
+    доля совпавших пикселей и средний IoU по классам относительно масок
+    режима reference.
+    """
+    results = {}
+    reference_masks = None
+    for mode in [reference] + [m for m in modes if m != reference]:
+        try:
+            engine = TerrainInferenceEngine(model_factory(), target_size=target_size, mode=mode)
+            warmup_ms = engine.warmup()
+        except Exception as e:
+            results[mode] = {"error": str(e)}
+            continue
+
+        masks, timings = [], []
+        for frame in frames:
+            start = time.perf_counter()
+            mask = engine.infer(frame)
+            timings.append((time.perf_counter() - start) * 1000)
+            masks.append(mask.copy())
+        if reference_masks is None:
+            reference_masks = masks
+
+        agreement = float(np.mean([np.mean(m == r) for m, r in zip(masks, reference_masks)]))
+        results[mode] = {
+            "load_ms": engine.load_ms,
+            "warmup_ms": warmup_ms,
+            "mean_ms": float(np.mean(timings)),
+            "p95_ms": float(np.percentile(timings, 95)),
+            "pixel_agreement": agreement,
+            "mean_iou": _mean_iou(masks, reference_masks),
+        }
+    return results
+
+
+def _mean_iou(masks, reference_masks):
+    predicted = np.stack(masks).ravel().astype(np.int64)
+    reference = np.stack(reference_masks).ravel().astype(np.int64)
+    num_classes = int(max(predicted.max(), reference.max())) + 1
+    confusion = np.bincount(reference * num_classes + predicted,
+                            minlength=num_classes * num_classes).reshape(num_classes, num_classes)
+    intersection = np.diag(confusion)
+    union = confusion.sum(0) + confusion.sum(1) - intersection
+    present = union > 0
+    return float(np.mean(intersection[present] / union[present])) if present.any() else 1.0
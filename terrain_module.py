@@ -1,108 +1,493 @@
+import time
 import cv2
 import torch
-from torchvision.transforms import ToTensor, Resize, Normalize
 import numpy as np
-from PIL import Image, ImageTk
 from torchvision.models.segmentation import deeplabv3_mobilenet_v3_large
 from pathlib import Path
+from pipeline import OFFLINE, StagedPipeline
+from playback_clock import PlaybackClock
+from terrain_engine import EAGER, ONNX_INT8, ONNX_MODES, TerrainInferenceEngine
+from model_registry import REGISTRY
+from metrics import NULL_METRICS, PerformanceMetrics
+from presenter import TkPresenter
+from columnar_log import NULL_LOG_WRITER, open_log_writer
+from frame_source import open_source
+from result_cache import NULL_CACHE_ENTRY
+
+# Классы модели рельефа в порядке выходных каналов
+TERRAIN_CLASSES = (
+    "Urban land",
+    "Agriculture land",
+    "Rangeland",
+    "Forest land",
+    "Water",
+    "Barren land",
+    "Unknown",
+)
+
+# Палитра цветов (BGR, как у кадров OpenCV): строка таблицы - цвет класса с тем же индексом
+TERRAIN_PALETTE = np.array([
+    (0, 255, 255),    # Urban land
+    (255, 255, 0),    # Agriculture land
+    (255, 0, 255),    # Rangeland
+    (0, 255, 0),      # Forest land
+    (255, 0, 64),     # Water (unknown)
+    (255, 255, 255),  # Barren land
+    (0, 0, 0),        # Unknown
+], dtype=np.uint8)
+
+# Проходимость классов для наземного робота: 1 - свободно, 0 - непроходимо
+TERRAIN_TRAVERSABILITY = np.array([
+    0.9,  # Urban land
+    0.7,  # Agriculture land
+    0.8,  # Rangeland
+    0.3,  # Forest land
+    0.0,  # Water
+    0.9,  # Barren land
+    0.5,  # Unknown
+], dtype=np.float32)
+
+
+class TerrainGrid:
+    """Грубая сетка вероятностей классов рельефа с экспоненциальным затуханием.
+
+    update(mask) за один np.bincount по маске классов (выход модели до
+    масштабирования и раскраски) считает гистограммы классов каждой ячейки
+    сетки grid_shape и долю каждого класса на кадре. Вероятности ячейки
+    обновляются как decay * старые + (1 - decay) * доли кадра; ячейки, на
+    которые не попал ни один пиксель маски, не меняются. traversability() -
+    ожидаемая проходимость ячеек по TERRAIN_TRAVERSABILITY.
+    """
+
+    def __init__(self, grid_shape=(32, 32), decay=0.8, traversability=TERRAIN_TRAVERSABILITY):
+        self.grid_shape = tuple(grid_shape)
+        self.decay = decay
+        self.costs = np.asarray(traversability, dtype=np.float32)
+        self.num_classes = len(self.costs)
+        self._cells = None
+        self.reset()
+
+    def reset(self):
+        rows, cols = self.grid_shape
+        self.probabilities = np.full((rows, cols, self.num_classes), 1.0 / self.num_classes, dtype=np.float32)
+        self.fractions = np.zeros(self.num_classes, dtype=np.float64)
+        self.updates = 0
+
+    def _cell_index(self, shape):
+        # Номер ячейки каждого пикселя, умноженный на число классов; пересчитывается при смене размера маски
+        if self._cells is None or self._cells.shape != shape:
+            rows, cols = self.grid_shape
+            row = np.arange(shape[0], dtype=np.int32) * rows // shape[0]
+            col = np.arange(shape[1], dtype=np.int32) * cols // shape[1]
+            self._cells = (row[:, None] * cols + col[None, :]) * self.num_classes
+        return self._cells
+
+    def update(self, mask):
+        """Учёт маски кадра; возвращает доли классов на кадре."""
+        rows, cols = self.grid_shape
+        counts = np.bincount((self._cell_index(mask.shape) + mask).ravel(),
+                             minlength=rows * cols * self.num_classes)
+        counts = counts[:rows * cols * self.num_classes].reshape(rows, cols, self.num_classes)
+        self.fractions = counts.sum(axis=(0, 1)) / max(mask.size, 1)
+
+        pixels = counts.sum(axis=2, keepdims=True)
+        observed = pixels[..., 0] > 0
+        frame_probabilities = counts[observed] / pixels[observed]
+        decay = self.decay if self.updates else 0.0
+        self.probabilities[observed] = decay * self.probabilities[observed] + (1 - decay) * frame_probabilities
+        self.updates += 1
+        return self.fractions
+
+    def traversability(self):
+        """Ожидаемая проходимость ячеек (rows, cols) от 0 до 1."""
+        return self.probabilities @ self.costs
+
+    def dominant(self):
+        """Наиболее вероятный класс каждой ячейки."""
+        return self.probabilities.argmax(axis=2)
+
+    def snapshot(self):
+        """Доли классов кадра и сетка проходимости в виде списков (для планировщика или JSON)."""
+        return {
+            "fractions": {name: round(float(f), 4) for name, f in zip(TERRAIN_CLASSES, self.fractions)},
+            "grid_shape": list(self.grid_shape),
+            "traversability": np.round(self.traversability(), 3).tolist(),
+        }
+
+
+class TemporalMaskReuse:
+    """Повторное использование маски рельефа на кадрах с малым движением.
+
+    Изменение сцены оценивается на уменьшенном сером кадре относительно
+    последнего ключевого кадра (на котором работала сеть): method="diff" -
+    средняя абсолютная разность яркости, method="flow" - медианный сдвиг
+    разреженного оптического потока Лукаса-Канаде в пикселях маски. Ниже
+    порога threshold сеть не запускается: маска ключевого кадра
+    возвращается как есть (diff) или сдвигается на найденный вектор (flow).
+    Каждые refresh_interval кадров инференс выполняется принудительно.
+    drift_check_interval > 0 включает контрольный полный инференс на каждом
+    N-м пропущенном кадре для оценки расхождения маски.
+    """
+
+    def __init__(self, segment, threshold=4.0, refresh_interval=10, method="diff", probe_size=(64, 64),
+                 drift_check_interval=0):
+        if method not in ("diff", "flow"):
+            raise ValueError(f"Unknown change measure: {method}")
+        self.segment = segment
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self.method = method
+        self.probe_size = probe_size
+        self.drift_check_interval = drift_check_interval
+
+        self._key_probe = None
+        self._key_points = None
+        self._key_mask = None
+        self._since_key = 0
+        self.frames = 0
+        self.inferred = 0
+        self.skipped = 0
+        self.last_change = 0.0
+        self._drift = []
+
+    def _probe(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, self.probe_size, interpolation=cv2.INTER_AREA)
+
+    def _measure_change(self, probe, mask_shape):
+        """Оценка изменения относительно ключевого кадра; для flow также сдвиг маски (dx, dy)."""
+        if self.method == "diff":
+            return float(cv2.absdiff(probe, self._key_probe).mean()), None
+
+        if self._key_points is None or len(self._key_points) < 4:
+            return float("inf"), None
+        points, status, _ = cv2.calcOpticalFlowPyrLK(self._key_probe, probe, self._key_points, None)
+        good = status.ravel() == 1
+        if good.sum() < 4:
+            return float("inf"), None
+        shift = np.median(points[good] - self._key_points[good], axis=0).ravel()
+        scale = np.array([mask_shape[1] / self.probe_size[0], mask_shape[0] / self.probe_size[1]])
+        shift = shift * scale
+        return float(np.hypot(*shift)), shift
+
+    def _keyframe(self, frame, probe):
+        self._key_mask = self.segment(frame).copy()
+        self._key_probe = probe
+        if self.method == "flow":
+            self._key_points = cv2.goodFeaturesToTrack(probe, maxCorners=50, qualityLevel=0.01, minDistance=4)
+        self._since_key = 0
+        self.inferred += 1
+        return self._key_mask
+
+    def __call__(self, frame):
+        self.frames += 1
+        probe = self._probe(frame)
+        if self._key_mask is None or self._since_key + 1 >= self.refresh_interval:
+            self.last_change = 0.0
+            return self._keyframe(frame, probe)
+
+        change, shift = self._measure_change(probe, self._key_mask.shape)
+        self.last_change = change
+        if change >= self.threshold:
+            return self._keyframe(frame, probe)
+
+        self._since_key += 1
+        self.skipped += 1
+        mask = self._key_mask
+        if shift is not None:
+            transform = np.float32([[1, 0, shift[0]], [0, 1, shift[1]]])
+            mask = cv2.warpAffine(mask, transform, (mask.shape[1], mask.shape[0]), flags=cv2.INTER_NEAREST,
+                                  borderMode=cv2.BORDER_REPLICATE)
+
+        if self.drift_check_interval and self.skipped % self.drift_check_interval == 0:
+            self._drift.append(float(np.mean(self.segment(frame) != mask)))
+        return mask
+
+    def stats(self):
+        """Доля пропущенных кадров и расхождение повторно использованных масок с полным инференсом."""
+        return {
+            "frames": self.frames,
+            "inferred": self.inferred,
+            "skipped": self.skipped,
+            "skip_ratio": self.skipped / max(self.frames, 1),
+            "drift_checks": len(self._drift),
+            "mean_drift": float(np.mean(self._drift)) if self._drift else None,
+            "max_drift": float(np.max(self._drift)) if self._drift else None,
+        }
 
 class RealTimeVideoProcessor:
-    def __init__(self, model, target_size=(512, 512), display_size=(800, 600)):
+    def __init__(self, model, target_size=(512, 512), display_size=(800, 600), policy=OFFLINE, engine=None,
+                 realtime=True):
         self.model = model
+        # Движок инференса: единый препроцессинг в переиспользуемый тензор
+        self.engine = engine or TerrainInferenceEngine(model, target_size)
         self.target_size = target_size  # Размер для обработки
         self.display_size = display_size  # Размер для отображения
+        self.policy = policy  # live - отбрасывать кадры при отставании, offline - каждый кадр
+        self.pipeline_stats = None
+        self.temporal_reuse = None  # TemporalMaskReuse, если включён инкрементальный режим
+        self.realtime = realtime  # вывод в темпе исходного видео с пропуском просроченных кадров
+        self.playback_stats = None
+        # Буферы постобработки, переиспользуемые между кадрами
+        self._buffers = {}
+        self.metrics = NULL_METRICS  # метрики по стадиям, см. enable_metrics
+        self.result_cache = None  # ResultCache для повторно открываемых видео, см. enable_result_cache
+        self.cache_stats = None
+        self.detection_log = None  # путь к журналу .rslog с масками классов, см. enable_detection_log
+        self.adaptive = None  # ResolutionController, см. enable_adaptive_resolution
+        self._held_mask = None
+        # Доли классов кадра и сетка вероятностей классов для планировщика (см. TerrainGrid)
+        self.terrain_grid = TerrainGrid()
 
-    def preprocess_frame(self, frame):
-        transform = Resize(self.target_size)
-        frame_tensor = ToTensor()(frame)
-        frame_resized = transform(frame_tensor)
-        frame_normalized = Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])(frame_resized)
-        return frame_normalized.unsqueeze(0)
+    def _buffer(self, name, shape, dtype=np.uint8):
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buffer
+        return buffer
 
-    def apply_colormap(self, mask, palette):
-        return palette[mask]
+    def apply_colormap(self, mask, palette=TERRAIN_PALETTE):
+        color_mask = self._buffer("color", mask.shape + (3,))
+        return np.take(palette, mask, axis=0, out=color_mask)
 
     def postprocess_mask(self, mask, original_size):
-        return cv2.resize(mask, original_size, interpolation=cv2.INTER_NEAREST)
+        resized = self._buffer("resized", (original_size[1], original_size[0], 3))
+        return cv2.resize(mask, original_size, dst=resized, interpolation=cv2.INTER_NEAREST)
+
+    def segment(self, frame):
+        """Маска классов (H, W) uint8 для кадра размера target_size.
+
+        Маска - представление переиспользуемого буфера и перезаписывается
+        следующим вызовом; для хранения между кадрами её нужно копировать.
+        """
+        if self.adaptive is not None:
+            return self._segment_adaptive(frame)
+        if self.temporal_reuse is not None:
+            return self.temporal_reuse(frame)
+        return self._infer(frame)
+
+    def _segment_adaptive(self, frame):
+        # На кадрах между запусками модели (шаг контроллера) держится маска последнего запуска
+        if not self.adaptive.step() and self._held_mask is not None:
+            return self._held_mask
+        size = self.adaptive.size
+        if self.engine.resizable:
+            self.engine.set_target_size((size, size))
+        start = time.perf_counter()
+        mask = self.temporal_reuse(frame) if self.temporal_reuse is not None else self._infer(frame)
+        self.adaptive.observe((time.perf_counter() - start) * 1000)
+        self._held_mask = mask.copy()
+        return self._held_mask
+
+    def _infer(self, frame):
+        # Вызов модели: при переиспользовании масок выполняется не на каждом кадре
+        start = time.perf_counter()
+        mask = self.engine.infer(frame)
+        if self.metrics.enabled:
+            self.metrics.record_model("terrain", (time.perf_counter() - start) * 1000)
+        if mask.shape != frame.shape[:2]:
+            # Уменьшенный контроллером вход: маска возвращается к размеру кадра обработки
+            mask = cv2.resize(mask, (frame.shape[1], frame.shape[0]), dst=self._buffer("mask", frame.shape[:2]),
+                              interpolation=cv2.INTER_NEAREST)
+        return mask
+
+    def enable_temporal_reuse(self, **options):
+        """Инкрементальный режим: пропуск инференса на кадрах с малым движением (см. TemporalMaskReuse)."""
+        self.temporal_reuse = TemporalMaskReuse(self._infer, **options)
+        return self.temporal_reuse
+
+    def enable_adaptive_resolution(self, target_fps, sizes=(512, 448, 384, 320, 256), strides=(1, 2, 3), **options):
+        """Размер входа модели и шаг кадров подбираются под target_fps (см. ResolutionController).
+
+        Размер входа меняется только в режимах движка eager и int8; в
+        остальных контроллер управляет только шагом кадров. Маска всегда
+        приводится к target_size, поэтому отрисовка и журнал не меняются.
+        """
+        from adaptive_resolution import ResolutionController
+        if not self.engine.resizable:
+            sizes = (self.engine.target_size[0],)
+        self.adaptive = ResolutionController("terrain", target_fps, sizes, strides,
+                                             initial=self.engine.target_size[0], **options)
+        self._held_mask = None
+        return self.adaptive
+
+    def enable_metrics(self, **options):
+        """Сбор p50/p95 по стадиям, счётчиков кадров и вызовов модели (см. PerformanceMetrics)."""
+        self.metrics = PerformanceMetrics("terrain", **options)
+        return self.metrics
+
+    def enable_detection_log(self, path):
+        """Запись маски классов каждого кадра в журнал .rslog (см. columnar_log)."""
+        self.detection_log = path
+        return path
+
+    def enable_result_cache(self, cache):
+        """Маски кадров берутся из ResultCache, если видео уже обрабатывалось с той же моделью."""
+        self.result_cache = cache
+        return cache
+
+    def _open_result_cache(self, video_path, analysis="terrain"):
+        # С адаптивным размером входа маски зависят от нагрузки оборудования и не кэшируются
+        if self.result_cache is None or self.adaptive is not None or not Path(str(video_path)).is_file():
+            return NULL_CACHE_ENTRY
+        reuse = self.temporal_reuse
+        params = {"target_size": list(self.target_size), "mode": self.engine.mode,
+                  "temporal_reuse": [reuse.threshold, reuse.refresh_interval, reuse.method]
+                  if reuse is not None else None}
+        weights = [TERRAIN_MODEL_PATH] if Path(TERRAIN_MODEL_PATH).exists() else []
+        return self.result_cache.open(video_path, analysis, weights, params)
+
+    def _segment_cached(self, cache, index, frame):
+        """Маска кадра из записи кэша или сегментация с сохранением в кэш."""
+        mask = cache.get_mask(index)
+        if mask is None:
+            mask = self.segment(frame)
+            cache.put_mask(index, mask)
+        return mask
+
+    def enable_terrain_grid(self, grid_shape=(32, 32), decay=0.8, traversability=TERRAIN_TRAVERSABILITY):
+        """Другие размер сетки, затухание или проходимость классов (см. TerrainGrid)."""
+        self.terrain_grid = TerrainGrid(grid_shape, decay, traversability)
+        return self.terrain_grid
+
+    def update_grid(self, mask):
+        """Учёт маски кадра в сетке; возвращает записи долей классов кадра."""
+        fractions = self.terrain_grid.update(mask)
+        return [{"class": name, "fraction": round(float(fraction), 4)}
+                for name, fraction in zip(TERRAIN_CLASSES, fractions)]
+
+    @staticmethod
+    def class_fractions(mask):
+        """Доля пикселей каждого класса на маске."""
+        counts = np.bincount(mask.ravel(), minlength=len(TERRAIN_CLASSES))
+        return counts / max(mask.size, 1)
 
     def process_frame(self, frame, width, height):
         """Обработка кадра с моделью."""
-        input_tensor = self.preprocess_frame(frame)
-        with torch.no_grad():
-            output = self.model(input_tensor)['out'][0]
-            output = torch.argmax(output, dim=0).cpu().numpy()
-
-        # палитра цветов
-        palette = {
-            0: (0, 255, 255),    # Urban land
-            1: (255, 255, 0),    # Agriculture land
-            2: (255, 0, 255),    # Rangeland
-            3: (0, 255, 0),      # Forest land
-            4: (255, 0, 64),     # Water (unknown)
-            5: (255, 255, 255),  # Barren land
-            6: (0, 0, 0)         # Unknown
-        }
-
-        color_mask = np.zeros((output.shape[0], output.shape[1], 3), dtype=np.uint8)
-        for class_idx, color in palette.items():
-            color_mask[output == class_idx] = color
+        return self.render(frame, self.segment(frame), width, height)
 
+    def render(self, frame, output, width, height):
+        """Наложение раскрашенной маски классов на кадр."""
+        color_mask = self.apply_colormap(output)
         segmented_mask = self.postprocess_mask(color_mask, (width, height))
-        overlay = cv2.addWeighted(frame, 0.7, segmented_mask, 0.3, 0)
+        overlay = self._buffer("overlay", segmented_mask.shape)
+        cv2.addWeighted(frame, 0.7, segmented_mask, 0.3, 0, dst=overlay)
 
         return overlay
 
-    def update_frame(self, cap, canvas, root):
-        ret, frame = cap.read()
-        if ret:
-            # Приведение кадра к размеру для обработки
-            standardized_size = self.target_size
-            frame = cv2.resize(frame, standardized_size, interpolation=cv2.INTER_AREA)
+    def standardize_frame(self, frame):
+        """Приведение кадра к размеру для обработки."""
+        return cv2.resize(frame, self.target_size, interpolation=cv2.INTER_AREA)
+
+    def update_frame(self, cap, canvas, root, cache=NULL_CACHE_ENTRY, log=NULL_LOG_WRITER):
+        """Покадровая обработка потока: чтение, сегментация и отображение в отдельных потоках."""
+        clock = PlaybackClock(cap.get(cv2.CAP_PROP_FPS))
+        presenter = TkPresenter(canvas, root, self.display_size, self.metrics)
+
+        def decode():
+            with self.metrics.stage("decode"):
+                ret, frame, timestamp = clock.read(cap, catch_up=self.realtime)
+                if not ret:
+                    return None
+                # Приведение кадра к размеру для обработки
+                frame = self.standardize_frame(frame)
+            self.metrics.frame_decoded()
+            return clock.frame_index, timestamp, frame
 
+        def infer(item):
+            index, timestamp, frame = item
             # Обработка кадра
-            height, width = standardized_size
-            processed_frame = self.process_frame(frame, width, height)
+            height, width = self.target_size
+            output = self._segment_cached(cache, index, frame)
+            with self.metrics.stage("grid"):
+                records = self.update_grid(output)
+            log.write(index, timestamp, records, mask=output, grid=self.terrain_grid.probabilities)
+            with self.metrics.stage("colorize"):
+                processed_frame = self.render(frame, output, width, height)
 
-            # Приведение кадра к размеру для отображения
-            display_frame = cv2.resize(processed_frame, self.display_size, interpolation=cv2.INTER_AREA)
+                # Приведение кадра к размеру для отображения
+                display_frame = cv2.resize(processed_frame, self.display_size, interpolation=cv2.INTER_AREA)
+            return timestamp, self.metrics.draw_hud(display_frame)
 
-            # Конвертация в изображение для Tkinter
-            img = Image.fromarray(cv2.cvtColor(display_frame, cv2.COLOR_BGR2RGB))
-            img_tk = ImageTk.PhotoImage(img)
+        def present(item):
+            timestamp, display_frame = item
+            # Конвертация в RGB для Tkinter
+            with self.metrics.stage("tk_convert"):
+                rgb = presenter.prepare(display_frame)
+            if self.realtime:
+                clock.wait(timestamp)
 
-            # Обновление изображения на холсте
-            canvas.create_image(0, 0, anchor="nw", image=img_tk)
-            canvas.image = img_tk
+            # Обновление единственного изображения на холсте в главном потоке Tk
+            presenter.post(rgb)
+            self.metrics.frame_presented(clock, pipeline)
 
-            root.after(10, self.update_frame, cap, canvas, root)
+        pipeline = StagedPipeline(decode, infer, present, policy=self.policy, name="terrain")
+        try:
+            self.pipeline_stats = pipeline.run()
+        finally:
+            self.playback_stats = clock.stats()
+            self.metrics.close()
+            cache.close()
+            self.cache_stats = cache.stats()
+            log.close()
+            presenter.close()
+            cap.release()
 
     def start_video_stream(self, video_source, canvas, root):
-        cap = cv2.VideoCapture(video_source)
-        if not cap.isOpened():
+        # Кадр уменьшается при декодировании, пока покрывает target_size: полный 4K-кадр не нужен
+        try:
+            cap = open_source(video_source, decode_size=self.target_size)
+        except Exception:
             print("Ошибка при открытии видео потока")
             return
 
-        # Размеры холста для отображения
-        canvas.config(width=self.display_size[0], height=self.display_size[1])
+        try:
+            # Размеры холста для отображения
+            canvas.config(width=self.display_size[0], height=self.display_size[1])
 
-        self.update_frame(cap, canvas, root)
+            log = open_log_writer(self.detection_log, "terrain", cap, video_source)
+            cache = self._open_result_cache(video_source)
+        except Exception:
+            # Дальше источник освобождает update_frame
+            cap.release()
+            raise
+        self.terrain_grid.reset()
+        self.update_frame(cap, canvas, root, cache, log)
+
+# Путь к весам модели рельефа
+TERRAIN_MODEL_PATH = Path(__file__).parent.resolve() / "models" / "terrain_model" / "terrain.pth"
+
+def build_terrain_engine(model_path, mode=EAGER):
+    if mode in ONNX_MODES:
+        # Экспортированная модель в ONNX Runtime (см. inference_backends.py)
+        from inference_backends import load_terrain_onnx
+        model = load_terrain_onnx(model_path, int8=mode == ONNX_INT8)
+        return TerrainInferenceEngine(model, mode=mode)
+
+    # Загружаем модель
+    model = deeplabv3_mobilenet_v3_large(num_classes=7)
+    model.load_state_dict(torch.load(model_path, map_location=torch.device('cpu')))
+    model.eval()
+
+    # Движок инференса в выбранном режиме (eager, script, compile, int8)
+    return TerrainInferenceEngine(model, mode=mode)
 
 class TerrainModelLoader:
-    def __init__(self):
-        # Определяем корневую директорию проекта
-        project_root = Path(__file__).parent.resolve()
-        
-        # Пути к модели
-        model_path = project_root / "models" / "terrain_model" / "terrain.pth"
-        
-        # Загружаем модель
-        self.model = deeplabv3_mobilenet_v3_large(num_classes=7)
-        self.model.load_state_dict(torch.load(model_path, map_location=torch.device('cpu')))
-        self.model.eval()
+    def __init__(self, mode=EAGER):
+        # Модель загружается, подготавливается и прогревается один раз за процесс через реестр;
+        # буферы движка и размер входа у каждого обработчика свои
+        shared = REGISTRY.get(
+            TERRAIN_MODEL_PATH,
+            lambda path: build_terrain_engine(path, mode),
+            tag=f"terrain-{mode}",
+            warmup=lambda engine: engine.warmup(),
+        )
+        self.engine = shared.clone()
+        self.model = self.engine.model
         
         # Инициализация обработчика видео
-        self.video_processor = RealTimeVideoProcessor(self.model)
+        self.video_processor = RealTimeVideoProcessor(self.model, engine=self.engine)
 
     def get_video_processor(self):
         # Возвращаем обработчик видео
-        return self.video_processor
\ No newline at end of file
+        return self.video_processor
@@ -1,12 +1,37 @@
 
+import os
+import tempfile
+import threading
+import time
 import unittest
 from unittest.mock import MagicMock, patch
 import cv2
 import numpy as np
 from module_mobile_object import VideoProcessor, DetectionMerger
 from static_object_detection import ObjectDetectionProcessor
-from terrain_module import RealTimeVideoProcessor
+from terrain_module import TERRAIN_CLASSES, TERRAIN_PALETTE, RealTimeVideoProcessor, TemporalMaskReuse, TerrainGrid
 from interface import VideoApp
+from model_ensemble import ModelEnsemble
+from robosight import DetectionLog, build_parser, main as robosight_main
+from pipeline import LIVE, OFFLINE, StagedPipeline
+from terrain_engine import MEAN, ONNX, STD, TerrainInferenceEngine, normalize_frame
+from keyframe_tracking import KeyframeDetector
+from playback_clock import PlaybackClock
+from model_registry import ModelRegistry, own_predictor
+from benchmarks.bench_suite import compare as compare_benchmarks
+from metrics import NULL_METRICS, PerformanceMetrics
+from track_store import EMA, KALMAN, TrackStore
+from presenter import TkPresenter
+from combined_module import CombinedProcessor
+from multistream import IoUTracker
+from parallel_offline import TrackIdReconciler, plan_segments
+from motion_gate import MotionGate
+from result_cache import ResultCache
+from columnar_log import ColumnarLog, ColumnarLogWriter
+from adaptive_resolution import ResolutionController
+from frame_source import ImageDirectorySource, PrefetchSource, open_source
+from benchmarks.synthetic import StubYOLO
+from sessions import CANCELLED, FINISHED, PENDING, RUNNING, SessionManager, current_session
 
 class TestVideoAppAndModules(unittest.TestCase):
 
@@ -105,6 +130,8 @@ class TestVideoAppAndModules(unittest.TestCase):
 
         app.process_static_video("/home/lenny/PetrSu/3_kurs/1_sem/TPPO/unitTests/RoboSight-main/tree1v.mp4", MagicMock(), MagicMock())
         mock_static_detection.assert_called()
+        # Анализ идёт по кадрам в исходном разрешении, уменьшается только показ
+        self.assertIsNone(mock_static_detection.call_args.kwargs.get("decode_size"))
 
     #@patch('terrain_module.TerrainModelLoader')
     #def test_m17_select_terrain_video_success(self, mock_terrain_loader):
@@ -137,6 +164,786 @@ class TestVideoAppAndModules(unittest.TestCase):
         app.process_terrain_video("/home/lenny/PetrSu/3_kurs/1_sem/TPPO/unitTests/RoboSight-main/tree1v.mp4", MagicMock(), MagicMock())
         app.terrain_processor.get_video_processor().start_video_stream.assert_called()
 
+    def test_m13_merge_detections_keeps_best_score(self):
+        merger = DetectionMerger(iou_threshold=0.5)
+        detections = [
+            [10, 10, 50, 50, 0.75, 1, "fox"],
+            [12, 11, 51, 49, 0.9, 2, "person"],
+            [200, 200, 240, 260, 0.8, 3, "rabbit"],
+        ]
+        merged = merger.merge_detections(detections)
+        self.assertEqual([d[5] for d in merged], [2, 3])
+
+    def test_m14_merge_detections_class_aware(self):
+        merger = DetectionMerger(iou_threshold=0.5, class_aware=True)
+        detections = [
+            [10, 10, 50, 50, 0.75, 1, "fox"],
+            [12, 11, 51, 49, 0.9, 2, "person"],
+            [11, 10, 50, 50, 0.8, 3, "fox"],
+        ]
+        merged = merger.merge_detections(detections)
+        self.assertEqual(sorted(d[5] for d in merged), [2, 3])
+
+    def test_m15_pairwise_iou_pixel_offset(self):
+        boxes = np.array([[0, 0, 9, 9], [5, 0, 14, 9]])
+        iou = DetectionMerger(pixel_offset=True).pairwise_iou(boxes)
+        self.assertAlmostEqual(float(iou[0, 1]), 50 / 150, places=5)
+        iou = DetectionMerger(pixel_offset=False).pairwise_iou(boxes)
+        self.assertAlmostEqual(float(iou[0, 1]), 36 / 126, places=5)
+
+    def test_m16_ensemble_letterbox_roundtrip(self):
+        ensemble = ModelEnsemble([], imgsz=608)
+        frame = np.zeros((720, 1280, 3), dtype=np.uint8)
+        tensor, ratio, pad = ensemble.letterbox(frame)
+        self.assertEqual(tuple(tensor.shape), (1, 3, 608, 608))
+
+        box = np.array([[100, 200, 300, 400]], dtype=np.float32)
+        letterboxed = box * ratio + np.array([pad[0], pad[1], pad[0], pad[1]], dtype=np.float32)
+        restored = ModelEnsemble.scale_boxes(letterboxed, ratio, pad, frame.shape[:2])
+        np.testing.assert_allclose(restored, box, atol=1e-3)
+
+    def test_m18_robosight_cli_arguments(self):
+        args = build_parser().parse_args(["terrain", "run.mp4", "--log", "run.csv", "--max-frames", "10"])
+        self.assertEqual((args.mode, args.input, args.log, args.max_frames), ("terrain", "run.mp4", "run.csv", 10))
+        self.assertIsNone(args.output)
+
+    def test_m19_detection_log_csv(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "log.csv")
+            log = DetectionLog(path)
+            log.write(0, 0.0, [{"class": "tree", "score": 0.9}])
+            log.write(1, 0.04, [{"class": "bush", "score": 0.8}])
+            log.close()
+            with open(path, encoding="utf-8") as file:
+                lines = file.read().splitlines()
+        self.assertEqual(lines[0], "frame,time,class,score")
+        self.assertEqual(len(lines), 3)
+
+    def test_m20_pipeline_offline_keeps_every_frame(self):
+        frames = iter(range(50))
+        presented = []
+        pipeline = StagedPipeline(lambda: next(frames, None), lambda x: x * 2, presented.append, policy=OFFLINE)
+        stats = pipeline.run()
+        self.assertEqual(presented, [x * 2 for x in range(50)])
+        self.assertEqual(stats["stages"]["decode"]["dropped"], 0)
+
+    def test_m21_pipeline_live_drops_stale_frames(self):
+        frames = iter(range(200))
+        presented = []
+
+        def slow_infer(x):
+            time.sleep(0.005)
+            return x
+
+        stats = StagedPipeline(lambda: next(frames, None), slow_infer, presented.append, policy=LIVE).run()
+        self.assertGreater(stats["stages"]["decode"]["dropped"], 0)
+        self.assertEqual(presented, sorted(presented))
+        self.assertEqual(len(presented), stats["stages"]["inference"]["items"])
+
+    def test_m22_terrain_colormap_lut(self):
+        processor = RealTimeVideoProcessor(model=MagicMock())
+        mask = np.array([[0, 1, 2], [3, 4, 6]], dtype=np.uint8)
+        color_mask = processor.apply_colormap(mask)
+        for (row, col), class_idx in np.ndenumerate(mask):
+            np.testing.assert_array_equal(color_mask[row, col], TERRAIN_PALETTE[class_idx])
+        self.assertIs(processor.apply_colormap(mask), color_mask)
+
+    def test_m23_terrain_engine_fused_preprocess(self):
+        engine = TerrainInferenceEngine(MagicMock(), target_size=(8, 4))
+        frame = np.random.default_rng(0).integers(0, 256, (4, 8, 3), dtype=np.uint8)
+        tensor = engine.preprocess(frame)
+        self.assertEqual(tuple(tensor.shape), (1, 3, 4, 8))
+        expected = (frame.transpose(2, 0, 1) / 255.0 - np.array(MEAN)[:, None, None]) / np.array(STD)[:, None, None]
+        np.testing.assert_allclose(tensor[0].numpy(), expected, atol=1e-5)
+
+    def test_m24_temporal_reuse_skips_static_frames(self):
+        segment = MagicMock(return_value=np.zeros((32, 32), dtype=np.uint8))
+        reuse = TemporalMaskReuse(segment, threshold=2.0, refresh_interval=5)
+        frame = np.full((32, 32, 3), 100, dtype=np.uint8)
+        for _ in range(10):
+            reuse(frame)
+        self.assertEqual(segment.call_count, 2)
+        self.assertAlmostEqual(reuse.stats()["skip_ratio"], 0.8)
+
+        segment.reset_mock()
+        reuse = TemporalMaskReuse(segment, threshold=2.0, refresh_interval=100)
+        reuse(frame)
+        reuse(np.full((32, 32, 3), 200, dtype=np.uint8))
+        self.assertEqual(segment.call_count, 2)
+
+    def test_m25_keyframe_detector_propagates_boxes(self):
+        rng = np.random.default_rng(0)
+        scene = cv2.GaussianBlur(rng.integers(0, 256, (400, 600), dtype=np.uint8), (5, 5), 0)
+        box = np.array([200, 150, 300, 250])
+        detect = MagicMock(return_value=[(box, "tree", 0.9, 10000)])
+        detector = KeyframeDetector(detect, interval=10, scene_change_threshold=255, probe_width=300)
+
+        for shift in range(5):
+            frame = cv2.cvtColor(np.roll(scene, 2 * shift, axis=1), cv2.COLOR_GRAY2BGR)
+            detections = detector(frame)
+
+        self.assertEqual(detect.call_count, 1)
+        np.testing.assert_allclose(detections[0][0], box + [8, 0, 8, 0], atol=2)
+        self.assertEqual(detector.stats()["keyframes"], 1)
+
+    def test_m26_playback_clock_grabs_late_frames(self):
+        cap = MagicMock()
+        cap.read.return_value = (True, np.zeros((2, 2, 3), dtype=np.uint8))
+        cap.grab.return_value = True
+        clock = PlaybackClock(fps=100)
+        clock.start()
+        clock._start -= 0.05  # обработка отстала на 5 кадров
+
+        ret, frame, pts = clock.read(cap)
+        self.assertTrue(ret)
+        self.assertEqual(cap.grab.call_count, 5)
+        self.assertAlmostEqual(pts, 0.05)
+        self.assertEqual(clock.stats()["dropped"], 5)
+
+        ret, frame, pts = clock.read(cap, catch_up=False)
+        self.assertAlmostEqual(pts, 0.06)
+        self.assertEqual(cap.grab.call_count, 5)
+        self.assertEqual(clock.frame_index, 6)
+
+    def test_m27_model_registry_caches_by_path_and_mtime(self):
+        registry = ModelRegistry()
+        factory = MagicMock(side_effect=lambda path: object())
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "model.pt")
+            with open(path, "wb") as file:
+                file.write(b"weights")
+            first = registry.get(path, factory)
+            self.assertIs(registry.get(path, factory), first)
+            self.assertEqual(factory.call_count, 1)
+
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            self.assertIsNot(registry.get(path, factory), first)
+            self.assertEqual(factory.call_count, 2)
+            self.assertEqual(len(registry.timings()), 1)
+
+    def test_m28_onnx_input_matches_engine_preprocess(self):
+        engine = TerrainInferenceEngine(MagicMock(), target_size=(8, 4), mode=ONNX)
+        frame = np.random.default_rng(1).integers(0, 256, (4, 8, 3), dtype=np.uint8)
+        tensor = engine.preprocess(frame)
+        self.assertTrue(tensor.is_contiguous())
+        np.testing.assert_allclose(normalize_frame(frame, (8, 4)), tensor.numpy(), atol=1e-5)
+
+    def test_m29_benchmark_baseline_comparison(self):
+        def results(merge_ms, draw_kib):
+            return {"configurations": {"640x360-d10": {"frames": 10, "stages": {
+                "merge": {"ms": merge_ms, "peak_kib": 10.0},
+                "draw": {"ms": 1.0, "peak_kib": draw_kib},
+                "decode": {"ms": 2.0, "peak_kib": None},
+            }}}}
+
+        baseline = results(merge_ms=1.0, draw_kib=100.0)
+        self.assertEqual(compare_benchmarks(results(1.1, 110.0), baseline, tolerance=0.2), [])
+        regressions = compare_benchmarks(results(1.5, 200.0), baseline, tolerance=0.2)
+        self.assertEqual([(r[1], r[2]) for r in regressions], [("merge", "ms"), ("draw", "peak_kib")])
+
+    def test_m30_performance_metrics_percentiles_and_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "robosight.prom")
+            metrics = PerformanceMetrics("mobile", window=10, path=path, write_interval=0)
+            for ms in range(1, 21):
+                metrics.record("decode", float(ms))
+            metrics.record_model("fox", 5.0)
+            metrics.frame_decoded()
+            clock, pipeline = MagicMock(dropped=2), MagicMock()
+            pipeline.stages = {"decode": MagicMock(dropped=1)}
+            metrics.frame_presented(clock, pipeline)
+
+            snapshot = metrics.snapshot()
+            self.assertEqual(snapshot["stages"]["decode"]["samples"], 10)
+            self.assertAlmostEqual(snapshot["stages"]["decode"]["p50_ms"], 15.5)
+            self.assertEqual(snapshot["dropped"], 3)
+            self.assertEqual(snapshot["model_calls"], {"fox": 1})
+            with open(path, encoding="utf-8") as file:
+                text = file.read()
+            self.assertIn('robosight_model_calls_total{pipeline="mobile",model="fox"} 1', text)
+
+        frame = np.zeros((4, 4, 3), dtype=np.uint8)
+        with NULL_METRICS.stage("decode"):
+            pass
+        self.assertIs(NULL_METRICS.draw_hud(frame), frame)
+
+    def test_m31_track_store_velocity_with_dropped_frames(self):
+        rng = np.random.default_rng(0)
+        for method in (KALMAN, EMA):
+            store = TrackStore(method=method)
+            timestamp = 0.0
+            for _ in range(100):
+                # Кадры 25 FPS с пропусками: шаг 1-3 кадра
+                timestamp += rng.integers(1, 4) / 25.0
+                center = (100.0 * timestamp + rng.normal(0, 0.3), 50.0 + rng.normal(0, 0.3))
+                store.next_frame()
+                store.update(7, center, timestamp)
+            self.assertAlmostEqual(store.speed(7), 100.0, delta=15.0, msg=method)
+            positions, timestamps = store.trajectory(7)
+            self.assertEqual(len(positions), store.history)
+            self.assertTrue(np.all(np.diff(timestamps) > 0))
+
+    def test_m32_track_store_soak_memory_is_flat(self):
+        # Трекер выдаёт новый id каждые 5 кадров, одновременно видно около 10 объектов
+        store = TrackStore(max_age=30)
+        processor = VideoProcessor(models=[], merger=DetectionMerger())
+        processor.tracks = store
+        frame = np.zeros((64, 64, 3), dtype=np.uint8)
+        sizes = []
+        for index in range(20000):
+            first = index // 5
+            detections = [[10, 10, 20, 20, 0.9, track_id, "fox"] for track_id in range(first, first + 10)]
+            processor.annotate(frame, detections, index / 25.0)
+            if index % 1000 == 999:
+                sizes.append((len(store), store.capacity, store.nbytes))
+        self.assertGreater(store.evicted, 3900)
+        self.assertTrue(all(size == sizes[0] for size in sizes[1:]))
+        self.assertLessEqual(len(store), 10 + 6)
+
+
+    @patch('presenter.ImageTk.PhotoImage')
+    def test_m33_presenter_reuses_single_canvas_item(self, mock_photo_image):
+        photo = mock_photo_image.return_value
+        photo.width.return_value, photo.height.return_value = 80, 60
+        canvas, root = MagicMock(), MagicMock()
+        presenter = TkPresenter(canvas, root, display_size=(80, 60))
+
+        # Три кадра до обработки очереди Tk: показан будет только последний
+        frames = [np.full((120, 160, 3), value, dtype=np.uint8) for value in (10, 20, 30)]
+        for frame in frames:
+            presenter.submit(frame)
+        self.assertEqual(root.after.call_count, 1)
+        self.assertEqual(presenter.replaced, 2)
+        flush = root.after.call_args[0][1]
+        flush()
+
+        presenter.submit(frames[0])
+        root.after.call_args[0][1]()
+        canvas.create_image.assert_called_once()
+        self.assertEqual(mock_photo_image.call_count, 1)
+        self.assertEqual(photo.paste.call_count, 1)
+        self.assertEqual(presenter.stats(), {"submitted": 4, "presented": 2, "replaced": 2})
+
+
+    def test_m34_combined_processor_rates_and_unified_record(self):
+        mobile = MagicMock()
+        mobile.detect.return_value = []
+        mobile.update_tracks.return_value = [{"id": 1, "class": "fox", "x1": 0, "y1": 0, "x2": 4, "y2": 4,
+                                              "score": 0.9, "speed": 0.0}]
+        static = ObjectDetectionProcessor([], ["tree"], None)
+        static.detect = MagicMock(return_value=[(np.array([1, 1, 5, 5]), "tree", 0.8, 16)])
+        terrain = RealTimeVideoProcessor(MagicMock(), target_size=(16, 16))
+        terrain.engine.infer = MagicMock(return_value=np.zeros((16, 16), dtype=np.uint8))
+
+        processor = CombinedProcessor(mobile, static, terrain, rates={"terrain": 3}, display_size=(80, 60))
+        frame = np.zeros((120, 160, 3), dtype=np.uint8)
+        records = []
+        for index in range(5):
+            display, record = processor.process(frame, index / 25.0)
+            records.append(record)
+
+        self.assertEqual(display.shape, (60, 80, 3))
+        self.assertEqual(mobile.detect.call_count, 5)
+        self.assertEqual(terrain.engine.infer.call_count, 2)
+        self.assertEqual([r["fresh"]["terrain"] for r in records], [True, False, False, True, False])
+        self.assertEqual(records[-1]["static"][0]["class"], "tree")
+        self.assertEqual(records[-1]["terrain"][0], {"class": TERRAIN_CLASSES[0], "fraction": 1.0})
+        self.assertIs(static.ensemble.shared_letterbox, processor.shared_letterbox)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "combined.csv")
+            log = DetectionLog(path)
+            log.write(0, 0.0, records[0])
+            log.close()
+            with open(path, encoding="utf-8") as file:
+                rows = file.read().splitlines()
+        self.assertTrue(rows[0].startswith("frame,time,analysis"))
+        self.assertEqual(len(rows), 1 + 1 + 1 + len(TERRAIN_CLASSES))
+
+    def test_m35_batched_inference_and_per_stream_ids(self):
+        models = [StubYOLO("fox", latency_ms=0, density=3, imgsz=64, seed=1)]
+        ensemble = ModelEnsemble(models, imgsz=64)
+        frames = [np.zeros((48, 64, 3), dtype=np.uint8), np.zeros((96, 64, 3), dtype=np.uint8)]
+        outputs = ensemble.predict_batch(frames)
+        ensemble.close()
+        self.assertEqual(len(outputs), 2)
+        self.assertEqual(models[0].calls, 2)
+        self.assertEqual([len(frame_outputs[0]) for frame_outputs in outputs], [3, 3])
+        # Боксы переводятся в координаты своего кадра
+        self.assertLessEqual(outputs[0][0].boxes[:, 3].max(), 47)
+
+        tracker = IoUTracker(iou_threshold=0.3, max_age=2)
+        first = tracker.update([[0, 0, 10, 10], [50, 50, 60, 60]], ["fox", "fox"])
+        second = tracker.update([[51, 51, 61, 61], [1, 1, 11, 11], [0, 0, 10, 10]], ["fox", "fox", "rabbit"])
+        self.assertEqual(list(second[:2]), [first[1], first[0]])
+        self.assertNotIn(second[2], list(first))
+
+    def test_m36_parallel_segments_and_track_id_reconciliation(self):
+        self.assertEqual(plan_segments(100, 4), [(0, 25), (25, 50), (50, 75), (75, 100)])
+        # Границы сдвигаются к ближайшим ключевым кадрам
+        self.assertEqual(plan_segments(100, 2, keyframes=[0, 30, 60, 90]), [(0, 60), (60, 100)])
+
+        def record(obj_id, x, cls="fox"):
+            return {"id": obj_id, "class": cls, "x1": x, "y1": 0, "x2": x + 10, "y2": 10}
+
+        reconciler = TrackIdReconciler()
+        reconciler.begin_segment()
+        tail = {8: reconciler.relabel([record(5, 0), record(7, 40)]),
+                9: reconciler.relabel([record(5, 1), record(7, 41)])}
+        self.assertEqual([r["id"] for r in tail[9]], [1, 2])
+
+        # Во втором сегменте трекер начал нумерацию заново, и порядок id другой
+        overlap = {8: [record(1, 40), record(2, 0)], 9: [record(1, 41), record(2, 1), record(3, 80)]}
+        reconciler.begin_segment(tail, overlap)
+        relabeled = reconciler.relabel([record(1, 42), record(2, 2), record(3, 81)])
+        self.assertEqual([r["id"] for r in relabeled], [2, 1, 3])
+        self.assertEqual((reconciler.matched, reconciler.created), (2, 3))
+
+    def test_m37_motion_gate_skips_static_frames_and_crops_motion(self):
+        gate = MotionGate(refresh_interval=0)
+        background = np.zeros((240, 320, 3), dtype=np.uint8)
+        self.assertEqual(gate.regions(background), [(0, 0, 320, 240)])
+        for _ in range(5):
+            self.assertIsNone(gate.regions(background))
+
+        frame = background.copy()
+        frame[100:140, 150:190] = 255
+        regions = gate.regions(frame)
+        self.assertEqual(len(regions), 1)
+        x1, y1, x2, y2 = regions[0]
+        self.assertTrue(x1 <= 150 and y1 <= 100 and x2 >= 190 and y2 >= 140)
+
+        stats = gate.stats()
+        self.assertEqual((stats["frames"], stats["skipped"], stats["full_frames"], stats["crop_frames"]), (7, 5, 1, 1))
+        self.assertAlmostEqual(stats["frame_ratio"], 2 / 7)
+        self.assertLess(stats["pixel_ratio"], 0.2)
+        # Фрагмент подаётся в модель с той же плотностью пикселей, что и полный кадр
+        self.assertEqual(MotionGate.input_size([(0, 0, 160, 120)], (480, 640, 3), 608), 160)
+
+    def test_m38_result_cache_roundtrip_keys_and_lru(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            video = os.path.join(tmp, "run.mp4")
+            with open(video, "wb") as file:
+                file.write(b"video-bytes")
+            cache = ResultCache(os.path.join(tmp, "cache"), max_bytes=None, chunk_frames=4)
+
+            entry = cache.open(video, "mobile", params={"conf": 0.7, "imgsz": 608})
+            entry.put_detections(0, [[1, 2, 30, 40, 0.9, 7, "fox"], [5, 5, 9, 9, 0.8, 8, "person"]])
+            entry.put_detections(1, [])
+            entry.put_detections(6, [[3, 3, 6, 6, 0.75, 9, "fox"]])
+            entry.close()
+            masks = cache.open(video, "terrain", params={"target_size": [4, 4]})
+            masks.put_mask(2, np.full((4, 4), 3, dtype=np.uint8))
+            masks.close()
+
+            entry = cache.open(video, "mobile", params={"imgsz": 608, "conf": 0.7})
+            self.assertEqual([d[:4] + d[5:] for d in entry.get_detections(0)],
+                             [[1, 2, 30, 40, 7, "fox"], [5, 5, 9, 9, 8, "person"]])
+            self.assertAlmostEqual(entry.get_detections(0)[0][4], 0.9, places=5)
+            self.assertEqual(entry.get_detections(1), [])
+            self.assertIsNone(entry.get_detections(2))
+            self.assertEqual(entry.get_detections(6)[0][6], "fox")
+            entry.close()
+            masks = cache.open(video, "terrain", params={"target_size": [4, 4]})
+            self.assertEqual(masks.get_mask(2).max(), 3)
+            masks.close()
+            # Другие параметры инференса - другая запись
+            other = cache.open(video, "mobile", params={"imgsz": 640, "conf": 0.7})
+            self.assertIsNone(other.get_detections(0))
+            other.close()
+
+            entries = cache.entries()
+            self.assertEqual(len(entries), 3)
+            keep = entries[0]["key"]
+            removed = cache.prune(max_bytes=0, keep=keep)
+            self.assertEqual(len(removed), 2)
+            self.assertEqual([e["key"] for e in cache.entries()], [keep])
+
+    def test_m39_columnar_log_roundtrip_and_frame_lookup(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "run.rslog")
+            writer = ColumnarLogWriter(path, "combined", fps=30.0, frame_size=(640, 480), source="run.mp4",
+                                       chunk_frames=2)
+            mask = np.arange(12, dtype=np.uint8).reshape(3, 4) % 7
+            writer.write(0, 0.0, {"mobile": [{"id": 3, "class": "fox", "x1": 1, "y1": 2, "x2": 30, "y2": 40,
+                                              "speed": 12.5, "score": 0.9}],
+                                  "static": [{"class": "tree", "x1": 5, "y1": 6, "x2": 50, "y2": 60,
+                                              "score": 0.8, "size": 2430}],
+                                  "terrain": {"mask_shape": [3, 4]}}, mask=mask)
+            writer.write(1, 1 / 30, {"mobile": [], "static": []})
+            writer.write(5, 5 / 30, {"mobile": [{"id": 4, "class": "person", "x1": 0, "y1": 0, "x2": 9, "y2": 9,
+                                              "speed": 0.0, "score": 0.7}], "static": []})
+            writer.close()
+
+            log = ColumnarLog(path)
+            self.assertEqual(len(log), 3)
+            self.assertEqual(log.meta["source"], "run.mp4")
+            records = log.records(0)
+            self.assertEqual(records["mobile"][0]["id"], 3)
+            self.assertEqual(records["mobile"][0]["class"], "fox")
+            self.assertEqual(records["static"][0]["size"], 2430)
+            np.testing.assert_array_equal(log.mask(0), mask)
+            self.assertIsNone(log.mask(1))
+            self.assertEqual(log.records(1), {"mobile": [], "static": []})
+            # Кадр, которого нет в журнале
+            self.assertIsNone(log.position(3))
+            self.assertEqual(log.records(5)["mobile"][0]["class"], "person")
+            table = log.table()
+            self.assertEqual(list(table["frame"]), [0, 0, 5])
+            self.assertEqual([log.classes[c] for c in table["class_id"]], ["fox", "tree", "person"])
+
+    def test_m40_resolution_controller_steps_with_hysteresis(self):
+        controller = ResolutionController("mobile", 10, sizes=(608, 416, 320), strides=(1, 2), window=3,
+                                          multiple_of=32)
+        self.assertEqual((controller.size, controller.stride), (608, 1))
+        for _ in range(3):
+            controller.observe(200)
+        self.assertEqual(controller.size, 416)
+        # Запас есть, но прогноз для 608 выше up_margin от бюджета - уровень не меняется
+        for _ in range(3):
+            self.assertFalse(controller.observe(50))
+        self.assertEqual(controller.size, 416)
+        for _ in range(3):
+            controller.observe(120)
+        for _ in range(3):
+            controller.observe(150)
+        self.assertEqual((controller.size, controller.stride), (320, 2))
+        self.assertEqual([controller.step() for _ in range(4)], [True, False, True, False])
+
+        for _ in range(3):
+            controller.observe(20)
+        self.assertEqual((controller.size, controller.stride), (320, 1))
+        for _ in range(3):
+            controller.observe(200)
+        # Неудачное повышение до (320, 1) не повторяется сразу
+        for _ in range(3):
+            controller.observe(20)
+        self.assertEqual((controller.size, controller.stride), (320, 2))
+        self.assertEqual([event["reason"] for event in controller.history],
+                         ["start", "slow", "slow", "slow", "headroom", "slow"])
+        with self.assertRaises(ValueError):
+            ResolutionController("static", 10, sizes=(600,), multiple_of=32)
+
+    def test_m41_frame_sources_stride_seek_and_reduced_decode(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for i in range(6):
+                cv2.imwrite(os.path.join(tmp, f"{i:04d}.png"), np.full((240, 320, 3), i * 40, dtype=np.uint8))
+
+            source = open_source(tmp, decode_size=(160, 100), stride=2)
+            self.assertIsInstance(source, ImageDirectorySource)
+            self.assertEqual(source.frame_size, (160, 120))
+            self.assertEqual(source.get(cv2.CAP_PROP_FRAME_COUNT), 6)
+            ret, frame = source.read()
+            self.assertEqual((ret, frame.shape, source.frame_index), (True, (120, 160, 3), 0))
+            ret, frame = source.read()
+            self.assertEqual((source.frame_index, int(frame[0, 0, 0])), (2, 80))
+            self.assertAlmostEqual(source.pts, 2 / 25.0)
+            self.assertEqual(source.stats()["skipped"], 1)
+
+            # После seek() следующий read() возвращает кадр index, дальше снова с шагом stride
+            source.seek(3)
+            self.assertEqual(source.read()[1][0, 0, 0], 120)
+            self.assertEqual(source.read()[1][0, 0, 0], 200)
+            self.assertEqual(source.read()[0], False)
+
+            source = open_source(tmp, stride=3)
+            indices = []
+            while source.read()[0]:
+                indices.append(source.frame_index)
+            self.assertEqual(indices, [0, 3])
+            source.stride = 1
+
+            # Часы берут время кадра у источника
+            clock = PlaybackClock(source.fps)
+            source.seek(3)
+            ret, frame, pts = clock.read(source, catch_up=False)
+            self.assertAlmostEqual(pts, 3 / 25.0)
+            self.assertEqual(clock.next_index, 4)
+
+            prefetch = PrefetchSource(ImageDirectorySource(tmp), depth=2)
+            indices = []
+            while True:
+                ret, frame = prefetch.read()
+                if not ret:
+                    break
+                indices.append(prefetch.frame_index)
+            prefetch.release()
+            self.assertEqual(indices, list(range(6)))
+
+            # Предвыборка сохраняет шаг внутреннего источника, в том числе при пропусках часами
+            prefetch = PrefetchSource(ImageDirectorySource(tmp, stride=2), depth=2)
+            clock = PlaybackClock(prefetch.fps)
+            clock.start()
+            clock._start -= 3 / prefetch.fps + 0.01  # обработка отстала на 3 кадра
+            ret, frame, pts = clock.read(prefetch)
+            self.assertEqual((ret, clock.frame_index, clock.dropped), (True, 4, 2))
+            self.assertEqual(prefetch.read()[0], False)
+            prefetch.release()
+
+    def test_m42_terrain_grid_decay_fractions_and_log(self):
+        grid = TerrainGrid(grid_shape=(2, 2), decay=0.5)
+        mask = np.zeros((4, 4), dtype=np.uint8)
+        mask[:, 2:] = 3  # правая половина - лес
+        fractions = grid.update(mask)
+        self.assertAlmostEqual(fractions[0], 0.5)
+        self.assertAlmostEqual(fractions[3], 0.5)
+        np.testing.assert_array_equal(grid.dominant(), [[0, 3], [0, 3]])
+        self.assertAlmostEqual(float(grid.traversability()[0, 1]), 0.3, places=5)
+
+        # Вода на всём кадре: вероятности сдвигаются наполовину
+        grid.update(np.full((4, 4), 4, dtype=np.uint8))
+        self.assertAlmostEqual(float(grid.probabilities[0, 0, 0]), 0.5)
+        self.assertAlmostEqual(float(grid.probabilities[0, 0, 4]), 0.5)
+        self.assertAlmostEqual(grid.snapshot()["fractions"]["Water"], 1.0)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "terrain.rslog")
+            writer = ColumnarLogWriter(path, "terrain")
+            records = [{"class": name, "fraction": float(f)} for name, f in zip(TERRAIN_CLASSES, fractions)]
+            writer.write(0, 0.0, records, mask=mask, grid=grid.probabilities)
+            writer.write(1, 0.04, [], mask=mask)
+            writer.close()
+            log = ColumnarLog(path)
+            np.testing.assert_allclose(log.grid(0), grid.probabilities, atol=1 / 255)
+            self.assertIsNone(log.grid(1))
+            self.assertEqual(log.fractions(0), {"Urban land": 0.5, "Agriculture land": 0.0, "Rangeland": 0.0,
+                                                "Forest land": 0.5, "Water": 0.0, "Barren land": 0.0,
+                                                "Unknown": 0.0})
+            self.assertIsNone(log.fractions(1))
+            self.assertEqual(len(log.detections(0)), 0)
+
+    def test_m43_session_cancel_releases_and_reuses_worker(self):
+        manager = SessionManager(max_workers=1)
+        released, workers = [], []
+
+        def endless(name):
+            workers.append(threading.current_thread().name)
+            current_session().add_cleanup(lambda: released.append(name))
+            pipeline = StagedPipeline(lambda: sum(range(1000)), lambda item: item, lambda result: None)
+            pipeline.run()
+
+        first = manager.submit("first", endless, "first")
+        deadline = time.time() + 2
+        while first.cpu_seconds() == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([s.name for s in manager.active()], ["first"])
+        self.assertGreater(manager.stats()[0]["cpu_s"], 0)
+
+        first.cancel()
+        self.assertTrue(first.wait(2))
+        self.assertEqual(first.state, CANCELLED)
+        self.assertEqual(released, ["first"])
+
+        second = manager.submit("second", lambda: workers.append(threading.current_thread().name))
+        self.assertTrue(second.wait(2))
+        self.assertEqual(second.state, FINISHED)
+        self.assertEqual(workers[0], workers[1])
+        self.assertEqual(manager.active(), [])
+        manager.shutdown()
+
+    def test_m44_terrain_engine_clone_has_own_buffers(self):
+        engine = TerrainInferenceEngine(MagicMock(), target_size=(8, 4))
+        clone = engine.clone()
+        self.assertIs(clone.model, engine.model)
+        self.assertIsNot(clone._input, engine._input)
+        clone.set_target_size((16, 8))
+        self.assertEqual(engine.target_size, (8, 4))
+        self.assertEqual(tuple(engine._input.shape), (1, 3, 4, 8))
+
+    def test_m45_own_predictor_shares_weights_not_trackers(self):
+        class Model:
+            def __init__(self):
+                self.model = object()
+                self.predictor = MagicMock()
+                self.callbacks = {"on_predict_start": []}
+
+        shared = Model()
+        first, second = own_predictor(shared), own_predictor(shared)
+        self.assertIs(first.model, shared.model)
+        self.assertIsNone(first.predictor)
+        first.predictor = MagicMock()
+        first.callbacks["on_predict_start"].append(print)
+        self.assertIsNone(second.predictor)
+        self.assertEqual(second.callbacks["on_predict_start"], [])
+        self.assertEqual(shared.callbacks["on_predict_start"], [])
+
+    @patch("robosight.run_headless")
+    def test_m46_cli_rejects_unsupported_option_combinations(self, mock_run_headless):
+        for extra in (["--stride", "2"], ["--decode-size", "640x360"]):
+            with patch("sys.stderr"), self.assertRaises(SystemExit):
+                robosight_main(["mobile", "run.mp4", "--workers", "4"] + extra)
+        with patch("sys.stderr"), self.assertRaises(SystemExit):
+            robosight_main(["mobile", "run.mp4", "--motion-gate", "--backend", "onnx"])
+        mock_run_headless.assert_not_called()
+
+    def test_m47_half_filled_cache_is_recomputed_whole(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            video = os.path.join(tmp, "run.mp4")
+            with open(video, "wb") as file:
+                file.write(b"video-bytes")
+            cache = ResultCache(os.path.join(tmp, "cache"), max_bytes=None, chunk_frames=4)
+            entry = cache.open(video, "mobile")
+            # Прошлый запуск в реальном времени посчитал только первую половину кадров
+            for index in range(4):
+                entry.put_detections(index, [[1, 1, 5, 5, 0.9, index + 10, "fox"]])
+            entry.close()
+
+            processor = VideoProcessor(models=[], merger=DetectionMerger())
+            processor.detect = MagicMock(side_effect=lambda frame: [[2, 2, 6, 6, 0.8, 1, "fox"]])
+            entry = cache.open(video, "mobile")
+            self.assertFalse(entry.require_complete(8))
+            for index in range(8):
+                self.assertEqual(processor._detect_cached(entry, index, None)[0][5], 1)
+            self.assertEqual(processor.detect.call_count, 8)
+            entry.close()
+
+            entry = cache.open(video, "mobile")
+            self.assertTrue(entry.require_complete(8))
+            self.assertEqual(processor._detect_cached(entry, 0, None)[0][5], 1)
+            self.assertEqual(processor.detect.call_count, 8)
+            self.assertFalse(entry.require_complete(None))
+
+    @patch('tkinter.filedialog.askopenfilename')
+    @patch('tkinter.simpledialog.askstring')
+    def test_m48_other_source_is_used_once(self, mock_askstring, mock_askopenfilename):
+        mock_askstring.return_value = " sim://run.mp4 "
+        mock_askopenfilename.return_value = "tree1v.mp4"
+        app = VideoApp(MagicMock())
+        app.select_source()
+        self.assertEqual(app.choose_source("Выберите видео"), "sim://run.mp4")
+        mock_askopenfilename.assert_not_called()
+        self.assertEqual(app.choose_source("Выберите видео"), "tree1v.mp4")
+        mock_askopenfilename.assert_called_once()
+
+    def test_m49_concurrent_sessions_cancel_one_and_share_resource_in_turn(self):
+        manager = SessionManager(max_workers=2)
+        started, released = [], []
+
+        def endless(name):
+            started.append(name)
+            current_session().add_cleanup(lambda: released.append(name))
+            StagedPipeline(lambda: sum(range(1000)), lambda item: item, lambda result: None).run()
+
+        mobile = manager.submit("mobile", endless, "mobile", resource="mobile")
+        terrain = manager.submit("terrain", endless, "terrain", resource="terrain")
+        # Второй сеанс того же обработчика ждёт первого, не занимая поток пула
+        queued = manager.submit("mobile-2", endless, "mobile-2", resource="mobile")
+        deadline = time.time() + 2
+        while len(started) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual((mobile.state, terrain.state, queued.state), (RUNNING, RUNNING, PENDING))
+
+        terrain.cancel()
+        self.assertTrue(terrain.wait(2))
+        self.assertEqual(terrain.state, CANCELLED)
+        self.assertEqual(released, ["terrain"])
+        self.assertEqual(mobile.state, RUNNING)
+        self.assertEqual(queued.state, PENDING)
+
+        mobile.cancel()
+        self.assertTrue(mobile.wait(2))
+        deadline = time.time() + 2
+        while queued.state == PENDING and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(queued.state, RUNNING)
+        self.assertEqual(released, ["terrain", "mobile"])
+        self.assertEqual([s.name for s in manager.active()], ["mobile-2"])
+        manager.shutdown()
+        self.assertEqual(queued.state, CANCELLED)
+        self.assertEqual(sorted(started[:2]), ["mobile", "terrain"])
+        self.assertEqual(started[2:], ["mobile-2"])
+
+    @patch("terrain_module.TerrainModelLoader")
+    @patch("static_object_detection.own_predictor", side_effect=lambda model: model)
+    @patch("module_mobile_object.own_predictor", side_effect=lambda model: model)
+    @patch("static_object_detection.load_yolo")
+    @patch("module_mobile_object.load_yolo")
+    def test_m50_combined_onnx_models_exported_at_shared_size(self, mobile_yolo, static_yolo, *_):
+        from combined_module import load_combined_processor
+        processor = load_combined_processor(backend="onnx")
+        self.assertTrue(all(c.kwargs["imgsz"] == 640 for c in mobile_yolo.call_args_list))
+        self.assertTrue(all(c.kwargs["imgsz"] == 640 for c in static_yolo.call_args_list))
+        self.assertEqual((processor.mobile.ensemble.imgsz, processor.static.ensemble.imgsz), (640, 640))
+
+        load_combined_processor(backend="torch")
+        self.assertEqual(mobile_yolo.call_args.kwargs["imgsz"], 608)
+
+    @patch("module_mobile_object.TkPresenter")
+    def test_m51_lagging_realtime_pass_records_every_frame(self, _):
+        with tempfile.TemporaryDirectory() as tmp:
+            video = os.path.join(tmp, "run.mp4")
+            writer = cv2.VideoWriter(video, cv2.VideoWriter_fourcc(*"mp4v"), 100, (64, 48))
+            for i in range(12):
+                writer.write(np.full((48, 64, 3), i * 20, dtype=np.uint8))
+            writer.release()
+
+            # Детектор втрое медленнее видео: без записи кэша часы пропускали бы кадры
+            processor = VideoProcessor(models=[], merger=DetectionMerger(), policy=LIVE)
+            processor.detect = MagicMock(side_effect=lambda frame: time.sleep(0.03) or [])
+            processor.enable_result_cache(ResultCache(os.path.join(tmp, "cache"), max_bytes=None))
+            processor.process_video(video, MagicMock(), MagicMock())
+            self.assertEqual(processor.detect.call_count, 12)
+            self.assertEqual(processor.playback_stats["dropped"], 0)
+
+            entry = processor._open_result_cache(video, 12)
+            self.assertTrue(entry.replay)
+            entry.close()
+
+    def test_m52_second_writer_opens_entry_read_only(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            video = os.path.join(tmp, "run.mp4")
+            with open(video, "wb") as file:
+                file.write(b"video-bytes")
+            cache = ResultCache(os.path.join(tmp, "cache"), max_bytes=None, chunk_frames=4)
+            first = cache.open(video, "mobile")
+            second = ResultCache(os.path.join(tmp, "cache"), max_bytes=None, chunk_frames=4).open(video, "mobile")
+            self.assertEqual((first.read_only, second.read_only), (False, True))
+
+            # Второй сеанс считает мимо кэша и не пишет в чужую запись
+            self.assertFalse(second.require_complete(4))
+            self.assertFalse(second.recording)
+            second.put_detections(0, [[9, 9, 19, 19, 0.5, 3, "person"]])
+            second.close()
+            for index in range(4):
+                first.put_detections(index, [[1, 1, 5, 5, 0.9, 1, "fox"]])
+            # Запись, которая сейчас пишется, не удаляется при соблюдении лимита
+            self.assertEqual(cache.prune(max_bytes=0), [])
+            first.close()
+
+            entry = cache.open(video, "mobile")
+            self.assertFalse(entry.read_only)
+            self.assertTrue(entry.require_complete(4))
+            self.assertEqual(entry.get_detections(0)[0][6], "fox")
+            entry.close()
+
+    def test_m53_onnx_ensembles_adapt_only_the_stride(self):
+        onnx_models = [MagicMock(ckpt_path="", model_name="models/fox.onnx")]
+        mobile = VideoProcessor(onnx_models, DetectionMerger())
+        mobile.ensemble.imgsz = 640
+        controller = mobile.enable_adaptive_resolution(target_fps=30)
+        self.assertEqual(controller.levels, [(640, 1), (640, 2), (640, 3)])
+
+        static = ObjectDetectionProcessor.__new__(ObjectDetectionProcessor)
+        static.ensemble = ModelEnsemble(onnx_models, imgsz=640)
+        self.assertEqual({size for size, _ in static.enable_adaptive_resolution(target_fps=30).levels}, {640})
+
+        # Модели torch по-прежнему меняют размер входа
+        torch_models = [MagicMock(ckpt_path="models/fox.pt")]
+        self.assertEqual(len(VideoProcessor(torch_models, DetectionMerger()).enable_adaptive_resolution(30).levels), 6)
+
+    def test_m54_playback_clock_reports_source_frame_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for i in range(6):
+                cv2.imwrite(os.path.join(tmp, f"{i:04d}.png"), np.zeros((8, 8, 3), dtype=np.uint8))
+            # Время кадров источника не совпадает с частотой часов: номер нельзя восстановить как pts * fps
+            clock = PlaybackClock(fps=30)
+            source = ImageDirectorySource(tmp, stride=2, fps=24)
+            indices = []
+            while clock.read(source, catch_up=False)[0]:
+                indices.append(clock.frame_index)
+            self.assertEqual(indices, [0, 2, 4])
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=2)
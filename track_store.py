@@ -0,0 +1,165 @@
+import numpy as np
+
+# Способы оценки скорости
+KALMAN = "kalman"
+EMA = "ema"
+
+
+class TrackStore:
+    """Ограниченное хранилище состояния треков на массивах.
+
+    Каждому живому id трекера выделяется слот в массивах фиксированной
+    ёмкости: кольцевая история последних history центров с временными
+    метками и состояние оценщика скорости. Трек, не встречавшийся
+    max_age кадров, удаляется, а его слот переиспользуется, поэтому
+    занимаемая память зависит от числа одновременно видимых объектов, а не
+    от числа id, выданных трекером за всё время работы.
+
+    Скорость (пикс/с) оценивается по реальным временным меткам кадров:
+    method="kalman" - фильтр Калмана с моделью постоянной скорости
+    (оси x и y независимы и имеют общую ковариацию 2x2), method="ema" -
+    экспоненциальное сглаживание мгновенной скорости.
+    """
+
+    def __init__(self, max_age=30, history=16, capacity=64, method=KALMAN, ema_alpha=0.4,
+                 process_noise=1e4, measurement_noise=4.0):
+        if method not in (KALMAN, EMA):
+            raise ValueError(f"Unknown velocity estimator: {method}")
+        self.max_age = max_age
+        self.history = history
+        self.method = method
+        self.ema_alpha = ema_alpha
+        self.process_noise = process_noise          # дисперсия ускорения, (пикс/с^2)^2
+        self.measurement_noise = measurement_noise  # дисперсия положения центра, пикс^2
+
+        self.frame_index = 0
+        self.evicted = 0
+        self._slots = {}  # id трека -> слот
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        self._free = list(range(capacity - 1, -1, -1))
+        self._last_seen = np.zeros(capacity, dtype=np.int64)
+        self._positions = np.zeros((capacity, self.history, 2), dtype=np.float32)
+        self._timestamps = np.zeros((capacity, self.history), dtype=np.float64)
+        self._length = np.zeros(capacity, dtype=np.int32)
+        self._head = np.zeros(capacity, dtype=np.int32)
+        # Оценка: положение (x, y), скорость (vx, vy) и ковариация [[pp, pv], [vp, vv]]
+        self._state = np.zeros((capacity, 4), dtype=np.float64)
+        self._covariance = np.zeros((capacity, 2, 2), dtype=np.float64)
+
+    def _grow(self):
+        old = self.capacity
+        arrays = ("_last_seen", "_positions", "_timestamps", "_length", "_head", "_state", "_covariance")
+        previous = {name: getattr(self, name) for name in arrays}
+        self._allocate(old * 2)
+        for name, array in previous.items():
+            getattr(self, name)[:old] = array
+        self._free = list(range(self.capacity - 1, old - 1, -1))
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, track_id):
+        return int(track_id) in self._slots
+
+    @property
+    def nbytes(self):
+        """Память массивов хранилища в байтах."""
+        return sum(array.nbytes for array in (self._last_seen, self._positions, self._timestamps,
+                                              self._length, self._head, self._state, self._covariance))
+
+    def next_frame(self):
+        """Переход к следующему кадру с удалением устаревших треков."""
+        self.frame_index += 1
+        if not self._slots:
+            return
+        stale = [track_id for track_id, slot in self._slots.items()
+                 if self.frame_index - self._last_seen[slot] > self.max_age]
+        for track_id in stale:
+            self._free.append(self._slots.pop(track_id))
+        self.evicted += len(stale)
+
+    def _new_slot(self, track_id, center, timestamp):
+        if not self._free:
+            self._grow()
+        slot = self._free.pop()
+        self._slots[track_id] = slot
+        self._length[slot] = 0
+        self._head[slot] = 0
+        self._state[slot] = (center[0], center[1], 0.0, 0.0)
+        self._covariance[slot] = ((self.measurement_noise, 0.0), (0.0, 1e4))
+        return slot
+
+    def update(self, track_id, center, timestamp):
+        """Новое положение центра трека; возвращает сглаженную скорость (vx, vy) в пикс/с."""
+        track_id = int(track_id)
+        slot = self._slots.get(track_id)
+        if slot is None:
+            slot = self._new_slot(track_id, center, timestamp)
+        elif self._length[slot]:
+            previous_time = self._timestamps[slot, (self._head[slot] - 1) % self.history]
+            dt = timestamp - previous_time
+            if dt > 0:
+                if self.method == KALMAN:
+                    self._kalman(slot, center, dt)
+                else:
+                    self._ema(slot, center, dt)
+
+        head = self._head[slot]
+        self._positions[slot, head] = center
+        self._timestamps[slot, head] = timestamp
+        self._head[slot] = (head + 1) % self.history
+        self._length[slot] = min(self._length[slot] + 1, self.history)
+        self._last_seen[slot] = self.frame_index
+        return self._state[slot, 2], self._state[slot, 3]
+
+    def _kalman(self, slot, center, dt):
+        state = self._state[slot]
+        (pp, pv), (vp, vv) = self._covariance[slot]
+        q = self.process_noise
+
+        # Прогноз: положение сдвигается на v*dt, неопределённость растёт с dt
+        state[0:2] += state[2:4] * dt
+        pp, pv, vp, vv = (
+            pp + dt * (pv + vp) + dt * dt * vv + q * dt ** 4 / 4,
+            pv + dt * vv + q * dt ** 3 / 2,
+            vp + dt * vv + q * dt ** 3 / 2,
+            vv + q * dt * dt,
+        )
+
+        # Коррекция по измеренному центру
+        s = pp + self.measurement_noise
+        k_position, k_velocity = pp / s, vp / s
+        innovation = np.asarray(center, dtype=np.float64) - state[0:2]
+        state[0:2] += k_position * innovation
+        state[2:4] += k_velocity * innovation
+        self._covariance[slot] = (
+            ((1 - k_position) * pp, (1 - k_position) * pv),
+            (vp - k_velocity * pp, vv - k_velocity * pv),
+        )
+
+    def _ema(self, slot, center, dt):
+        state = self._state[slot]
+        velocity = (np.asarray(center, dtype=np.float64) - state[0:2]) / dt
+        state[2:4] = self.ema_alpha * velocity + (1 - self.ema_alpha) * state[2:4]
+        state[0:2] = center
+
+    def speed(self, track_id):
+        slot = self._slots.get(int(track_id))
+        return float(np.hypot(*self._state[slot, 2:4])) if slot is not None else 0.0
+
+    def trajectory(self, track_id):
+        """История центров трека от старых к новым: (положения (N, 2), временные метки (N,))."""
+        slot = self._slots.get(int(track_id))
+        if slot is None:
+            return np.empty((0, 2), dtype=np.float32), np.empty(0)
+        length, head = self._length[slot], self._head[slot]
+        order = (np.arange(head - length, head)) % self.history
+        return self._positions[slot, order], self._timestamps[slot, order]
+
+    def clear(self):
+        self._slots.clear()
+        self._free = list(range(self.capacity - 1, -1, -1))
+        self.frame_index = 0